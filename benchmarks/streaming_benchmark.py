@@ -0,0 +1,98 @@
+'''
+Benchmark of the Python side of the streaming (polling loop, callback and
+circular buffers) using the simulated drivers, no device is needed.
+For every series and number of channels the sampling rate is doubled until
+the simulated driver starts losing samples, the last rate sustained is
+reported with what stopped the search:
+    application : samples lost while the simulator used less than
+                  SIMULATOR_BOUND of the time, the limit of the Python side
+    simulator   : samples lost while the simulator itself used most of the
+                  time producing the samples, the rate says nothing about
+                  the application
+    max rate    : no sample lost up to max_rate, the application can go
+                  faster (the rate is printed as a lower bound)
+The fraction of the time taken by the simulator at the rate reported is
+printed as well: the higher it is, the more the simulation and not the
+application sets the rate.
+
+Usage: python benchmarks/streaming_benchmark.py --duration 2
+'''
+
+import argparse
+import tempfile
+import time
+from pypicostreaming import Picoscope4000, Picoscope5000a
+from pypicostreaming.simulator import SimulatedPs4000, SimulatedPs5000a
+
+
+SIMULATOR_BOUND = 0.5 # Fraction of the trial spent by the simulator producing the samples
+
+
+def open_scope(series, driver_buffer_size):
+    if series == '5000a':
+        driver = SimulatedPs5000a(driver_buffer_size = driver_buffer_size)
+        return Picoscope5000a('PS5000A_DR_16BIT', driver = driver), driver, 'PS5000A'
+    driver = SimulatedPs4000(driver_buffer_size = driver_buffer_size)
+    return Picoscope4000(driver = driver), driver, 'PS4000'
+
+
+def run_trial(series, n_channels, rate, duration, saving_path):
+    '''
+    Stream for the given duration and return True if no sample was lost,
+    and the fraction of the time spent by the simulator producing the samples.
+    The simulated driver keeps at most 100 ms of samples waiting for a poll.
+    '''
+    interval_ns = max(1, round(1e9/rate))
+    capture_size = max(1000, int(0.05e9/interval_ns)) # 50 ms of samples in the application buffer
+    scope, driver, prefix = open_scope(series, max(2*capture_size, int(0.1e9/interval_ns)))
+    scope.set_pico(capture_size, capture_size*10, interval_ns, f'{prefix}_NS', saving_path)
+    for letter in 'ABCD'[:n_channels]:
+        scope.set_channel(f'{prefix}_CHANNEL_{letter}', f'{prefix}_1V')
+    scope.run_streaming_non_blocking(autoStop = False)
+    start = time.perf_counter()
+    time.sleep(duration)
+    scope.stop()
+    if not scope.completed_event.wait(10*duration + 10):
+        raise RuntimeError('The polling thread did not complete the acquisition.')
+    simulator_load = driver.copy_time/(time.perf_counter() - start)
+    return driver.lost_samples == 0 and scope.nextSample > 0, simulator_load
+
+
+def max_sustainable_rate(series, n_channels, duration, saving_path, start_rate = 1e4, max_rate = 1e9):
+    '''
+    Return the last rate sustained, the fraction of the time taken by the
+    simulator at that rate and what stopped the search (see above).
+    '''
+    rate = start_rate
+    sustained = 0
+    sustained_load = 0.0
+    while rate <= max_rate:
+        ok, simulator_load = run_trial(series, n_channels, rate, duration, saving_path)
+        if not ok:
+            limit = 'simulator' if simulator_load >= SIMULATOR_BOUND else 'application'
+            return sustained, sustained_load, limit
+        sustained = 1e9/max(1, round(1e9/rate)) # Rate actually used with the ns interval
+        sustained_load = simulator_load
+        rate *= 2
+    return sustained, sustained_load, 'max rate'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type = float, default = 1.0, help = 'seconds of streaming per trial')
+    parser.add_argument('--channels', type = int, nargs = '+', default = [1, 2, 4])
+    parser.add_argument('--series', nargs = '+', default = ['4000', '5000a'])
+    args = parser.parse_args()
+
+    saving_path = tempfile.mkdtemp()
+    results = []
+    for series in args.series:
+        for n_channels in args.channels:
+            results.append((series, n_channels, *max_sustainable_rate(series, n_channels, args.duration,
+                                                                      saving_path)))
+    print()
+    print(f'{"Series":>8} {"Channels":>9} {"Max rate (Sa/s per channel)":>30} {"Simulator load":>15} '
+          f'{"Limited by":>12}')
+    for series, n_channels, rate, load, limit in results:
+        rate = f'{">=" if limit == "max rate" else ""}{rate:.3g}'
+        print(f'{series:>8} {n_channels:>9} {rate:>30} {load:>15.0%} {limit:>12}')
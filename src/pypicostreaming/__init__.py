@@ -1,2 +1,38 @@
 from pypicostreaming.series4000 import Picoscope4000
-from pypicostreaming.series5000a import Picoscope5000a
\ No newline at end of file
+from pypicostreaming.series5000a import Picoscope5000a
+from pypicostreaming.writer import ChunkedWriter
+from pypicostreaming.simulator import SimulatedPs4000, SimulatedPs5000a
+from pypicostreaming.pipeline import Pipeline, Stage, FunctionStage
+from pypicostreaming.manager import AcquisitionManager
+from pypicostreaming.archive import ArchiveWriter, ArchiveReader
+from pypicostreaming.reader import RunReader, load_signal
+from pypicostreaming.trigger import EventDetector, EventStore
+from pypicostreaming.process import ProcessPicoscope
+from pypicostreaming.tracing import Tracer
+from pypicostreaming.calibration import Calibration
+from pypicostreaming.statistics import RunningStatistics, WelchPSD, StatisticsStage
+
+
+__all__ = [
+    'Picoscope4000',
+    'Picoscope5000a',
+    'ChunkedWriter',
+    'SimulatedPs4000',
+    'SimulatedPs5000a',
+    'Pipeline',
+    'Stage',
+    'FunctionStage',
+    'AcquisitionManager',
+    'ArchiveWriter',
+    'ArchiveReader',
+    'RunReader',
+    'EventDetector',
+    'EventStore',
+    'ProcessPicoscope',
+    'Tracer',
+    'Calibration',
+    'load_signal',
+    'RunningStatistics',
+    'WelchPSD',
+    'StatisticsStage',
+]
@@ -0,0 +1,291 @@
+import bz2
+import json
+import lzma
+import struct
+import zlib
+import numpy as np
+from pathlib import Path
+from pypicostreaming.calibration import Calibration, convert
+from pypicostreaming.pipeline import Stage
+
+
+ARCHIVE_MAGIC = b'PICOARC1'
+ARCHIVE_EXTENSION = '.pcarc'
+
+CODECS = {
+    'zlib' : (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'bz2'  : (lambda data, level: bz2.compress(data, level), bz2.decompress),
+    'lzma' : (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+# One row per chunk: position in the file and range of samples
+INDEX_DTYPE = np.dtype([('offset', '<u8'),
+                        ('nbytes', '<u4'),
+                        ('start', '<u8'),
+                        ('length', '<u4'),
+                        ('min', '<i2'),
+                        ('max', '<i2')])
+
+TRAILER = struct.Struct('<QQ8s') # Offset of the index, offset of the header, magic
+
+
+def encode_chunk(samples):
+    '''
+    Delta encoding (wrapping in int16, so it is always reversible) followed
+    by a byte shuffle: the low bytes and then the high bytes, that for slow
+    signals are mostly equal and compress well.
+    '''
+    delta = np.diff(samples, prepend=np.int16(0)).astype('<i2', copy=False)
+    return delta.view(np.uint8).reshape(-1, 2).T.tobytes()
+
+
+def decode_chunk(data):
+    shuffled = np.frombuffer(data, dtype=np.uint8).reshape(2, -1)
+    delta = np.ascontiguousarray(shuffled.T).view('<i2').ravel()
+    return np.cumsum(delta, dtype=np.int16)
+
+
+class ArchiveWriter:
+    def __init__(self, file_name, chunk_size = 2**16, codec = 'zlib', level = 6, scale = None, metadata = None,
+                 calibration = None):
+        '''
+        Write the raw int16 samples of a channel in a compressed archive.
+        The samples are split in chunks of chunk_size samples, each one delta
+        and byte shuffle encoded (see encode_chunk) and compressed. At the end
+        of the file an index of the chunks (offset in the file, first sample,
+        length, min and max) allows to read any range without decompressing
+        the whole file (see ArchiveReader).
+
+        Parameters:
+        file_name : str
+        chunk_size : int
+            Samples per chunk.
+        codec : str
+            'zlib', 'bz2' or 'lzma' (standard library).
+        level : int
+            Compression level of the codec.
+        scale : float
+            Factor converting the ADC numbers to physical values, saved in
+            the file (see channel_scale).
+        metadata : dict
+            Saved in the file (e.g. the metadata of the acquisition).
+        calibration : dict
+            Calibration of the channel, saved in the file and used instead of
+            scale by read_scaled: {'Calibration' : Calibration.to_dict(),
+            'Voltage range (mV)' : ..., 'Max ADC' : ...} as in the header
+            channelX.json (see channel_calibration).
+        '''
+        if codec not in CODECS:
+            raise ValueError(f'codec must be one of {list(CODECS)}')
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.level = level
+        self.scale = scale
+        self.metadata = metadata
+        self.calibration = calibration
+        self.samples_written = 0
+        self.bytes_written = 0
+        self._compress = CODECS[codec][0]
+        self._index = []
+        self._pending = [] # Samples waiting to fill a chunk
+        self._pending_size = 0
+        self._file = open(file_name, 'wb')
+        self._file.write(ARCHIVE_MAGIC)
+
+
+    def write(self, samples):
+        self._pending.append(np.array(samples, dtype=np.int16))
+        self._pending_size += len(samples)
+        if self._pending_size < self.chunk_size:
+            return
+        samples = np.concatenate(self._pending)
+        n_chunks = len(samples)//self.chunk_size
+        for i in range(n_chunks):
+            self._write_chunk(samples[i*self.chunk_size:(i + 1)*self.chunk_size])
+        rest = samples[n_chunks*self.chunk_size:]
+        self._pending = [rest]
+        self._pending_size = len(rest)
+
+
+    def _write_chunk(self, samples):
+        data = self._compress(encode_chunk(samples), self.level)
+        self._index.append((self._file.tell(),
+                            len(data),
+                            self.samples_written,
+                            len(samples),
+                            samples.min(),
+                            samples.max()))
+        self._file.write(data)
+        self.samples_written += len(samples)
+        self.bytes_written += len(data)
+
+
+    def close(self):
+        '''
+        Write the samples left, the index and the header.
+        '''
+        if self._file.closed:
+            return
+        if self._pending_size:
+            self._write_chunk(np.concatenate(self._pending))
+        self._pending = []
+        self._pending_size = 0
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+        header_offset = self._file.tell()
+        header = {
+            'Samples' : self.samples_written,
+            'Chunk size' : self.chunk_size,
+            'Codec' : self.codec,
+            'Encoding' : 'delta, byte shuffle',
+            'Data type' : 'int16',
+            'Scale' : self.scale,
+            'Calibration' : self.calibration,
+            'Metadata' : self.metadata,
+        }
+        self._file.write(json.dumps(header).encode())
+        self._file.write(TRAILER.pack(index_offset, header_offset, ARCHIVE_MAGIC))
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArchiveReader:
+    def __init__(self, file_name):
+        '''
+        Read an archive written by ArchiveWriter. Slicing (reader[a:b])
+        returns the raw samples decompressing only the chunks needed.
+        '''
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        if self._file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError(f'{file_name} is not a pico archive.')
+        self._file.seek(-TRAILER.size, 2)
+        trailer_offset = self._file.tell()
+        index_offset, header_offset, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f'{file_name} is incomplete (the writer was not closed).')
+        self._file.seek(index_offset)
+        self.index = np.frombuffer(self._file.read(header_offset - index_offset), dtype=INDEX_DTYPE)
+        header = json.loads(self._file.read(trailer_offset - header_offset))
+        self.chunk_size = header['Chunk size']
+        self.codec = header['Codec']
+        self.scale = header['Scale']
+        self.calibration = header.get('Calibration')
+        self.lut = None
+        if self.calibration is not None:
+            self.lut = Calibration.from_dict(self.calibration['Calibration']).lut(
+                self.calibration['Voltage range (mV)'], self.calibration['Max ADC'])
+        self.metadata = header['Metadata']
+        self.n_samples = header['Samples']
+        # Index from the start of the acquisition of the first sample, see save_archive
+        self.first_sample = (self.metadata or {}).get('First sample', 0)
+        self._decompress = CODECS[self.codec][1]
+
+
+    def __len__(self):
+        return self.n_samples
+
+
+    def read_chunk(self, i):
+        self._file.seek(int(self.index['offset'][i]))
+        return decode_chunk(self._decompress(self._file.read(int(self.index['nbytes'][i]))))
+
+
+    def read(self, start = 0, stop = None):
+        '''
+        Raw samples in the range [start, stop).
+        '''
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        if start >= stop:
+            return np.empty(0, dtype=np.int16)
+        first = np.searchsorted(self.index['start'], start, side='right') - 1
+        last = np.searchsorted(self.index['start'], stop, side='left')
+        samples = np.concatenate([self.read_chunk(i) for i in range(first, last)])
+        offset = int(self.index['start'][first])
+        return samples[start - offset:stop - offset]
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('Only slices are supported.')
+        start, stop, step = key.indices(self.n_samples)
+        return self.read(start, stop)[::step]
+
+
+    def read_scaled(self, start = 0, stop = None):
+        '''
+        Samples in the range [start, stop) converted with the calibration
+        saved or, without calibration, with the scale.
+        '''
+        if self.lut is not None:
+            return convert(self.read(start, stop), self.lut)
+        return np.multiply(self.read(start, stop), self.scale, dtype='float32')
+
+
+    def envelope(self):
+        '''
+        First sample, minimum and maximum of every chunk from the index,
+        without reading the data.
+        '''
+        return self.index['start'], self.index['min'], self.index['max']
+
+
+    def close(self):
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArchiveStage(Stage):
+    '''
+    Pipeline stage writing every channel (and the _MIN buffers in aggregate
+    mode) to channelX.pcarc files in saving_dir while streaming. scales
+    (channel name -> scale), calibrations (channel name -> calibration, see
+    ArchiveWriter) and metadata must be set before the first block, the
+    index of the first sample written is added to the metadata.
+    '''
+    def __init__(self, saving_dir, chunk_size = 2**16, codec = 'zlib', level = 6):
+        super().__init__('ArchiveStage', max_results=1)
+        self.saving_dir = saving_dir
+        Path(self.saving_dir).mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.level = level
+        self.scales = {}
+        self.calibrations = {}
+        self.metadata = None
+        self.writers = {}
+
+    def file_name(self, channel_name):
+        suffix = channel_name.split('_CHANNEL_')[-1]
+        return self.saving_dir + f'/channel{suffix}{ARCHIVE_EXTENSION}'
+
+    def process(self, start_sample, blocks):
+        for name, block in blocks.items():
+            if name not in self.writers:
+                self.writers[name] = ArchiveWriter(self.file_name(name),
+                                                   self.chunk_size,
+                                                   self.codec,
+                                                   self.level,
+                                                   self.scales.get(name.removesuffix('_MIN')),
+                                                   dict(self.metadata or {}, **{'First sample' : start_sample}),
+                                                   self.calibrations.get(name.removesuffix('_MIN')))
+            self.writers[name].write(block)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
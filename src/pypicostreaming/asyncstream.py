@@ -0,0 +1,101 @@
+import asyncio
+import numpy as np
+from collections import deque
+from threading import Lock, Semaphore
+
+
+class AsyncBlockStream:
+    POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, loop, queue_depth = 64, policy = 'block'):
+        '''
+        Consumer (see add_consumer) delivering the new blocks of samples to
+        an asyncio event loop as an async iterator of
+        (start_sample, {channel name : raw samples}). Created by the stream
+        method of the Picoscope classes.
+
+        Parameters:
+        loop : asyncio event loop
+            Loop of the coroutine iterating over the stream.
+        queue_depth : int
+            Maximum number of blocks waiting to be read.
+        policy : str
+            What to do when the queue is full:
+            'block'       : the callback waits for the reader, this pauses the
+                            polling of the driver (which keeps buffering the
+                            samples)
+            'drop_oldest' : discard the oldest block waiting
+            'drop_newest' : discard the new block
+        '''
+        if policy not in self.POLICIES:
+            raise ValueError(f'policy must be one of {self.POLICIES}')
+        self.loop = loop
+        self.policy = policy
+        self.dropped_blocks = 0
+        self._items = deque()
+        self._lock = Lock()
+        self._space = Semaphore(queue_depth)
+        self._queue_depth = queue_depth
+        self._ready = asyncio.Event()
+        self._finished = False # No more blocks will come from the driver
+        self._cancelled = False # The reader is gone
+
+
+    def put(self, start_sample, blocks):
+        '''
+        Called by the driver callback thread.
+        '''
+        item = (start_sample, {name: np.array(block) for name, block in blocks.items()})
+        if self.policy == 'block':
+            while not self._space.acquire(timeout=0.1):
+                if self._cancelled:
+                    return
+        with self._lock:
+            if self.policy != 'block' and len(self._items) >= self._queue_depth:
+                self.dropped_blocks += 1
+                if self.policy == 'drop_newest':
+                    return
+                self._items.popleft()
+            self._items.append(item)
+        self._notify()
+
+
+    def close(self):
+        '''
+        Called at the end of the acquisition: the iteration stops once the
+        blocks left have been read.
+        '''
+        self._finished = True
+        self._notify()
+
+
+    def cancel(self):
+        '''
+        Stop accepting blocks and release the callback if it is waiting.
+        '''
+        self._cancelled = True
+        self._space.release()
+
+
+    def _notify(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._ready.set)
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        while True:
+            self._ready.clear()
+            with self._lock:
+                if self._items:
+                    item = self._items.popleft()
+                    break
+            if self._finished:
+                raise StopAsyncIteration
+            await self._ready.wait()
+        if self.policy == 'block':
+            self._space.release()
+        return item
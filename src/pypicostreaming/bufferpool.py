@@ -0,0 +1,50 @@
+import numpy as np
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class PoolBlock :
+    channel      : str
+    data         : np.ndarray # View on the filled part of the driver buffer
+    start_sample : int        # Index of the first sample of the block in the acquisition
+    buffer       : np.ndarray
+    pool         : 'BufferPool'
+
+    def release(self):
+        '''
+        Give the buffer back to the pool. The data must not be used after.
+        '''
+        self.pool.release(self.buffer)
+
+
+class BufferPool:
+    def __init__(self, n_blocks, block_size, dtype = np.int16):
+        '''
+        Ring of preallocated buffers of block_size samples that are registered
+        in turn to the driver. A filled buffer is handed to the consumers by
+        reference and goes back to the ring only when released.
+        '''
+        if n_blocks < 2:
+            raise ValueError('A buffer pool needs at least 2 blocks.')
+        self.blocks = [np.zeros(shape=block_size, dtype=dtype) for _ in range(n_blocks)]
+        self._free = deque(self.blocks)
+
+
+    @property
+    def available(self):
+        return len(self._free)
+
+
+    def acquire(self):
+        '''
+        Return a free buffer or None if all of them are in use.
+        '''
+        try:
+            return self._free.popleft()
+        except IndexError:
+            return None
+
+
+    def release(self, buffer):
+        self._free.append(buffer)
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+# ADC number of every entry of the lookup tables: the int16 samples viewed as
+# uint16 are the indices of their entry
+LUT_ADC = np.arange(2**16, dtype=np.uint16).view(np.int16)
+
+
+class Calibration:
+    def __init__(self, polarity = 1, offset = 0.0, gain = 1.0, polynomial = None, table = None):
+        '''
+        Transfer function of a channel from the ADC numbers to the physical
+        value:
+            x = polarity*volts  (volts from the voltage range of the channel)
+            value = gain*curve(x) + offset
+        It is compiled once by lut into a table with the value of every int16
+        sample, so the conversion is a single gather (see convert) whatever
+        the curve.
+
+        Parameters:
+        polarity : int
+            1 or -1 (e.g. -1 for the potentiostat, see channel_scale).
+        offset, gain : float
+        polynomial : sequence
+            Coefficients of the curve from the highest degree, as numpy.polyval.
+        table : (x, y)
+            Points of the curve, x in increasing order. It is interpolated
+            linearly and held constant outside the points.
+        '''
+        if polarity not in (1, -1):
+            raise ValueError('polarity must be 1 or -1.')
+        if polynomial is not None and table is not None:
+            raise ValueError('The curve is either a polynomial or a table, not both.')
+        self.polarity = polarity
+        self.offset = offset
+        self.gain = gain
+        self.polynomial = None if polynomial is None else [float(c) for c in polynomial]
+        self.table = None if table is None else ([float(x) for x in table[0]], [float(y) for y in table[1]])
+        if self.table is not None and len(self.table[0]) != len(self.table[1]):
+            raise ValueError('The table must have the same number of x and y points.')
+
+
+    def lut(self, range_mv, max_adc = 32767):
+        '''
+        float32 table of the 65536 int16 values for the voltage range
+        range_mv (mV) and the ADC number max_adc of the full range.
+        '''
+        x = LUT_ADC*(self.polarity*range_mv/max_adc/1000)
+        if self.polynomial is not None:
+            x = np.polyval(self.polynomial, x)
+        elif self.table is not None:
+            x = np.interp(x, *self.table)
+        return (self.gain*x + self.offset).astype(np.float32)
+
+
+    def to_dict(self):
+        return {'Polarity' : self.polarity,
+                'Offset' : self.offset,
+                'Gain' : self.gain,
+                'Polynomial' : self.polynomial,
+                'Table' : self.table}
+
+
+    @classmethod
+    def from_dict(cls, spec):
+        '''
+        Calibration saved in the metadata of the channels with to_dict.
+        '''
+        return cls(spec['Polarity'], spec['Offset'], spec['Gain'], spec['Polynomial'], spec['Table'])
+
+
+def convert(samples, lut, out = None):
+    '''
+    Convert int16 samples with a lookup table (see Calibration.lut) in one
+    pass, optionally writing in the float32 array out.
+    '''
+    samples = np.asarray(samples)
+    if samples.dtype != np.int16:
+        raise ValueError('The samples must be int16 ADC numbers.')
+    return np.take(lut, samples.view(np.uint16), out=out, mode='clip')
+
+
+def inverse(lut, value):
+    '''
+    ADC number whose value in the lookup table is the closest to value.
+    '''
+    return int(LUT_ADC[np.argmin(np.abs(lut - value))])
@@ -0,0 +1,191 @@
+import json
+import time
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from threading import Thread, Event
+from pypicostreaming.series4000 import Picoscope4000
+from pypicostreaming.series5000a import Picoscope5000a
+
+
+class AcquisitionManager:
+    def __init__(self, saving_path):
+        '''
+        Run the streaming of several scopes together. The devices are armed
+        one after the other in a single pass and polled by one scheduler
+        thread, that sleeps until the next device is due (each one keeps its
+        own PollScheduler) instead of one polling thread per device.
+        Every block received is timestamped with the host clock
+        (time.perf_counter_ns, the same for all the devices) so that the
+        streams can be aligned afterwards (see host_times).
+
+        The scopes are configured as usual (set_pico, set_channel) after
+        being opened with open_device or registered with add_device, e.g.:
+            manager = AcquisitionManager(path)
+            pico = manager.open_device('main', '5000a', serial = b'JO123/0001')
+            pico.set_pico(..., saving_path = manager.device_path('main'))
+            ...
+            manager.run()
+
+        Parameters:
+        saving_path : str
+            Folder where the metadata of the manager and the timestamps of
+            the blocks are saved (pico_manager subfolder).
+        '''
+        self.saving_dir = saving_path + '/pico_manager'
+        Path(self.saving_dir).mkdir(parents=True, exist_ok=True)
+        self.scopes = {}
+        self.arm_times = {}   # Host time (ns) after the RunStreaming of every device
+        self.block_times = {} # Per device list of (host time (ns), first sample, number of samples)
+        self.start_time = None
+        self.start_datetime = None # Wall clock time of start, saved in the metadata
+        self.wake_event = Event() # Set by stop() to interrupt the sleep of the polling thread
+        self._thread = None
+
+
+    def open_device(self, name, series, serial = None, resolution = 'PS5000A_DR_16BIT', driver = None):
+        '''
+        Connect a device and register it with the given name.
+
+        Parameters:
+        series : str
+            '5000a' or '4000'.
+        serial : bytes
+            Serial of the device, the first device available if None.
+        resolution : str
+            Only for the 5000a series, see Picoscope5000a.
+        driver : object
+            Replacement of the picosdk module (e.g. a simulator).
+        '''
+        if series == '5000a':
+            scope = Picoscope5000a(resolution, serial, driver)
+        elif series == '4000':
+            scope = Picoscope4000(serial, driver)
+        else:
+            raise ValueError("series must be '5000a' or '4000'.")
+        return self.add_device(name, scope)
+
+
+    def add_device(self, name, scope):
+        if name in self.scopes:
+            raise ValueError(f'A device named {name} is already registered.')
+        self.scopes[name] = scope
+        return scope
+
+
+    def device_path(self, name):
+        '''
+        Suggested saving_path for the set_pico of a device.
+        '''
+        return self.saving_dir + '/' + name
+
+
+    def start(self, autoStop = True):
+        '''
+        Arm all the devices and start the polling thread.
+        '''
+        self.wake_event.clear()
+        self.start_datetime = datetime.now()
+        self.start_time = time.perf_counter_ns()
+        for name, scope in self.scopes.items():
+            scope.start_streaming(autoStop)
+            self.arm_times[name] = time.perf_counter_ns()
+            self.block_times[name] = []
+        self._thread = Thread(target=self._poll_loop)
+        self._thread.start()
+
+
+    def run(self, autoStop = True):
+        '''
+        Same as start but returns when all the acquisitions are completed.
+        '''
+        self.start(autoStop)
+        self.join()
+
+
+    def join(self, timeout = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+    def stop(self):
+        for scope in self.scopes.values():
+            if not scope.autoStopOuter:
+                scope.stop()
+        self.wake_event.set()
+
+
+    def _poll_loop(self):
+        active = dict(self.scopes)
+        due = {name : 0.0 for name in active}
+        first_error = None
+        for scope in active.values():
+            scope.poll_scheduler.reset()
+        while active:
+            for name, scope in list(active.items()):
+                if not scope.autoStopOuter:
+                    if due[name] > time.perf_counter():
+                        continue
+                    samples_before = scope.nextSample
+                    sleep_time = scope.poll_once()
+                    if scope.nextSample > samples_before:
+                        self.block_times[name].append((time.perf_counter_ns(),
+                                                       samples_before,
+                                                       scope.nextSample - samples_before))
+                    due[name] = time.perf_counter() + sleep_time
+                if scope.autoStopOuter:
+                    try:
+                        scope.complete_acquisition()
+                    except Exception as error:
+                        # The other acquisitions go on, the error is raised at the end
+                        first_error = first_error or error
+                    del active[name]
+            if active:
+                sleep_time = min(due[name] for name in active) - time.perf_counter()
+                if sleep_time > 0:
+                    self.wake_event.wait(sleep_time)
+        self.save_timestamps()
+        print('> Pico msg: All the acquisitions completed!')
+        if first_error is not None:
+            raise first_error
+
+
+    def block_timestamps(self, name):
+        '''
+        Array of the blocks received from a device, one row per block:
+        host time (ns, from the start of the acquisition), index of the first
+        sample and number of samples.
+        '''
+        timestamps = np.array(self.block_times[name], dtype=np.int64).reshape(-1, 3)
+        timestamps[:, 0] -= self.start_time
+        return timestamps
+
+
+    def host_times(self, name, sample_indices):
+        '''
+        Estimate the host time (s, from the start of the acquisition) of the
+        samples of a device, interpolating the time of arrival of the blocks.
+        '''
+        timestamps = self.block_timestamps(name)
+        last_samples = timestamps[:, 1] + timestamps[:, 2]
+        return np.interp(sample_indices, last_samples, timestamps[:, 0])*1e-9
+
+
+    def save_timestamps(self):
+        devices = {}
+        for name, scope in self.scopes.items():
+            np.save(self.saving_dir + f'/timestamps_{name}.npy', self.block_timestamps(name))
+            devices[name] = {
+                'Series' : type(scope).__name__,
+                'Device serial' : scope.serial.decode() if isinstance(scope.serial, bytes) else scope.serial,
+                'Saving folder' : scope.saving_dir,
+                'Sampling time (s)' : scope.sample_step,
+                'Arm time (s)' : (self.arm_times[name] - self.start_time)*1e-9,
+                'Samples' : scope.nextSample,
+            }
+        metadata_dict = {
+            'Starting time' : self.start_datetime.strftime("%d/%m/%Y %H:%M:%S"),
+            'Devices' : devices,
+        }
+        with open(self.saving_dir + '/metadata_manager.json', 'w') as fp:
+            json.dump(metadata_dict, fp)
@@ -0,0 +1,100 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+class StreamMonitor:
+    def __init__(self, channel_bits, driver_buffer_size, bytes_per_sample = 2,
+                 window = 1.0, max_events = 1000):
+        '''
+        Keep track of the health of a streaming run from the arguments of the
+        driver callback: voltage overflows of every channel, gaps in the
+        driver buffer indices and the rates of callbacks, samples and bytes.
+
+        Parameters:
+        channel_bits : dict
+            Channel name -> index of the bit of the channel in the overflow
+            mask passed to the callback.
+        driver_buffer_size : int
+            Size of the driver buffers (capture_size): the driver restarts
+            writing from 0 once they are full.
+        bytes_per_sample : int
+            Bytes transferred for one sample of all the buffers of all the
+            channels.
+        window : float
+            Seconds over which the recent rates are computed.
+        max_events : int
+            Maximum number of overflow and gap events kept in memory, the
+            counters keep going.
+        '''
+        self.channel_bits = channel_bits
+        self.driver_buffer_size = driver_buffer_size
+        self.bytes_per_sample = bytes_per_sample
+        self.window = window
+        self.max_events = max_events
+        self._lock = Lock() # record runs on the callback thread, stats on any thread
+        self.reset()
+
+
+    def reset(self):
+        self.callbacks = 0
+        self.samples = 0
+        self.overflow_count = {name : 0 for name in self.channel_bits}
+        self.overflow_samples = {name : [] for name in self.channel_bits}
+        self.gap_count = 0
+        self.gaps = []
+        self.expected_index = 0
+        self.start_time = time.perf_counter()
+        self._recent = deque() # (time, samples) of the callbacks in the last window
+
+
+    def record(self, sample_index, n_samples, start_index, overflow):
+        '''
+        Account for a callback of the driver. sample_index is the index (from
+        the start of the acquisition) of the first sample of the block.
+        '''
+        now = time.perf_counter()
+        self.callbacks += 1
+        self.samples += n_samples
+        if start_index != self.expected_index:
+            self.gap_count += 1
+            if len(self.gaps) < self.max_events:
+                self.gaps.append({'sample' : sample_index,
+                                  'start_index' : start_index,
+                                  'expected_index' : self.expected_index})
+        self.expected_index = (start_index + n_samples) % self.driver_buffer_size
+        if overflow:
+            for name, bit in self.channel_bits.items():
+                if overflow & (1 << bit):
+                    self.overflow_count[name] += 1
+                    if len(self.overflow_samples[name]) < self.max_events:
+                        self.overflow_samples[name].append(sample_index)
+        with self._lock:
+            self._recent.append((now, n_samples))
+            while now - self._recent[0][0] > self.window:
+                self._recent.popleft()
+
+
+    def stats(self):
+        '''
+        Counters and rates (per second) since the start, plus the sample rate
+        over the last window.
+        '''
+        now = time.perf_counter()
+        elapsed = now - self.start_time
+        with self._lock:
+            recent = sum(n for t, n in self._recent if now - t <= self.window)
+        return {
+            'elapsed' : elapsed,
+            'callbacks' : self.callbacks,
+            'samples' : self.samples,
+            'bytes' : self.samples*self.bytes_per_sample,
+            'callback_rate' : self.callbacks/elapsed if elapsed else 0.0,
+            'sample_rate' : self.samples/elapsed if elapsed else 0.0,
+            'byte_rate' : self.samples*self.bytes_per_sample/elapsed if elapsed else 0.0,
+            'recent_sample_rate' : recent/self.window,
+            'overflow_count' : dict(self.overflow_count),
+            'overflow_samples' : {name : list(samples) for name, samples in self.overflow_samples.items()},
+            'gap_count' : self.gap_count,
+            'gaps' : list(self.gaps),
+        }
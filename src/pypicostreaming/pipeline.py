@@ -0,0 +1,220 @@
+import queue
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Thread
+
+
+class Stage(ABC):
+    '''
+    Base class of the processing stages of a Pipeline. Child classes
+    implement process(start_sample, blocks), called on the worker thread with
+    the index of the first sample and a dictionary channel name -> raw samples
+    (int16) of every new block. The returned value, if not None, is appended
+    to self.results (only the last max_results are kept).
+    '''
+    def __init__(self, name = None, max_results = 1000):
+        self.name = name if name is not None else type(self).__name__
+        self.results = deque(maxlen=max_results)
+
+    @abstractmethod
+    def process(self, start_sample, blocks):
+        pass
+
+    def close(self): # noqa: B027 (optional hook, called when the pipeline is closed)
+        pass
+
+
+class FunctionStage(Stage):
+    '''
+    Stage calling function(start_sample, blocks).
+    '''
+    def __init__(self, function, name = None, max_results = 1000):
+        super().__init__(name if name is not None else function.__name__, max_results)
+        self.function = function
+
+    def process(self, start_sample, blocks):
+        return self.function(start_sample, blocks)
+
+
+class RMSStage(Stage):
+    '''
+    RMS value (ADC units) of every channel for each block.
+    '''
+    def process(self, start_sample, blocks):
+        return start_sample, {name: float(np.sqrt(np.mean(np.square(block, dtype=np.float64))))
+                              for name, block in blocks.items()}
+
+
+class ThresholdStage(Stage):
+    '''
+    Indices of the samples where a channel crosses the threshold (ADC units)
+    upward. Only blocks with at least one crossing produce a result.
+    '''
+    def __init__(self, channel, threshold, name = None, max_results = 1000):
+        super().__init__(name, max_results)
+        self.channel = channel
+        self.threshold = threshold
+        self._last = None
+
+    def process(self, start_sample, blocks):
+        above = blocks[self.channel] >= self.threshold
+        crossings = np.flatnonzero(above[1:] & ~above[:-1]) + 1
+        if self._last is False and len(above) and above[0]:
+            crossings = np.concatenate(([0], crossings))
+        if len(above):
+            self._last = bool(above[-1])
+        if len(crossings):
+            return start_sample + crossings
+
+
+class FFTStage(Stage):
+    '''
+    Magnitude of the spectrum of the last n_fft samples of a channel, with a
+    Hann window. A result is produced every time n_fft new samples arrive:
+    all the segments completed by a block are transformed with a single
+    2-D rfft and added to the results in order.
+    '''
+    def __init__(self, channel, n_fft = 4096, name = None, max_results = 100):
+        super().__init__(name, max_results)
+        self.channel = channel
+        self.n_fft = n_fft
+        self.window = np.hanning(n_fft)
+        self._pending = np.empty(0, dtype=np.int16)
+
+    def process(self, start_sample, blocks):
+        self._pending = np.concatenate((self._pending, blocks[self.channel]))
+        n_segments = len(self._pending)//self.n_fft
+        if not n_segments:
+            return None
+        segments = self._pending[:n_segments*self.n_fft].reshape(n_segments, self.n_fft)
+        self._pending = self._pending[n_segments*self.n_fft:].copy()
+        self.results.extend(np.abs(np.fft.rfft(segments*self.window, axis=1)))
+        return None
+
+
+class FIRFilterStage(Stage):
+    '''
+    Filter a channel with the given FIR coefficients, keeping the state
+    between blocks so that the output is continuous.
+    '''
+    def __init__(self, channel, coefficients, name = None, max_results = 100):
+        super().__init__(name, max_results)
+        self.channel = channel
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self._state = np.zeros(len(self.coefficients) - 1)
+
+    def process(self, start_sample, blocks):
+        data = np.concatenate((self._state, blocks[self.channel]))
+        if len(self._state):
+            self._state = data[-len(self._state):]
+        return start_sample, np.convolve(data, self.coefficients, mode='valid')
+
+
+class Pipeline:
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, stages = (), queue_depth = 64, policy = 'drop_oldest'):
+        '''
+        Run processing stages on the new blocks of samples outside of the
+        driver callback. Register it with scope.add_consumer(pipeline): the
+        callback only copies the blocks into a bounded queue and a worker
+        thread feeds them to every stage in order of registration.
+
+        Parameters:
+        stages : list of Stage
+        queue_depth : int
+            Maximum number of blocks waiting to be processed.
+        policy : str
+            What to do when the queue is full:
+            'drop_oldest' : discard the oldest block waiting
+            'drop_newest' : discard the new block
+            'block'       : wait for a free place, this pauses the polling of
+                            the driver (which keeps buffering the samples)
+        '''
+        if policy not in self.POLICIES:
+            raise ValueError(f'policy must be one of {self.POLICIES}')
+        self.stages = list(stages)
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.dropped_blocks = 0
+        self.max_queue_depth = 0
+        self._latency = {}
+        self._thread = Thread(target=self._work_loop, daemon=True)
+        self._thread.start()
+
+
+    def add_stage(self, stage):
+        self.stages.append(stage)
+        return stage
+
+
+    def put(self, start_sample, blocks):
+        '''
+        Called by the driver callback: queue a copy of the new blocks.
+        '''
+        item = (start_sample, {name: np.array(block) for name, block in blocks.items()})
+        if self.policy == 'block':
+            self.queue.put(item)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    self.dropped_blocks += 1
+                    if self.policy == 'drop_newest':
+                        break
+                    try:
+                        self.queue.get_nowait()
+                    except queue.Empty:
+                        pass
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+
+    def close(self):
+        '''
+        Process the blocks left in the queue and stop the worker thread.
+        '''
+        if not self._thread.is_alive():
+            return
+        self.queue.put(None)
+        self._thread.join()
+        for stage in self.stages:
+            stage.close()
+
+
+    def _work_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            start_sample, blocks = item
+            for stage in self.stages:
+                t0 = time.perf_counter()
+                try:
+                    result = stage.process(start_sample, blocks)
+                except Exception as error:
+                    print(f'> Pico msg: error in the stage {stage.name}: {error!r}')
+                    result = None
+                latency = time.perf_counter() - t0
+                calls, total, maximum = self._latency.get(stage.name, (0, 0.0, 0.0))
+                self._latency[stage.name] = (calls + 1, total + latency, max(maximum, latency))
+                if result is not None:
+                    stage.results.append(result)
+
+
+    def stats(self):
+        '''
+        Queue depth, dropped blocks and latency (seconds) of every stage.
+        '''
+        return {
+            'queue_depth' : self.queue.qsize(),
+            'max_queue_depth' : self.max_queue_depth,
+            'dropped_blocks' : self.dropped_blocks,
+            'stages' : {name: {'calls' : calls,
+                               'mean_latency' : total/calls,
+                               'max_latency' : maximum}
+                        for name, (calls, total, maximum) in self._latency.items()},
+        }
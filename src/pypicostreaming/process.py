@@ -0,0 +1,239 @@
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from threading import Thread
+from pypicostreaming.ringbuffer import RingBuffer
+from pypicostreaming.calibration import convert
+
+
+COUNTER_SIZE = 8 # Bytes of the shared counter of written samples before the data
+
+
+class SharedRingBuffer(RingBuffer):
+    '''
+    RingBuffer stored in a multiprocessing shared memory block, together
+    with its counter of the samples written, so that another process can
+    take snapshots of it (see RingBuffer.snapshot) without copies. Only the
+    process that created it writes in it.
+    '''
+    def __init__(self, shm, capacity, dtype = np.int16, writer = True):
+        self.shm = shm
+        self._writer = writer
+        self._counter = np.ndarray(1, dtype=np.int64, buffer=shm.buf)
+        data = np.ndarray(capacity, dtype=dtype, buffer=shm.buf, offset=COUNTER_SIZE)
+        super().__init__(capacity, dtype, data)
+
+    @property
+    def written(self):
+        return int(self._counter[0])
+
+    @written.setter
+    def written(self, value):
+        if self._writer:
+            self._counter[0] = value
+
+    @classmethod
+    def create(cls, capacity, dtype = np.int16):
+        shm = shared_memory.SharedMemory(create=True, size=COUNTER_SIZE + capacity*np.dtype(dtype).itemsize)
+        return cls(shm, capacity, dtype)
+
+    @classmethod
+    def attach(cls, name, capacity, dtype = np.int16):
+        # The child processes share the resource tracker of the parent, that
+        # unlinks the block only when the process that created it does
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, capacity, dtype, writer=False)
+
+    def descriptor(self):
+        return self.shm.name, self.capacity, self.data.dtype.str
+
+    def close(self, unlink = False):
+        self._counter = None
+        self.data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass # Views of the samples are still in use, the memory is released with them
+        if unlink:
+            self.shm.unlink()
+
+
+def _scope_class(series):
+    # Imported in the child process only
+    if series == '5000a':
+        from pypicostreaming.series5000a import Picoscope5000a as base
+    elif series == '4000':
+        from pypicostreaming.series4000 import Picoscope4000 as base
+    else:
+        raise ValueError("series must be '5000a' or '4000'.")
+
+    class SharedMemoryPicoscope(base):
+        def set_pico(self, *args, **kwargs):
+            if kwargs.get('buffer_pool') or kwargs.get('interleaved') or kwargs.get('memmap'):
+                raise ValueError('The process mode stores the channels only in shared memory rings.')
+            for ring in getattr(self, 'shared_rings', {}).values():
+                ring.close(unlink=True)
+            self.shared_rings = {}
+            return super().set_pico(*args, **kwargs)
+
+        def _make_total_buffer(self, file_name):
+            ring = SharedRingBuffer.create(self.capture_size*self.number_captures)
+            # 'channelA.npy' -> 'A', 'channelA_MIN.npy' -> 'A_MIN'
+            self.shared_rings[file_name[len('channel'):-len('.npy')]] = ring
+            return ring
+
+    return SharedMemoryPicoscope
+
+
+def _child_main(conn, series, args, kwargs, finished):
+    '''
+    Process running the scope: executes the commands of the proxy.
+    '''
+    try:
+        scope = _scope_class(series)(*args, **kwargs)
+    except Exception as error:
+        conn.send(('error', error))
+        return
+    conn.send(('ok', None))
+    while True:
+        name, call_args, call_kwargs = conn.recv()
+        if name == '_exit':
+            break
+        try:
+            if name == '_run_streaming':
+                finished.clear()
+                scope.start_streaming(*call_args)
+                def get_data():
+                    scope.get_data_loop()
+                    finished.set()
+                Thread(target=get_data).start()
+                result = None
+            elif name == '_rings':
+                result = {key : ring.descriptor() + (scope.channel_scale(scope.channels[key[0]]),
+                                                     scope.channels[key[0]].lut)
+                          for key, ring in scope.shared_rings.items()}
+            else:
+                result = getattr(scope, name)(*call_args, **call_kwargs)
+            conn.send(('ok', result))
+        except Exception as error:
+            conn.send(('error', error))
+    for ring in getattr(scope, 'shared_rings', {}).values():
+        ring.close(unlink=True)
+    conn.send(('ok', None))
+
+
+class ProcessPicoscope:
+    def __init__(self, series, *args, **kwargs):
+        '''
+        Run a Picoscope5000a (series = '5000a') or Picoscope4000 ('4000') in
+        a dedicated process, so that the polling of the driver does not share
+        the GIL with the computations of this process. The buffer of every
+        channel is a SharedRingBuffer: snapshot and get_all_signals read it
+        without copies between the processes. The other methods of the
+        scope (set_pico, set_channel, stop, polling_statistics...) are
+        called in the child process with the same arguments.
+        args and kwargs are passed to the constructor of the scope (e.g.
+        resolution, serial, driver, which must be picklable).
+        '''
+        context = multiprocessing.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self.finished = context.Event()
+        self.rings = {}
+        self.scales = {}
+        self.luts = {}
+        self._process = context.Process(target=_child_main,
+                                        args=(child_conn, series, args, kwargs, self.finished),
+                                        daemon=True)
+        self._process.start()
+        self._receive()
+
+
+    def _receive(self):
+        status, result = self._conn.recv()
+        if status == 'error':
+            raise result
+        return result
+
+
+    def _call(self, name, *args, **kwargs):
+        self._conn.send((name, args, kwargs))
+        return self._receive()
+
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+
+    def set_pico(self, *args, **kwargs):
+        self._close_rings()
+        return self._call('set_pico', *args, **kwargs)
+
+
+    def set_channel(self, *args, **kwargs):
+        result = self._call('set_channel', *args, **kwargs)
+        for key, (name, capacity, dtype, scale, lut) in self._call('_rings').items():
+            if key not in self.rings:
+                self.rings[key] = SharedRingBuffer.attach(name, capacity, dtype)
+                self.scales[key] = scale
+                self.luts[key] = lut
+        return result
+
+
+    def run_streaming_non_blocking(self, autoStop = True):
+        self._call('_run_streaming', autoStop)
+
+
+    def run_streaming_blocking(self, autoStop = True):
+        self._call('_run_streaming', autoStop)
+        self.finished.wait()
+
+
+    def snapshot(self, n = None, start = None, stop = None):
+        '''
+        Same as the snapshot of the scope, the samples are read-only views of
+        the shared memory.
+        '''
+        if start is None:
+            stop = min(ring.written for ring in self.rings.values())
+            start = max(0, stop - (min(ring.capacity for ring in self.rings.values()) if n is None else n))
+        signals = {}
+        for key, ring in self.rings.items():
+            start, signals[key] = ring.snapshot(start=start, stop=stop)
+        return start, signals
+
+
+    def snapshot_valid(self, start):
+        return all(ring.is_valid(start) for ring in self.rings.values())
+
+
+    def get_all_signals(self):
+        '''
+        Convert the samples not read yet of all the channels (not the _MIN
+        buffers) as the get_all_signals of the scope.
+        '''
+        return tuple(np.multiply(ring.empty(), self.scales[key], dtype = 'float32') if self.luts[key] is None
+                     else convert(ring.empty(), self.luts[key])
+                     for key, ring in self.rings.items() if not key.endswith('_MIN'))
+
+
+    def _close_rings(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        self.scales = {}
+        self.luts = {}
+
+
+    def close(self):
+        '''
+        Release the shared memory and terminate the child process (the device
+        is not disconnected, call disconnect before).
+        '''
+        if not self._process.is_alive():
+            return
+        self._close_rings()
+        self._conn.send(('_exit', (), {}))
+        self._receive()
+        self._process.join()
@@ -0,0 +1,164 @@
+import numpy as np
+from threading import Lock
+
+
+class _GrowingArray:
+    # 1-D array doubling its capacity when full, appends are amortized O(1)
+    def __init__(self, dtype, capacity = 1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, values):
+        if self.size + len(values) > len(self.data):
+            data = np.empty(max(2*len(self.data), self.size + len(values)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def values(self):
+        return self.data[:self.size]
+
+
+class MinMaxPyramid:
+    def __init__(self, factor = 8, levels = 8):
+        '''
+        Level of detail index of one channel: level l holds the minimum,
+        maximum and mean of consecutive bins of factor**(l + 1) samples.
+        It is updated block by block with vectorized reductions and allows to
+        plot any range of the signal in O(pixels) with envelope, without
+        reading the raw samples. The samples of an incomplete bin are kept
+        aside until the bin is complete.
+
+        Parameters:
+        factor : int
+            Decimation between two consecutive levels.
+        levels : int
+            Number of levels, the coarsest bins are factor**levels samples.
+        '''
+        if factor < 2:
+            raise ValueError('factor must be at least 2.')
+        self.factor = factor
+        self.levels = levels
+        self.n_samples = 0
+        self.mins = [_GrowingArray(np.int16) for _ in range(levels)]
+        self.maxs = [_GrowingArray(np.int16) for _ in range(levels)]
+        self.means = [_GrowingArray(np.float32) for _ in range(levels)]
+        empty = (np.empty(0, np.int16), np.empty(0, np.int16), np.empty(0, np.float32))
+        self._pending = [empty]*levels # Values not yet reduced at every level
+        self._lock = Lock()
+
+
+    def bin_size(self, level):
+        return self.factor**(level + 1)
+
+
+    def push(self, block):
+        block = np.asarray(block)
+        # The samples are the bins of size 1 of the level below the first
+        low, high, mean = block, block, block
+        with self._lock:
+            self.n_samples += len(block)
+            for level in range(self.levels):
+                pending = self._pending[level]
+                if len(pending[0]):
+                    low = np.concatenate((pending[0], low))
+                    high = np.concatenate((pending[1], high))
+                    mean = np.concatenate((pending[2], mean))
+                n_full = len(low)//self.factor*self.factor
+                self._pending[level] = (low[n_full:].astype(np.int16, copy=True),
+                                        high[n_full:].astype(np.int16, copy=True),
+                                        mean[n_full:].astype(np.float32, copy=True))
+                if n_full == 0:
+                    break
+                low = low[:n_full].reshape(-1, self.factor).min(axis=1)
+                high = high[:n_full].reshape(-1, self.factor).max(axis=1)
+                mean = mean[:n_full].reshape(-1, self.factor).mean(axis=1, dtype=np.float32)
+                self.mins[level].append(low)
+                self.maxs[level].append(high)
+                self.means[level].append(mean)
+
+
+    def envelope(self, start, stop, pixels):
+        '''
+        Return (first sample, minimum, maximum, mean) of at most pixels bins
+        covering the samples [start, stop), taken from the coarsest level
+        with at least one bin per pixel.
+        '''
+        with self._lock:
+            stop = min(stop, self.n_samples)
+            samples_per_pixel = max(1, (stop - start)/pixels)
+            level = 0
+            while level + 1 < self.levels and self.bin_size(level + 1) <= samples_per_pixel:
+                level += 1
+            size = self.bin_size(level)
+            n_bins = min(self.mins[level].size, self.maxs[level].size, self.means[level].size)
+            first = min(start//size, n_bins)
+            last = min(-(-stop//size), n_bins)
+            low = self.mins[level].values()[first:last]
+            high = self.maxs[level].values()[first:last]
+            mean = self.means[level].values()[first:last]
+        positions = (first + np.arange(last - first))*size
+        if last - first <= pixels:
+            return positions, low.copy(), high.copy(), mean.copy()
+        edges = np.unique(np.linspace(0, last - first, pixels, endpoint=False).astype(np.intp))
+        counts = np.diff(np.append(edges, last - first))
+        return (positions[edges],
+                np.minimum.reduceat(low, edges),
+                np.maximum.reduceat(high, edges),
+                (np.add.reduceat(mean, edges, dtype=np.float64)/counts).astype(np.float32))
+
+
+    def save(self, file_name):
+        arrays = {'factor' : self.factor, 'n_samples' : self.n_samples}
+        for level in range(self.levels):
+            arrays[f'min_{level}'] = self.mins[level].values()
+            arrays[f'max_{level}'] = self.maxs[level].values()
+            arrays[f'mean_{level}'] = self.means[level].values()
+        np.savez(file_name, **arrays)
+
+
+    @classmethod
+    def load(cls, file_name):
+        '''
+        Pyramid saved with save, e.g. channelX_lod.npz next to the channel
+        data (the samples of the incomplete bins are not saved).
+        '''
+        with np.load(file_name) as arrays:
+            levels = len([key for key in arrays.files if key.startswith('min_')])
+            pyramid = cls(int(arrays['factor']), levels)
+            pyramid.n_samples = int(arrays['n_samples'])
+            for level in range(levels):
+                pyramid.mins[level].append(arrays[f'min_{level}'])
+                pyramid.maxs[level].append(arrays[f'max_{level}'])
+                pyramid.means[level].append(arrays[f'mean_{level}'])
+        return pyramid
+
+
+class PyramidIndex:
+    def __init__(self, saving_dir, factor = 8, levels = 8):
+        '''
+        Consumer (see add_consumer) updating a MinMaxPyramid per channel at
+        every callback. At the end of the acquisition they are saved in
+        saving_dir as channelX_lod.npz.
+        '''
+        self.saving_dir = saving_dir
+        self.factor = factor
+        self.levels = levels
+        self.pyramids = {}
+
+
+    def file_name(self, channel_name):
+        return self.saving_dir + f'/channel{channel_name.split("_CHANNEL_")[-1]}_lod.npz'
+
+
+    def put(self, start_sample, blocks):
+        for name, block in blocks.items():
+            if name not in self.pyramids:
+                self.pyramids[name] = MinMaxPyramid(self.factor, self.levels)
+            self.pyramids[name].push(block)
+
+
+    def close(self):
+        for name, pyramid in self.pyramids.items():
+            pyramid.save(self.file_name(name))
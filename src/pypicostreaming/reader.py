@@ -0,0 +1,207 @@
+import json
+import numpy as np
+from pathlib import Path
+from pypicostreaming.archive import ArchiveReader, ARCHIVE_EXTENSION
+from pypicostreaming.calibration import Calibration, convert
+from pypicostreaming.ringbuffer import RotatedSamples
+
+
+# Same as channelInputRanges of the Picoscope classes (mV)
+CHANNEL_INPUT_RANGES = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+# Files of a channel in order of preference: saved/memory mapped, streamed, archived
+SOURCES = {
+    'npy' : '.npy',
+    'stream' : '_stream.npy',
+    'archive' : ARCHIVE_EXTENSION,
+}
+
+
+class RunChannel:
+    def __init__(self, name, samples, scale, sample_step, signal_name = None, lut = None, first_sample = 0):
+        '''
+        One channel of a saved acquisition. The samples are not loaded:
+        slicing (channel[a:b]) reads and converts only the requested range.
+
+        Parameters:
+        samples : array, RotatedSamples or ArchiveReader
+            Raw ADC numbers (int16), e.g. a memory map.
+        scale : float
+            Factor converting the ADC numbers to physical values.
+        sample_step : float
+            Seconds between two samples.
+        lut : array
+            Lookup table of the calibration of the channel (see
+            calibration.Calibration), used instead of scale if given.
+        first_sample : int
+            Index from the start of the acquisition of the first sample,
+            for the time axis.
+        '''
+        self.name = name
+        self.samples = samples
+        self.scale = scale
+        self.sample_step = sample_step
+        self.signal_name = signal_name
+        self.lut = lut
+        self.first_sample = first_sample
+
+
+    def __len__(self):
+        return len(self.samples)
+
+
+    def raw(self, key = slice(None)):
+        return self.samples[key]
+
+
+    def __getitem__(self, key):
+        '''
+        Values of the slice in volts (or in the unit of the conversion factor).
+        '''
+        if self.lut is not None:
+            return convert(self.samples[key], self.lut)
+        return np.multiply(self.samples[key], self.scale, dtype='float32')
+
+
+    def time(self, key = slice(None)):
+        '''
+        Time axis (s) of the slice, computed only for the requested samples.
+        '''
+        start, stop, step = key.indices(len(self))
+        return (self.first_sample + np.arange(start, stop, step))*self.sample_step
+
+
+    def iter_chunks(self, chunk_size = 2**20, start = 0, stop = None):
+        '''
+        Yield (time, values) of consecutive chunks of chunk_size samples.
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        for first in range(start, stop, chunk_size):
+            key = slice(first, min(first + chunk_size, stop))
+            yield self.time(key), self[key]
+
+
+def _header_name(file_name):
+    # channelX.json of channelX.npy and channelX_MIN.npy
+    return file_name.removesuffix('.npy').removesuffix('_MIN') + '.json'
+
+
+def _in_order(samples, header):
+    # Samples of a file saved from a ring buffer without rotation (see RingBuffer.finalize)
+    offset = header.get('Ring offset', 0)
+    return RotatedSamples(samples, offset) if offset else samples
+
+
+def load_signal(file_name, mmap_mode = 'r'):
+    '''
+    Open a raw signal saved by save_signal or save_intermediate_signals
+    (channelX.npy or channelX_MIN.npy) with its header channelX.json: the
+    samples are memory mapped and converted only when sliced (see
+    RunChannel), e.g. load_signal('.../channelA.npy')[:] for all the values.
+    The samples of a memory mapped buffer that wrapped are read in
+    chronological order from the 'Ring offset' of the header.
+    '''
+    with open(_header_name(file_name)) as fp:
+        header = json.load(fp)
+    lut = None
+    if header['Calibration'] is not None:
+        lut = Calibration.from_dict(header['Calibration']).lut(header['Voltage range (mV)'], header['Max ADC'])
+    channel = RunChannel(header['Channel'],
+                         _in_order(np.load(file_name, mmap_mode=mmap_mode), header),
+                         header['Scale'],
+                         header['Sampling time (s)'],
+                         header['Signal name'],
+                         lut,
+                         header['First sample'])
+    return channel
+
+
+class RunReader:
+    def __init__(self, saving_dir, source = None, subfolder_name = None):
+        '''
+        Open a saved acquisition (the pico_aquisition folder) without loading
+        it: the metadata are parsed and the file of every channel is memory
+        mapped (or indexed if archived), see RunChannel.
+
+        Parameters:
+        saving_dir : str
+        source : str
+            'npy' (channelX.npy), 'stream' (channelX_stream.npy) or 'archive'
+            (channelX.pcarc). If None the first available in this order is
+            used for every channel.
+        subfolder_name : str
+            Subfolder of the files, as given to the save methods (e.g. the
+            files of save_intermediate_signals).
+        '''
+        if source is not None and source not in SOURCES:
+            raise ValueError(f'source must be one of {list(SOURCES)}')
+        self.saving_dir = saving_dir
+        files_dir = saving_dir if subfolder_name is None else saving_dir + subfolder_name
+        with open(saving_dir + '/metadata_pico.json') as fp:
+            self.metadata = json.load(fp)
+        self.sample_step = self.metadata['Sampling time (s)']*self.metadata.get('Downsampling ratio', 1)
+        self.max_adc = self.metadata.get('Max ADC', 32767)
+        self.channels = {}
+        for name, info in self.metadata.items():
+            if not isinstance(info, dict) or 'Voltage range' not in info:
+                continue
+            suffix = name.split('_CHANNEL_')[-1]
+            for key in ([source] if source is not None else SOURCES):
+                for channel_suffix in (suffix, suffix + '_MIN'):
+                    file_name = files_dir + f'/channel{channel_suffix}{SOURCES[key]}'
+                    if Path(file_name).exists():
+                        samples, first_sample = self._open(file_name, key)
+                        self.channels[channel_suffix] = RunChannel(name if channel_suffix == suffix else name + '_MIN',
+                                                                   samples,
+                                                                   self.channel_scale(info),
+                                                                   self.sample_step,
+                                                                   info.get('Signal name'),
+                                                                   self.channel_lut(info),
+                                                                   first_sample)
+                if suffix in self.channels:
+                    break
+
+
+    def channel_scale(self, info):
+        # Same as channel_scale of the Picoscope classes, with the minus of the potentiostat
+        scale = -CHANNEL_INPUT_RANGES[info['Voltage range']]/self.max_adc/1000
+        if info.get('Converting factor') is not None:
+            scale *= info['Converting factor']
+        return scale
+
+
+    def channel_lut(self, info):
+        if info.get('Calibration') is None:
+            return None
+        return Calibration.from_dict(info['Calibration']).lut(CHANNEL_INPUT_RANGES[info['Voltage range']],
+                                                               self.max_adc)
+
+
+    def _open(self, file_name, source):
+        # Samples of a file and index of the first one from the start of the acquisition
+        if source == 'archive':
+            archive = ArchiveReader(file_name)
+            return archive, archive.first_sample
+        samples = np.load(file_name, mmap_mode='r')
+        # Header written with the file: channelX.json, or stream.json by the stream writer
+        header_name = str(Path(file_name).parent/'stream.json') if source == 'stream' else _header_name(file_name)
+        if not Path(header_name).exists():
+            return samples, 0
+        with open(header_name) as fp:
+            header = json.load(fp)
+        return _in_order(samples, header), header['First sample'] or 0
+
+
+    def __getitem__(self, channel):
+        '''
+        Channel by letter ('A', 'A_MIN'...) or by name ('PS5000A_CHANNEL_A').
+        '''
+        return self.channels[channel.split('_CHANNEL_')[-1]]
+
+
+    def __iter__(self):
+        return iter(self.channels.values())
+
+
+    def __len__(self):
+        return len(self.channels)
@@ -0,0 +1,323 @@
+import operator
+import numpy as np
+from threading import Lock
+from pypicostreaming.writer import npy_header, NPY_HEADER_SIZE
+
+
+def _reverse(data, start, stop, chunk = 2**20):
+    '''
+    Reverse data[start:stop] in place swapping chunks from the two ends, so
+    that a memory mapped array is never loaded entirely in memory.
+    '''
+    while stop - start > 1:
+        n = min(chunk, (stop - start)//2)
+        left = data[start:start + n].copy()
+        data[start:start + n] = data[stop - n:stop][::-1]
+        data[stop - n:stop] = left[::-1]
+        start += n
+        stop -= n
+
+
+def _window(written, capacity, n, start, stop):
+    '''
+    Absolute [start, stop) range of a snapshot: the last n samples (all the
+    ones stored if n is None) or the range given, that must be still stored.
+    '''
+    oldest = max(0, written - capacity)
+    if start is None:
+        n = written - oldest if n is None else min(n, written - oldest)
+        return written - n, written
+    stop = written if stop is None else stop
+    if not oldest <= start <= stop <= written:
+        raise ValueError(f'The samples available are in the range [{oldest}, {written}).')
+    return start, stop
+
+
+def _read_only(view):
+    view.flags.writeable = False
+    return view
+
+
+class RingBuffer:
+    def __init__(self, capacity, dtype = np.int16, buffer = None):
+        '''
+        Circular buffer of the samples of one channel. It counts the samples
+        written and read since the creation, so the oldest samples are
+        overwritten when it is full and empty() returns only the new ones.
+
+        Parameters:
+        capacity : int
+            Number of samples kept.
+        buffer : 1-D array, optional
+            Storage of the samples (e.g. a memory map, see open_memmap), a
+            new array is allocated in memory if not given.
+        '''
+        self.capacity = capacity
+        self.data = np.zeros(shape=capacity, dtype=dtype) if buffer is None else buffer
+        if self.data.shape != (capacity,):
+            raise ValueError(f'buffer must be a 1-D array of {capacity} samples.')
+        self.file_name = None
+        self.written = 0 # Total number of samples pushed since the creation
+        self.read = 0    # Index of the first sample not read yet
+        self._offset = 0 # Position of the sample 0 in data, changed by finalize
+        self._lock = Lock()
+
+
+    @classmethod
+    def open_memmap(cls, file_name, capacity, dtype = np.int16):
+        '''
+        Create a ring whose samples are stored in a memory mapped .npy file,
+        so that the size is not limited by the RAM. The file can be loaded
+        with np.load at any moment and, after finalize, it holds the samples
+        in chronological order (or in the order of the ring, read in order
+        with RotatedSamples, see finalize).
+        '''
+        dtype = np.dtype(dtype)
+        with open(file_name, 'wb') as file:
+            file.write(npy_header(dtype, capacity))
+            file.truncate(NPY_HEADER_SIZE + capacity*dtype.itemsize) # Sparse until written
+        data = np.memmap(file_name, dtype=dtype, mode='r+', offset=NPY_HEADER_SIZE, shape=(capacity,))
+        ring = cls(capacity, dtype, data)
+        ring.file_name = file_name
+        return ring
+
+
+    def __len__(self):
+        return min(self.written - self.read, self.capacity)
+
+
+    def push(self, block):
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            skipped, n = n - self.capacity, self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            start = (self.written + skipped + self._offset) % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = block[:first]
+            self.data[:n - first] = block[first:]
+            self.written += skipped + n
+
+
+    def reset(self):
+        '''
+        Forget the samples stored (they are overwritten by the next ones)
+        without reallocating the buffer.
+        '''
+        with self._lock:
+            self.written = 0
+            self.read = 0
+            self._offset = 0
+
+
+    def empty(self, stop = None):
+        '''
+        Return a copy of the samples not read yet in chronological order and
+        mark them as read. If stop (absolute index) is given only the samples
+        before it are returned, the next ones are left for the next read.
+        '''
+        with self._lock:
+            stop = self.written if stop is None else min(stop, self.written)
+            # Samples still stored (the oldest ones are overwritten) not read yet
+            n = max(0, stop - max(self.read, self.written - self.capacity))
+            start = (stop - n + self._offset) % self.capacity
+            if start + n <= self.capacity:
+                samples = self.data[start:start + n].copy()
+            else:
+                samples = np.concatenate((self.data[start:], self.data[:start + n - self.capacity]))
+            self.read = max(self.read, stop)
+        return samples
+
+
+    def snapshot(self, n = None, start = None, stop = None):
+        '''
+        Return (start, samples) with the last n samples or the samples of the
+        absolute range [start, stop) without marking them as read. samples is
+        a read-only view of the buffer, unless the window crosses the end of
+        the buffer and it is copied. The view is overwritten when the buffer
+        wraps over it: check it with is_valid(start) after using it.
+        '''
+        with self._lock:
+            start, stop = _window(self.written, self.capacity, n, start, stop)
+            first = (start + self._offset) % self.capacity
+            if first + stop - start <= self.capacity:
+                samples = _read_only(self.data[first:first + stop - start])
+            else:
+                samples = np.concatenate((self.data[first:], self.data[:first + stop - start - self.capacity]))
+        return start, samples
+
+
+    def is_valid(self, start):
+        '''
+        True if the samples from start on have not been overwritten yet.
+        '''
+        with self._lock:
+            return start >= self.written - self.capacity
+
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+
+    def finalize(self, rotate = True):
+        '''
+        Make the memory mapped file a .npy file of the samples stored and
+        return the position in the file of the oldest one.
+        If the buffer has wrapped, with rotate = True the samples are rotated
+        in place in chronological order (the position returned is 0), which
+        reads and writes the whole file about twice. With rotate = False the
+        samples are left where they are, nothing is copied, and they are read
+        in order with RotatedSamples(np.load(file_name), position).
+        The length in the header is updated in both cases.
+        '''
+        if self.file_name is None:
+            raise ValueError('Only rings created with open_memmap can be finalized.')
+        with self._lock:
+            shift = (self.written + self._offset) % self.capacity if self.written >= self.capacity else 0
+            if rotate and shift:
+                _reverse(self.data, 0, shift)
+                _reverse(self.data, shift, self.capacity)
+                _reverse(self.data, 0, self.capacity)
+                self._offset = -self.written % self.capacity
+                shift = 0
+            self.data.flush()
+            with open(self.file_name, 'r+b') as file:
+                file.write(npy_header(self.data.dtype, min(self.written, self.capacity)))
+        return shift
+
+
+class RotatedSamples:
+    def __init__(self, data, offset):
+        '''
+        Samples of a ring file finalized without rotation (see
+        RingBuffer.finalize) in chronological order: sample i is
+        data[(offset + i) % len(data)]. Only the samples of the index or
+        slice requested are read, so data can be a memory map.
+        '''
+        self.data = data
+        self.offset = offset
+        self.dtype = data.dtype
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def __getitem__(self, key):
+        n = len(self.data)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                return self.data[(np.arange(start, stop, step) + self.offset) % n]
+            if stop <= start:
+                return self.data[:0]
+            first, last = (start + self.offset) % n, (stop - 1 + self.offset) % n + 1
+            if first < last:
+                return self.data[first:last]
+            return np.concatenate((self.data[first:], self.data[:last]))
+        index = operator.index(key)
+        if not -n <= index < n:
+            raise IndexError(f'index {index} is out of bounds for {n} samples')
+        return self.data[(index % n + self.offset) % n]
+
+
+    def __array__(self, dtype = None, copy = None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class MultiChannelRingBuffer:
+    def __init__(self, capacity, columns, dtype = np.int16):
+        '''
+        Circular buffer keeping the samples of several channels in a single
+        (capacity, n_channels) array with one write cursor, so that every row
+        holds time-aligned samples of all the channels. When the buffer is
+        full the oldest rows are overwritten.
+
+        Parameters:
+        capacity : int
+            Number of rows (samples per channel).
+        columns : list of str
+            Names of the channels, in the order of the columns.
+        '''
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.data = np.zeros(shape=(capacity, len(self.columns)), dtype=dtype)
+        self.written = 0 # Total number of rows pushed since the creation
+        self.read = 0    # Index of the first row not read yet
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return min(self.written - self.read, self.capacity)
+
+
+    def reset(self):
+        with self._lock:
+            self.written = 0
+            self.read = 0
+
+
+    def push(self, blocks):
+        '''
+        Write the new samples of all the channels (a list of 1-D arrays of the
+        same length, in the order of the columns) with one vectorized copy
+        (two when the cursor wraps).
+        '''
+        n = len(blocks[0])
+        if n > self.capacity:
+            blocks = [block[-self.capacity:] for block in blocks]
+            skipped, n = n - self.capacity, self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            start = (self.written + skipped) % self.capacity
+            first = min(n, self.capacity - start)
+            np.stack([block[:first] for block in blocks], axis=1, out=self.data[start:start + first])
+            if first < n:
+                np.stack([block[first:] for block in blocks], axis=1, out=self.data[:n - first])
+            self.written += skipped + n
+
+
+    def empty(self):
+        '''
+        Return a copy of the rows not read yet in chronological order and
+        mark them as read.
+        '''
+        with self._lock:
+            n = min(self.written - self.read, self.capacity)
+            start = (self.written - n) % self.capacity
+            if start + n <= self.capacity:
+                rows = self.data[start:start + n].copy()
+            else:
+                rows = np.concatenate((self.data[start:], self.data[:start + n - self.capacity]))
+            self.read = self.written
+        return rows
+
+
+    def snapshot(self, n = None, start = None, stop = None):
+        '''
+        Return (start, rows) with the last n rows or the rows of the absolute
+        range [start, stop) without marking them as read. rows is a read-only
+        view of the buffer, unless the window crosses the end of the buffer
+        and it is copied. The view is overwritten when the buffer wraps over
+        it: check it with is_valid(start) after using it.
+        '''
+        with self._lock:
+            start, stop = _window(self.written, self.capacity, n, start, stop)
+            first = start % self.capacity
+            if first + stop - start <= self.capacity:
+                rows = _read_only(self.data[first:first + stop - start])
+            else:
+                rows = np.concatenate((self.data[first:], self.data[:first + stop - start - self.capacity]))
+        return start, rows
+
+
+    def is_valid(self, start):
+        '''
+        True if the samples from start on have not been overwritten yet.
+        '''
+        with self._lock:
+            return start >= self.written - self.capacity
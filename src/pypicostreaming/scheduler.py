@@ -0,0 +1,79 @@
+import time
+
+
+class PollScheduler:
+    def __init__(self, time_step, capture_size, fill_fraction = 0.5, min_sleep = 1e-4, max_sleep = 1.0):
+        '''
+        Decide how long the polling loop can sleep between two calls of
+        GetStreamingLatestValues.
+        The driver buffer is filled in capture_size*time_step seconds, so after
+        a callback the next poll is scheduled when fill_fraction of the buffer
+        is expected to be ready. If the driver has no data at that time the
+        sleep is doubled at every empty poll starting from min_sleep, up to the
+        expected interval.
+
+        Parameters:
+        time_step : float
+            Sampling time in seconds.
+        capture_size : int
+            Size of the buffer given to the driver (samples).
+        fill_fraction : float
+            Fraction of the driver buffer to wait for before polling again.
+        min_sleep, max_sleep : float
+            Limits of the sleeping time in seconds.
+        '''
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.target_samples = max(1, int(capture_size*fill_fraction))
+        self.interval = min(max(self.target_samples*time_step, min_sleep), max_sleep)
+        self.reset()
+
+
+    def reset(self):
+        self.polls = 0
+        self.empty_polls = 0
+        self.data_polls = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._backoff = self.min_sleep
+        self._deadline = None
+
+
+    def next_sleep(self, was_called_back, samples = 0):
+        '''
+        Update the statistics after a poll and return the time to sleep
+        (seconds) before the next one.
+        '''
+        now = time.perf_counter()
+        self.polls += 1
+        if was_called_back:
+            self.data_polls += 1
+            if self._deadline is not None:
+                # Time passed between the moment data was expected and the poll that got it
+                latency = max(0.0, now - self._deadline)
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            self._backoff = self.min_sleep
+            if samples >= self.target_samples:
+                # Behind schedule: the driver probably has more data ready
+                self._deadline = now
+                return 0.0
+            self._deadline = now + self.interval
+            return self.interval
+        self.empty_polls += 1
+        if self._deadline is None:
+            self._deadline = now
+        sleep_time = self._backoff
+        self._backoff = min(self._backoff*2, self.interval)
+        return sleep_time
+
+
+    def stats(self):
+        return {
+            'polls' : self.polls,
+            'empty_polls' : self.empty_polls,
+            'empty_poll_ratio' : self.empty_polls/self.polls if self.polls else 0.0,
+            'mean_callback_latency' : self.latency_total/self.data_polls if self.data_polls else 0.0,
+            'max_callback_latency' : self.latency_max,
+            'poll_interval' : self.interval,
+        }
@@ -1,39 +1,89 @@
+import asyncio
 import ctypes
-import time
 import json
+import time
 from datetime import datetime
+from functools import partial
 import numpy as np
-from npbuffer import NumpyCircularBuffer
-from picosdk.ps4000 import ps4000 as ps
 from picosdk.functions import assert_pico_ok
+from picosdk.errors import CannotFindPicoSDKError
+try:
+    from picosdk.ps4000 import ps4000 as ps
+except CannotFindPicoSDKError:
+    # The driver library is not installed: only a simulated driver can be used
+    ps = None
 from dataclasses import dataclass
-from threading import Thread
+from contextlib import asynccontextmanager
+from threading import Thread, Event
 from pathlib import Path
+from pypicostreaming.writer import ChunkedWriter, npy_header
+from pypicostreaming.scheduler import PollScheduler
+from pypicostreaming.bufferpool import BufferPool, PoolBlock
+from pypicostreaming.ringbuffer import MultiChannelRingBuffer, RingBuffer
+from pypicostreaming.monitor import StreamMonitor
+from pypicostreaming.tracing import Tracer
+from pypicostreaming.calibration import Calibration, convert, inverse
+from pypicostreaming.asyncstream import AsyncBlockStream
+from pypicostreaming.pipeline import Pipeline
+from pypicostreaming.pyramid import PyramidIndex
+from pypicostreaming.statistics import StatisticsStage
+from pypicostreaming.trigger import EventDetector, EventStore
+from pypicostreaming.archive import ArchiveWriter, ArchiveStage, ARCHIVE_EXTENSION
+from collections import deque
+
+# Downsampling modes of the ps4000 driver (not defined in picosdk)
+PS4000_RATIO_MODE = {
+    'PS4000_RATIO_MODE_NONE': 0,
+    'PS4000_RATIO_MODE_AGGREGATE': 1,
+    'PS4000_RATIO_MODE_AVERAGE': 2,
+}
+
+# Directions of the simple trigger of the ps4000 driver (not defined in picosdk)
+PS4000_THRESHOLD_DIRECTION = {
+    'PS4000_ABOVE': 0,
+    'PS4000_BELOW': 1,
+    'PS4000_RISING': 2,
+    'PS4000_FALLING': 3,
+    'PS4000_RISING_OR_FALLING': 4,
+}
 
 @dataclass
 class PicoChannel :
     name         : str
     vrange       : str
     buffer_small : int
-    buffer_total : NumpyCircularBuffer
+    buffer_total : RingBuffer
     status       : str
     conv_factor  : int = None
     signal_name  : str = None
+    pool         : BufferPool = None
+    buffer_small_min : np.ndarray = None # Minimum values in aggregate mode (buffer_small holds the maximum)
+    buffer_total_min : RingBuffer = None
+    calibration  : Calibration = None
+    lut          : np.ndarray = None # Value of every ADC number, compiled from calibration in set_channel
 
 
 class Picoscope4000():
-    def __init__(self):
+    def __init__(self, serial = None, driver = None):
         '''
         Connect the instrument (connects always to the erlriest plugged to the 
-        computer that is not already in use).
+        computer that is not already in use, unless the serial is given).
+        The driver is the picosdk ps4000 module unless another object with
+        the same functions is given (e.g. simulator.SimulatedPs4000 to run
+        without a device attached).
         '''
+        self.ps = ps if driver is None else driver
+        self.serial = serial
         self.handle = ctypes.c_int16()
         self.status = {}
         self.connect()
     
     
     def connect(self):
-        self.status["openunit"] = ps.ps4000OpenUnit(ctypes.byref(self.handle))
+        if self.serial is None:
+            self.status["openunit"] = self.ps.ps4000OpenUnit(ctypes.byref(self.handle))
+        else:
+            self.status["openunit"] = self.ps.ps4000OpenUnitEx(ctypes.byref(self.handle), self.serial)
         assert_pico_ok(self.status["openunit"]) 
     
 
@@ -47,7 +97,20 @@ class Picoscope4000():
                  samples_total, 
                  sampling_time, 
                  time_unit,
-                 is_debug = False):
+                 saving_path,
+                 is_debug = False,
+                 stream_to_disk = False,
+                 buffer_pool = 0,
+                 ratio_mode = 'PS4000_RATIO_MODE_NONE',
+                 downsample_ratio = 1,
+                 interleaved = False,
+                 memmap = False,
+                 archive = False,
+                 pyramid = False,
+                 rotate_samples = None,
+                 rotate_seconds = None,
+                 statistics = False,
+                 psd_segment = None):
         '''
         Set parameters valid for the acquisition on all channels and variables
         for the data saving on allocated memory and autostop.
@@ -62,25 +125,215 @@ class Picoscope4000():
         'PS4000_US': microseconds
         'PS4000_MS': milliseconds
         'PS4000_S' : seconds
+
+        With stream_to_disk = True the raw samples of every channel are also
+        appended to channelX_stream.npy files in the saving folder by a
+        background thread, so the length of the acquisition is not limited
+        by samples_total.
+        The blocks dropped when the disk cannot keep up are listed in
+        stream.json and in the metadata ('Stream to disk').
+        With rotate_samples and/or rotate_seconds the stream is split in
+        numbered segments (channelX_stream_NNNNNN.npy) of rotate_samples
+        samples or rotate_seconds seconds, listed with their first sample in
+        segments.json, so that the runs with autoStop = False can last for
+        days with constant memory. In this case the writer pauses the polling
+        instead of dropping blocks when it cannot keep up, and the continuity
+        of the segments can be verified with writer.check_segments.
+        With archive = True they are written instead compressed in
+        channelX.pcarc files (see archive.ArchiveWriter), with the scale
+        factors and the metadata embedded.
+
+        With pyramid = True a min/max/mean level of detail index of every
+        channel is updated at every callback (see pyramid.MinMaxPyramid) and
+        saved as channelX_lod.npz: envelope returns any time range reduced
+        to the number of pixels of a plot without reading the samples.
+
+        With statistics = True the count, mean, RMS, standard deviation,
+        minimum and maximum of every channel (converted as convert_samples)
+        are updated at every block in a worker thread and, if psd_segment is
+        given, the Welch power spectral density with segments of psd_segment
+        samples (see statistics.StatisticsStage). They can be read during the
+        acquisition with self.statistics.stats() and self.statistics.psd(name),
+        at the end they are saved in the metadata and in psd.npz.
+
+        With buffer_pool = N (N >= 2) each channel gets a ring of N driver
+        buffers of capture_size samples. When the driver has filled a buffer,
+        it is replaced with a free one and handed to the user by reference
+        (see get_block) instead of being copied in buffer_total, which is not
+        allocated in this mode. Blocks must be released after use, if all the
+        buffers are in use the new block is lost (counted in dropped_blocks).
+        The methods reading buffer_total (save_signals, get_all_signals...)
+        raise ValueError in this mode.
+
+        Hardware downsampling is enabled by setting downsample_ratio > 1
+        with one of the ratio modes:
+        'PS4000_RATIO_MODE_NONE'     : no downsampling (ratio must be 1)
+        'PS4000_RATIO_MODE_AGGREGATE': minimum and maximum of every
+                                       downsample_ratio samples (two buffers
+                                       per channel, the minimum is stored in
+                                       buffer_small_min/buffer_total_min)
+        'PS4000_RATIO_MODE_AVERAGE'  : average of every downsample_ratio samples
+        samples_total is always in raw samples while capture_size is in
+        downsampled samples (size of the driver buffers).
+
+        With interleaved = True the samples of all the channels are stored in
+        a single MultiChannelRingBuffer (buffer_interleaved) instead of one
+        buffer_total per channel: every callback makes one write and the
+        channels always have the same number of samples when read.
+
+        With memmap = True buffer_total (and buffer_total_min) is a RingBuffer
+        stored in the memory mapped file channelX.npy (channelX_MIN.npy) in
+        the saving folder instead of the RAM, so samples_total is limited
+        only by the disk. The file is finalized at the end of the
+        acquisition, with its channelX.json header, and is the output of
+        save_signals, without copies: if the ring has wrapped the samples
+        are not rotated, the position of the oldest one is saved as
+        'Ring offset' in the header and load_signal and RunReader read them
+        in chronological order (see ringbuffer.RotatedSamples).
+
+        The signals are always saved as raw ADC numbers (int16), each file
+        channelX.npy with a channelX.json header holding the maximum ADC
+        number, the voltage range, the conversion factor and the calibration
+        (see signal_header). They are converted when read, e.g. with
+        reader.load_signal or reader.RunReader.
+
+        With is_debug = True the duration of the driver calls, of the
+        callbacks, of the push of every channel and of the consumers is
+        recorded by self.tracer (see tracing.Tracer). At the end of the
+        acquisition the percentiles are added to the metadata and the spans
+        saved in trace.json (Chrome trace format). When False the polling
+        only checks that tracer is None.
         '''
         # Measurement parameters
         self.capture_size = capture_size
         self.samples_total = samples_total # Total must be an integer number of capture_size
-        self.number_captures = int(self.samples_total/self.capture_size)
+        self.ratio_mode = PS4000_RATIO_MODE[ratio_mode]
+        self.downsample_ratio = downsample_ratio
+        if downsample_ratio < 1 or (downsample_ratio > 1 and ratio_mode == 'PS4000_RATIO_MODE_NONE'):
+            raise ValueError('downsample_ratio must be 1 without downsampling and greater than 1 otherwise.')
+        self.aggregate = ratio_mode == 'PS4000_RATIO_MODE_AGGREGATE'
+        if self.aggregate and buffer_pool:
+            raise ValueError('The buffer pool mode is not available in aggregate mode.')
+        if interleaved and buffer_pool:
+            raise ValueError('The buffer pool and interleaved modes cannot be used together.')
+        if memmap and (buffer_pool or interleaved):
+            raise ValueError('The memory mapped buffers are not available in buffer pool or interleaved mode.')
+        self.number_captures = max(1, int(self.samples_total/self.downsample_ratio/self.capture_size))
         self.sampling_time = ctypes.c_int32(sampling_time)
-        self.time_unit = ps.PS4000_TIME_UNITS[time_unit]
+        self.time_unit = self.ps.PS4000_TIME_UNITS[time_unit]
         self.time_step = self.time_unit_in_seconds(sampling_time, self.time_unit)
+        self.sample_step = self.time_step*self.downsample_ratio # Time between the samples stored
         self.is_debug = is_debug
+        self.tracer = Tracer() if is_debug else None # Durations of the steps of the polling, see tracing.Tracer
         # Software parameters
         self.channels = {} # Dictionary containing all the information of set up channels
         self.nextSample = 0
         self.autoStopOuter = False
         self.wasCalledBack = False
+        self.buffer_pool = buffer_pool
+        self.interleaved = interleaved
+        self.memmap = memmap
+        self.buffer_interleaved = None # Allocated in start_streaming when all the channels are set
+        self.filled_blocks = deque() # Blocks handed over by reference in buffer pool mode
+        self.dropped_blocks = 0
+        self.block_start = 0 # Acquisition index of the first sample in the current driver buffer
+        self.block_end = 0
+        self.poll_scheduler = PollScheduler(self.sample_step, self.capture_size)
+        self.wake_event = Event() # Set by stop() to interrupt the sleep of the polling loop
         self.max_adc = ctypes.c_int16(32767) # 16bit convertion
         self.channelInputRanges = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
 
         self.saving_dir = saving_path+'/pico_aquisition'
         Path(self.saving_dir).mkdir(parents=True, exist_ok=True)  
+        self.consumers = [] # Objects receiving each new block of samples from the callback
+        self.stream_monitor = None # Overflows, gaps and rates of the run, see start_streaming
+        self.completed_event = Event() # Set by complete_acquisition
+        self.segments_data = None # Waveforms of the rapid block mode, see set_rapid_block
+        self.segment_buffers_registered = False
+        self.arm_time = None # perf_counter at the start of the device and at the first samples
+        self.first_sample_time = None
+        self._add_output_consumers(stream_to_disk, archive, pyramid, rotate_samples, rotate_seconds,
+                                   statistics, psd_segment)
+
+
+    def _add_output_consumers(self, stream_to_disk, archive, pyramid, rotate_samples, rotate_seconds,
+                              statistics, psd_segment):
+        self.writer = None
+        if stream_to_disk:
+            rotate = rotate_samples is not None or rotate_seconds is not None
+            self.writer = ChunkedWriter(self.saving_dir,
+                                        rotate_samples = rotate_samples,
+                                        rotate_seconds = rotate_seconds,
+                                        drop_when_full = not rotate)
+            self.add_consumer(self.writer)
+        self.archive = None
+        if archive:
+            self.archive = ArchiveStage(self.saving_dir)
+            self.add_consumer(Pipeline([self.archive], policy='block'))
+        self.pyramid = None
+        if pyramid:
+            self.pyramid = PyramidIndex(self.saving_dir)
+            self.add_consumer(self.pyramid)
+        self.statistics = None
+        if statistics:
+            self.statistics = StatisticsStage(self.sample_step, psd_segment)
+            self.add_consumer(Pipeline([self.statistics], policy='block'))
+
+
+    def add_consumer(self, consumer):
+        '''
+        Register an object that receives the new samples at every callback.
+        The object must implement:
+            put(start_sample, blocks) : called inside the callback with the
+                index of the first new sample and a dictionary channel name ->
+                samples. The arrays are views on the driver buffers, so they
+                must be copied if kept after the call.
+            close() : called when the acquisition is completed.
+        '''
+        self.consumers.append(consumer)
+
+
+    def add_trigger(self, condition, pre, post, holdoff = None, save = True):
+        '''
+        Capture only the windows of pre and post samples around the events
+        defined by the condition (see trigger.EventDetector), saved in the
+        events subfolder if save is True. Return the detector, its store
+        holds the events.
+        '''
+        store = EventStore(self.saving_dir + '/events' if save else None)
+        detector = EventDetector(condition, pre, post, holdoff, store)
+        self.add_consumer(detector)
+        return detector
+
+
+    def volts_to_adc(self, channel, value):
+        '''
+        ADC number of a channel corresponding to a value in volts (or in the
+        unit of the conversion factor), e.g. for the trigger thresholds.
+        The scale of the channels is negative (see channel_scale): a rising
+        edge in volts is a falling edge in ADC numbers.
+        With a calibration the closest value of its lookup table is taken.
+        '''
+        ch = self.channels[channel[-1]]
+        if ch.lut is not None:
+            return int(np.clip(inverse(ch.lut, value), -32767, 32767))
+        return int(np.clip(round(value/self.channel_scale(ch)), -32767, 32767))
+
+
+    def close_consumers(self):
+        '''
+        Close all the consumers, the first error raised by their close (e.g.
+        a write of the ChunkedWriter that failed) is raised once all of them
+        are closed.
+        '''
+        first_error = None
+        for consumer in self.consumers:
+            try:
+                consumer.close()
+            except Exception as error:
+                first_error = first_error or error
+        if first_error is not None:
+            raise first_error
 
 
     def _online_computation(self):
@@ -88,6 +341,9 @@ class Picoscope4000():
         Here can be put code for make computation on new data. Ideally operataion
         can be included in child classes expanding this one that will be called
         inside the callback after retriving new data from the instrument.
+        Heavy computations slow down the polling of the driver: register them
+        as stages of a pipeline.Pipeline (see add_consumer) to run them in a
+        separate thread.
         """
         pass
 
@@ -105,32 +361,118 @@ class Picoscope4000():
         The callback function called by the Picoscope driver. Slightly modified
         from the example to include the class attributes.
         '''
+        tracer = self.tracer
+        if tracer is not None:
+            callback_start = time.perf_counter_ns()
         self.wasCalledBack = True
+        if self.first_sample_time is None and noOfSamples:
+            self.first_sample_time = time.perf_counter()
         sourceEnd = startIndex + noOfSamples
-        for ch in self.channels.values():
-            ch.buffer_total.push(ch.buffer_small[startIndex:sourceEnd])
-        self._online_computation()
+        self.stream_monitor.record(self.nextSample, noOfSamples, startIndex, overflow)
+        if self.buffer_pool:
+            # The driver buffers are swapped after the call in get_data_loop
+            self.block_end = sourceEnd
+        elif self.interleaved:
+            blocks = [ch.buffer_small[startIndex:sourceEnd] for ch in self.channels.values()]
+            if self.aggregate:
+                blocks += [ch.buffer_small_min[startIndex:sourceEnd] for ch in self.channels.values()]
+            self.buffer_interleaved.push(blocks)
+        else:
+            for ch in self.channels.values():
+                if tracer is not None:
+                    push_start = time.perf_counter_ns()
+                ch.buffer_total.push(ch.buffer_small[startIndex:sourceEnd])
+                if self.aggregate:
+                    ch.buffer_total_min.push(ch.buffer_small_min[startIndex:sourceEnd])
+                if tracer is not None:
+                    tracer.record('push ' + ch.name, push_start)
+        if self.consumers:
+            blocks = {ch.name : ch.buffer_small[startIndex:sourceEnd] for ch in self.channels.values()}
+            if self.aggregate:
+                blocks.update({ch.name + '_MIN' : ch.buffer_small_min[startIndex:sourceEnd]
+                               for ch in self.channels.values()})
+            for consumer in self.consumers:
+                if tracer is not None:
+                    put_start = time.perf_counter_ns()
+                consumer.put(self.nextSample, blocks)
+                if tracer is not None:
+                    tracer.record('put ' + type(consumer).__name__, put_start)
+        if tracer is not None:
+            hook_start = time.perf_counter_ns()
+            self._online_computation()
+            tracer.record('_online_computation', hook_start)
+        else:
+            self._online_computation()
         self.nextSample += noOfSamples
         if autoStop: 
             self.autoStopOuter = True
+        if tracer is not None:
+            tracer.record('streaming_callback', callback_start)
             
     
-    def run_streaming_non_blocking(self, autoStop = True):
-        ''' 
-        Start the streaming of sampled signals from picoscope internal memory.
+    def start_streaming(self, autoStop = True):
         '''
+        Save the metadata and start the streaming on the device. The data must
+        then be collected with get_data_loop.
+        '''
+        self.completed_event.clear()
+        if self.segment_buffers_registered:
+            for ch in self.channels.values():
+                self._register_buffer(ch)
+            self.segment_buffers_registered = False
+        if self.interleaved and self.buffer_interleaved is None:
+            columns = [ch.name for ch in self.channels.values()]
+            if self.aggregate:
+                columns += [ch.name + '_MIN' for ch in self.channels.values()]
+            self.buffer_interleaved = MultiChannelRingBuffer(self.capture_size*self.number_captures, columns)
+        n_buffers = len(self.channels)*(2 if self.aggregate else 1)
+        channel_indices = {ch.name : self.ps.PS4000_CHANNEL[ch.name] for ch in self.channels.values()}
+        self.stream_monitor = StreamMonitor(channel_indices,
+                                            self.capture_size,
+                                            bytes_per_sample = 2*n_buffers)
         self.save_metadata(autoStop)
-        self.status["runStreaming"] = ps.ps4000RunStreaming(self.handle,
-                                                            ctypes.byref(self.sampling_time),
-                                                            self.time_unit,
-                                                            0, # maxPreTriggerSamples
-                                                            self.samples_total,
-                                                            autoStop, 
-                                                            1, # downsampleRatio
-                                                            self.capture_size)
+        if self.archive is not None:
+            self.archive.metadata = self.load_metadata()
+            self.archive.scales = {ch.name : self.channel_scale(ch) for ch in self.channels.values()}
+            self.archive.calibrations = {ch.name : self.channel_calibration(ch) for ch in self.channels.values()}
+        if self.statistics is not None:
+            for ch in self.channels.values():
+                convert_channel = partial(self.convert_samples, ch)
+                self.statistics.converters[ch.name] = convert_channel
+                self.statistics.converters[ch.name + '_MIN'] = convert_channel
+        self.first_sample_time = None
+        self.arm_time = time.perf_counter()
+        if self.ratio_mode == PS4000_RATIO_MODE['PS4000_RATIO_MODE_NONE']:
+            self.status["runStreaming"] = self.ps.ps4000RunStreaming(self.handle,
+                                                                     ctypes.byref(self.sampling_time),
+                                                                     self.time_unit,
+                                                                     0, # maxPreTriggerSamples
+                                                                     self.samples_total,
+                                                                     autoStop, 
+                                                                     1, # downsampleRatio
+                                                                     self.capture_size)
+        else:
+            self.status["runStreaming"] = self.ps.ps4000RunStreamingEx(self.handle,
+                                                                       ctypes.byref(self.sampling_time),
+                                                                       self.time_unit,
+                                                                       0, # maxPreTriggerSamples
+                                                                       self.samples_total,
+                                                                       autoStop,
+                                                                       self.downsample_ratio,
+                                                                       self.ratio_mode,
+                                                                       self.capture_size)
         assert_pico_ok(self.status["runStreaming"])
+        if self.tracer is not None:
+            self.tracer.reset()
         print("> Pico msg: Acquisition started!")
-        self.cFuncPtr = ps.StreamingReadyType(self.streaming_callback)
+        self.cFuncPtr = self.ps.StreamingReadyType(self.streaming_callback)
+
+
+    def run_streaming_non_blocking(self, autoStop = True):
+        ''' 
+        Start the streaming of sampled signals from picoscope internal memory.
+        '''
+        self.start_streaming(autoStop)
         get_data_thread = Thread( target=(self.get_data_loop) )
         get_data_thread.start()
         
@@ -139,39 +481,162 @@ class Picoscope4000():
         ''' 
         Start the streaming of sampled signals from picoscope internal memory.
         '''
-        self.save_metadata(autoStop)
-        self.status["runStreaming"] = ps.ps4000RunStreaming(self.handle,
-                                                            ctypes.byref(self.sampling_time),
-                                                            self.time_unit,
-                                                            0, # maxPreTriggerSamples
-                                                            self.samples_total,
-                                                            autoStop, 
-                                                            1, # downsampleRatio
-                                                            self.capture_size)
-        assert_pico_ok(self.status["runStreaming"])
-        print("> Pico msg: Acquisition started!")
-        self.cFuncPtr = ps.StreamingReadyType(self.streaming_callback)
+        self.start_streaming(autoStop)
         self.get_data_loop()
+
+
+    @asynccontextmanager
+    async def stream(self, autoStop = True, queue_depth = 64, policy = 'block'):
+        '''
+        Start the streaming and iterate over the new blocks of samples from
+        an asyncio coroutine:
+            async with pico.stream() as blocks:
+                async for start_sample, block in blocks:
+                    ...
+        block is a dictionary channel name -> raw samples (a copy). The
+        polling runs in its own thread as in run_streaming_non_blocking.
+        Leaving the context (also by cancellation or exception) stops the
+        device if the acquisition is not completed yet.
+        See AsyncBlockStream for queue_depth and policy.
+        '''
+        loop = asyncio.get_running_loop()
+        blocks = AsyncBlockStream(loop, queue_depth, policy)
+        self.add_consumer(blocks)
+        await loop.run_in_executor(None, self.start_streaming, autoStop)
+        get_data_thread = Thread( target=(self.get_data_loop) )
+        get_data_thread.start()
+        try:
+            yield blocks
+        finally:
+            blocks.cancel()
+            if not self.autoStopOuter:
+                self.stop()
         
     
     def get_data_loop(self):
         '''
         Run the streaming from picoscope in a dedicated thread
         '''
+        self.poll_scheduler.reset()
         while not self.autoStopOuter:
-            self.wasCalledBack = False
-            self.status["getStreamingLastestValues"] = ps.ps4000GetStreamingLatestValues(self.handle, 
-                                                                                          self.cFuncPtr, 
-                                                                                          None)
-            if not self.wasCalledBack:
-                # If we weren't called back by the driver, this means no data is ready. Sleep for a short while before trying
-                # again.
-                time.sleep(0.001)
+            sleep_time = self.poll_once()
+            if sleep_time > 0:
+                self.wake_event.wait(sleep_time)
         else:
-            print('> Pico msg: Acquisition completed!')
+            self.complete_acquisition()
+
+
+    def poll_once(self):
+        '''
+        Ask the driver for the new data (delivered to streaming_callback) and
+        return the seconds to wait before the next poll (see PollScheduler).
+        '''
+        self.wasCalledBack = False
+        samples_before = self.nextSample
+        if self.tracer is not None:
+            driver_start = time.perf_counter_ns()
+        self.status["getStreamingLastestValues"] = self.ps.ps4000GetStreamingLatestValues(self.handle, 
+                                                                                           self.cFuncPtr, 
+                                                                                           None)
+        if self.tracer is not None:
+            self.tracer.record('ps4000GetStreamingLatestValues', driver_start)
+        if self.buffer_pool and (self.block_end == self.capture_size or self.autoStopOuter):
+            self._swap_pool_buffers()
+        return self.poll_scheduler.next_sleep(self.wasCalledBack,
+                                              max(0, self.nextSample - samples_before))
+
+
+    def complete_acquisition(self):
+        '''
+        Close the consumers and the files and complete the metadata at the end
+        of the acquisition. An error of the consumers is raised after the
+        metadata is completed and completed_event is set.
+        '''
+        consumer_error = None
+        try:
+            self.close_consumers()
+        except Exception as error:
+            consumer_error = error
+        if self.memmap:
+            self.finalize_memmap()
+        self.update_metadata({'Streaming statistics' : self.streaming_statistics(),
+                              'Polling statistics' : self.polling_statistics(),
+                              'Arm to first sample (s)' : self.arm_latency()})
+        if self.writer is not None:
+            self.update_metadata({'Stream to disk' : self.writer.stats()})
+        if self.statistics is not None:
+            if self.statistics.segment_size is not None:
+                self.statistics.save(self.saving_dir + '/psd.npz')
+            self.update_metadata({'Channel statistics' : self.statistics.stats()})
+        if self.tracer is not None:
+            self.tracer.save_chrome_trace(self.saving_dir + '/trace.json')
+            self.update_metadata({'Trace summary' : self.tracer.summary()})
+        print('> Pico msg: Acquisition completed!')
+        self.completed_event.set()
+        if consumer_error is not None:
+            raise consumer_error
     
+    def _swap_pool_buffers(self):
+        '''
+        Hand over the driver buffers filled so far and register free ones.
+        The driver writes the application buffers only during
+        GetStreamingLatestValues, so they can be swapped between two calls.
+        '''
+        if self.block_end == 0:
+            return
+        if all(ch.pool.available for ch in self.channels.values()):
+            for ch in self.channels.values():
+                self.filled_blocks.append(PoolBlock(ch.name,
+                                                    ch.buffer_small[:self.block_end],
+                                                    self.block_start,
+                                                    ch.buffer_small,
+                                                    ch.pool))
+                ch.buffer_small = ch.pool.acquire()
+                self._register_buffer(ch)
+        else:
+            # All the buffers are still in use: the same ones are overwritten by the driver
+            self.dropped_blocks += 1
+        self.block_start += self.block_end
+        self.block_end = 0
+
+
+    def get_block(self):
+        '''
+        Return the oldest block filled by the driver (buffer pool mode) or
+        None if there is no new block. Call block.release() when the data
+        is not needed anymore.
+        '''
+        try:
+            return self.filled_blocks.popleft()
+        except IndexError:
+            return None
+
+
+    def _check_samples_stored(self):
+        if self.buffer_pool:
+            raise ValueError('The samples are not stored in buffer pool mode, the blocks are handed over by get_block.')
+
+
+    def polling_statistics(self):
+        '''
+        Return the statistics of the polling loop: number of polls, ratio of
+        polls without new data and latency of the callbacks (seconds).
+        '''
+        return self.poll_scheduler.stats()
+
+
+    def streaming_statistics(self):
+        '''
+        Return the health of the running acquisition: callbacks, samples and
+        bytes received (totals and per second), voltage overflows of every
+        channel with the index of the samples where they happened and gaps
+        in the indices of the driver buffer. See monitor.StreamMonitor.
+        '''
+        return self.stream_monitor.stats() if self.stream_monitor is not None else None
+
+
     def available_device(self):
-        return ps.ps4000EnumerateUnits() 
+        return self.ps.ps4000EnumerateUnits() 
     
     
     def convert_ADC_numbers(self, data, vrange, conv_factor = None):
@@ -180,45 +645,305 @@ class Picoscope4000():
         '''
         # !!! Here there is a minus only beacause the potentiosat has negative values
         # !!! Correct this for general use case
-        numbers = np.multiply(-data, (self.channelInputRanges[vrange]/self.max_adc.value/1000), dtype = 'float32')
+        scale = -self.channelInputRanges[vrange]/self.max_adc.value/1000
         if conv_factor != None:
-            numbers = np.multiply(numbers, conv_factor)
-        return numbers
-    
-    
+            scale *= conv_factor
+        return np.multiply(data, scale, dtype = 'float32')
+
+
     def convert2volts(self, signal, vrange):
         '''
         Convert data from integer of the ADC to values in voltage
         '''
-        return np.multiply(-signal, (self.channelInputRanges[vrange]/self.max_adc.value/1000), dtype = 'float32')
-        
-    
+        return np.multiply(signal, -self.channelInputRanges[vrange]/self.max_adc.value/1000, dtype = 'float32')
+
+
+    def channel_scale(self, channel):
+        '''
+        Factor converting the ADC numbers of a channel to physical values. It
+        includes the sign, the voltage range and the conversion factor.
+        '''
+        # !!! Here there is a minus only beacause the potentiosat has negative values
+        scale = -self.channelInputRanges[channel.vrange]/self.max_adc.value/1000
+        if channel.conv_factor is not None:
+            scale *= channel.conv_factor
+        return scale
+
+
+    def convert_samples(self, channel, samples, out = None):
+        '''
+        Convert raw samples of a channel to physical values in a single pass:
+        a gather from the lookup table of its calibration if set, otherwise
+        a multiplication by channel_scale.
+        '''
+        if channel.lut is not None:
+            return convert(samples, channel.lut, out)
+        return np.multiply(samples, self.channel_scale(channel), out = out, dtype = np.float32)
+
+
     def convert_channel(self, channel):
-         signal = self.convert2volts(channel.buffer_total.empty(),
-                                             channel.vrange)
-         # Convert to current (A) if the case
-         if channel.conv_factor is not None:
-            signal = np.multiply(signal, channel.conv_factor)
-         return signal
+        # Voltage and conversion to current (A) if the case in a single pass
+        return self.convert_samples(channel, channel.buffer_total.empty())
+
 
     def get_all_signals(self):
         '''
         Convert data from all the channel to voltage values and to current if
         specified in the channel definition.
         '''
+        self._check_samples_stored()
+        if self.interleaved:
+            return tuple(self.get_signals_matrix())
         signal_list = []
         for ch in self.channels.values():
             signal_list.append(self.convert_channel(ch))
         return tuple(signal_list)
-    
-    def save_signal(self, channel, subfolder_name = None):
+
+
+    def convert_to_matrix(self, raw_signals, out = None):
+        '''
+        Convert a list of raw signals (one per channel, in the order of
+        self.channels) into the rows of a (n_channels, n_samples) float32
+        array. Each row is written directly by a single multiplication with
+        the scale (or the lookup table) of its channel, without intermediate
+        arrays.
+        If out is given it must have n_channels rows and at least n_samples
+        columns, the filled part is returned.
+        '''
+        if len(raw_signals) != len(self.channels):
+            raise ValueError(f'{len(raw_signals)} signals given for {len(self.channels)} channels.')
+        n_samples = min((len(signal) for signal in raw_signals), default = 0)
+        if out is None:
+            out = np.empty((len(raw_signals), n_samples), dtype = np.float32)
+        elif out.dtype != np.float32 or out.shape[0] != len(raw_signals) or out.shape[1] < n_samples:
+            raise ValueError(f'out must be a float32 array of shape ({len(raw_signals)}, >={n_samples}).')
+        out = out[:, :n_samples]
+        for row, signal, ch in zip(out, raw_signals, self.channels.values(), strict=True):
+            self.convert_samples(ch, signal[:n_samples], out = row)
+        return out
+
+
+    def get_signals_matrix(self, out = None):
+        '''
+        Same as get_all_signals but the signals are returned as the rows of a
+        single contiguous (n_channels, n_samples) float32 array, optionally
+        provided by the caller to avoid a new allocation at every call.
+        During the acquisition only the samples already received on all the
+        channels are read, the others are left for the next call.
+        '''
+        self._check_samples_stored()
+        if self.interleaved:
+            rows = self.buffer_interleaved.empty()
+            raw_signals = [rows[:, i] for i in range(len(self.channels))]
+        else:
+            # The callback pushes the channels one after the other: stop at the
+            # last sample pushed in all of them
+            rings = [ch.buffer_total for ch in self.channels.values()]
+            stop = min((ring.written for ring in rings), default = 0)
+            raw_signals = [ring.empty(stop) for ring in rings]
+            # All the signals end at stop, a ring that wrapped further holds fewer of the oldest ones
+            n_samples = min((len(signal) for signal in raw_signals), default = 0)
+            raw_signals = [signal[len(signal) - n_samples:] for signal in raw_signals]
+        return self.convert_to_matrix(raw_signals, out)
+
+
+    def envelope(self, channel, t_start, t_stop, pixels):
+        '''
+        Return (time, minimum, maximum, mean) of a channel between t_start
+        and t_stop (s from the start of the acquisition) in at most pixels
+        points from the level of detail index (pyramid = True in set_pico).
+        The values are converted as in convert_channel (with a calibration
+        the curve must be monotonic for the minimum and maximum to hold).
+        '''
+        if self.pyramid is None:
+            raise ValueError('The level of detail index is not enabled (pyramid = True in set_pico).')
+        ch = self.channels[channel[-1]]
+        start = int(t_start/self.sample_step)
+        stop = int(np.ceil(t_stop/self.sample_step))
+        positions, low, high, mean = self.pyramid.pyramids[ch.name].envelope(start, stop, pixels)
+        if self.aggregate:
+            low = self.pyramid.pyramids[ch.name + '_MIN'].envelope(start, stop, pixels)[1]
+        low = self.convert_samples(ch, low)
+        high = self.convert_samples(ch, high)
+        if ch.lut is not None:
+            # The lookup table is indexed by ADC numbers (the mean is approximated)
+            mean = np.rint(mean).astype(np.int16)
+        # The scale can be negative: swap minimum and maximum
+        return (positions*self.sample_step, 
+                np.minimum(low, high), 
+                np.maximum(low, high), 
+                self.convert_samples(ch, mean))
+
+
+    def snapshot(self, n = None, start = None, stop = None):
+        '''
+        Return (start, signals) with the last n raw samples (all the ones
+        stored if None) or the samples of the absolute range [start, stop) of
+        every channel, as a dictionary channel name -> samples, without
+        consuming them as get_all_signals does. The samples are read-only
+        views of the buffers (copied only if the window crosses their end),
+        so any number of readers can take snapshots during the acquisition.
+        A view is overwritten when the buffer wraps over it: check it with
+        snapshot_valid(start) after using it.
+        '''
+        if self.buffer_pool:
+            raise ValueError('Snapshots are not available in buffer pool mode, see get_block.')
+        if self.interleaved:
+            start, rows = self.buffer_interleaved.snapshot(n, start, stop)
+            return start, {name : rows[:, i] for i, name in enumerate(self.buffer_interleaved.columns)}
+        rings = self._rings()
+        if start is None:
+            # The same range for all the channels even if the callback is pushing a block
+            stop = min(ring.written for ring in rings.values())
+            start = max(0, stop - (min(ring.capacity for ring in rings.values()) if n is None else n))
+        signals = {}
+        for name, ring in rings.items():
+            start, signals[name] = ring.snapshot(start=start, stop=stop)
+        return start, signals
+
+
+    def snapshot_valid(self, start):
+        '''
+        True if the samples of the snapshots from start on are still intact.
+        '''
+        if self.interleaved:
+            return self.buffer_interleaved.is_valid(start)
+        return all(ring.is_valid(start) for ring in self._rings().values())
+
+
+    def _rings(self):
+        # Buffer of every channel and, in aggregate mode, of its minimum values
+        rings = {ch.name : ch.buffer_total for ch in self.channels.values()}
+        if self.aggregate:
+            rings.update({ch.name + '_MIN' : ch.buffer_total_min for ch in self.channels.values()})
+        return rings
+
+
+    def _saving_path(self, subfolder_name):
         if subfolder_name is None :
-            saving_file_path = self.saving_dir
+            return self.saving_dir
+        saving_file_path = self.saving_dir + subfolder_name
+        Path(saving_file_path).mkdir(parents=True, exist_ok=True)
+        return saving_file_path
+
+
+    def channel_calibration(self, channel):
+        '''
+        Calibration of a channel with the range it applies to, saved in the
+        archives (see archive.ArchiveWriter), None without calibration.
+        '''
+        if channel.calibration is None:
+            return None
+        return {'Calibration' : channel.calibration.to_dict(),
+                'Voltage range (mV)' : self.channelInputRanges[channel.vrange],
+                'Max ADC' : self.max_adc.value}
+
+
+    def signal_header(self, channel, first_sample = 0, ring_offset = 0):
+        '''
+        Information to convert the raw samples of a channel saved in a file,
+        written next to it as channelX.json. ring_offset is the position in
+        the file of the oldest sample (see RingBuffer.finalize).
+        '''
+        return {
+            'Channel' : channel.name,
+            'Signal name' : channel.signal_name,
+            'Data type' : 'int16',
+            'Max ADC' : self.max_adc.value,
+            'Voltage range' : channel.vrange,
+            'Voltage range (mV)' : self.channelInputRanges[channel.vrange],
+            'Converting factor' : channel.conv_factor,
+            'Calibration' : channel.calibration.to_dict() if channel.calibration is not None else None,
+            'Scale' : self.channel_scale(channel),
+            'Sampling time (s)' : self.sample_step,
+            'First sample' : int(first_sample),
+            'Ring offset' : int(ring_offset),
+        }
+
+
+    def _save_raw(self, ring, file_name):
+        # Return the index of the first sample saved and its position in the file
+        if self.memmap:
+            # The samples are already in the memory mapped file, left in the order of the ring
+            offset = ring.finalize(rotate = False)
+            first_sample = max(0, ring.written - ring.capacity)
+            if Path(file_name) == Path(ring.file_name):
+                return first_sample, offset
+            # A copy in another folder is written in chronological order
+            n_samples = min(ring.written, ring.capacity)
+            with open(file_name, 'wb') as fp:
+                fp.write(npy_header(ring.data.dtype, n_samples))
+                ring.data[offset:n_samples].tofile(fp)
+                ring.data[:offset].tofile(fp)
+            return first_sample, 0
+        start, samples = ring.snapshot()
+        np.save(file_name, samples, allow_pickle=False)
+        return start, 0
+
+
+    def _save_columns(self, rows, channel, file_name):
+        # Columns of a channel (and of its minimum values) in rows of buffer_interleaved
+        columns = self.buffer_interleaved.columns
+        np.save(file_name + '.npy', rows[:, columns.index(channel.name)], allow_pickle=False)
+        if self.aggregate:
+            np.save(file_name + '_MIN.npy', rows[:, columns.index(channel.name + '_MIN')], allow_pickle=False)
+
+
+    def save_signal(self, channel, subfolder_name = None):
+        '''
+        Save the raw samples stored of a channel (without consuming them) in
+        channelX.npy, the minimum values in channelX_MIN.npy in aggregate
+        mode, and the header channelX.json.
+        '''
+        self._check_samples_stored()
+        file_name = self._saving_path(subfolder_name) + f'/channel{channel.name[-1]}'
+        if self.interleaved:
+            first_sample, rows = self.buffer_interleaved.snapshot()
+            ring_offset = 0
+            self._save_columns(rows, channel, file_name)
         else:
-            saving_file_path = self.saving_dir + subfolder_name
-            Path(saving_file_path).mkdir(parents=True, exist_ok=True)
-        file_name = saving_file_path + f'/channel{channel.name[-1]}.npy'
-        np.save(file_name, channel.buffer_total)
+            first_sample, ring_offset = self._save_raw(channel.buffer_total, file_name + '.npy')
+            if channel.buffer_total_min is not None:
+                # Pushed with buffer_total: same samples at the same positions
+                self._save_raw(channel.buffer_total_min, file_name + '_MIN.npy')
+        with open(file_name + '.json', 'w') as fp:
+            json.dump(self.signal_header(channel, first_sample, ring_offset), fp)
+
+    def save_archive(self, subfolder_name = None, chunk_size = 2**16, codec = 'zlib', level = 6):
+        '''
+        Save the samples stored of every channel in compressed archives
+        (channelX.pcarc, see archive.ArchiveWriter) with the scale factors,
+        the calibrations and the metadata embedded. The samples are not consumed (see snapshot).
+        '''
+        saving_file_path = self._saving_path(subfolder_name)
+        metadata = self.load_metadata()
+        scales = {ch.name : self.channel_scale(ch) for ch in self.channels.values()}
+        calibrations = {ch.name : self.channel_calibration(ch) for ch in self.channels.values()}
+        start, signals = self.snapshot()
+        for name, samples in signals.items():
+            suffix = name.split('_CHANNEL_')[-1]
+            with ArchiveWriter(saving_file_path + f'/channel{suffix}{ARCHIVE_EXTENSION}',
+                               chunk_size, 
+                               codec, 
+                               level, 
+                               scales[name.removesuffix('_MIN')],
+                               dict(metadata, **{'First sample' : start}),
+                               calibrations[name.removesuffix('_MIN')]) as writer:
+                writer.write(samples)
+
+    def finalize_memmap(self):
+        '''
+        Write the samples of the memory mapped buffers to disk and make the
+        files loadable with np.load, with their header channelX.json as
+        save_signal. The samples are not rotated, see memmap in set_pico.
+        '''
+        for ch in self.channels.values():
+            ring_offset = ch.buffer_total.finalize(rotate = False)
+            if ch.buffer_total_min is not None:
+                ch.buffer_total_min.finalize(rotate = False)
+            first_sample = max(0, ch.buffer_total.written - ch.buffer_total.capacity)
+            with open(self.saving_dir + f'/channel{ch.name[-1]}.json', 'w') as fp:
+                json.dump(self.signal_header(ch, first_sample, ring_offset), fp)
 
     def save_signals(self, subfolder_name=None):
         for ch in self.channels.values():
@@ -227,43 +952,335 @@ class Picoscope4000():
 
     def save_intermediate_signals(self, subfolder_name):
         '''
-        Save part of the buffer. Typically used when autostop is False or one doesn't know the lenght of the signal to sample
+        Save part of the buffer. Typically used when autostop is False or one
+        doesn't know the length of the signal to sample.
+        The samples not read yet are saved raw with their header as in
+        save_signal and marked as read.
         '''
+        self._check_samples_stored()
+        saving_file_path = self._saving_path(subfolder_name)
+        if self.interleaved:
+            ring = self.buffer_interleaved
+            first_sample = max(ring.read, ring.written - ring.capacity)
+            rows = ring.empty()
         for ch in self.channels.values():
-            signal = self.convert2volts(ch.buffer_total.empty(),
-                                    ch.vrange)
-            # Convert to current (A) if the case
-            if ch.conv_factor is not None:
-                signal = np.multiply(signal, ch.conv_factor)
-            if subfolder_name is None:
-                saving_file_path = self.saving_dir
+            file_name = saving_file_path + f'/channel{ch.name[-1]}'
+            if self.interleaved:
+                self._save_columns(rows, ch, file_name)
             else:
-                saving_file_path = self.saving_dir + subfolder_name
-                Path(saving_file_path).mkdir(parents=True, exist_ok=True)
-            file_name = saving_file_path + f'/channel{ch.name[-1]}.npy'
-            np.save(file_name, signal)
+                first_sample = max(ch.buffer_total.read, ch.buffer_total.written - ch.buffer_total.capacity)
+                np.save(file_name + '.npy', ch.buffer_total.empty(), allow_pickle=False)
+                if ch.buffer_total_min is not None:
+                    np.save(file_name + '_MIN.npy', ch.buffer_total_min.empty(), allow_pickle=False)
+            with open(file_name + '.json', 'w') as fp:
+                json.dump(self.signal_header(ch, first_sample), fp)
             print(f'File saved {ch.name}')
         self.reset_buffer()
 
 
     def reset_buffer(self):
         self.nextSample = 0
+
+
+    def rearm(self, autoStop = True, blocking = True, saving_path = None, ranges = None, sampling_time = None):
+        '''
+        Start a new acquisition with the same settings and channels, without
+        calling set_pico and set_channel again: the buffers (also the ones
+        registered to the driver) are kept and only their cursors and the
+        counters are reset, so the dead time between repeated acquisitions
+        is mostly the start of the device (see arm_latency).
+        The previous acquisition must be completed or stopped. Its consumers
+        have been closed: the ones of set_pico (stream_to_disk, archive,
+        pyramid) are created again, the others must be added again.
+        The files of the previous acquisition are overwritten unless a new
+        saving_path is given (not possible with memmap = True).
+        The voltage ranges and the sampling time can change between the
+        acquisitions: only the channels whose range differs are set again on
+        the device (their calibration is compiled again for the new range).
+        The other settings of set_pico and set_channel (sizes, downsampling,
+        conversion factors, channels enabled) size the buffers kept, so they
+        need set_pico and set_channel to change.
+
+        Parameters:
+        ranges : dict
+            Channel (e.g. 'PS4000_CHANNEL_A') -> voltage range (e.g. 'PS4000_1V').
+        sampling_time : int
+            New sampling time, in the time unit of set_pico.
+        '''
+        if self.stream_monitor is not None:
+            if not self.autoStopOuter:
+                raise ValueError('The acquisition is still running, call stop before rearm.')
+            self.completed_event.wait()
+        if saving_path is not None:
+            if self.memmap:
+                raise ValueError('The memory mapped buffers are stored in the saving folder of set_pico.')
+            self.saving_dir = saving_path+'/pico_aquisition'
+            Path(self.saving_dir).mkdir(parents=True, exist_ok=True)
+        for channel, vrange in (ranges or {}).items():
+            ch = self.channels[channel[-1]]
+            if self.ps.PS4000_RANGE[vrange] != ch.vrange:
+                ch.vrange = self.ps.PS4000_RANGE[vrange]
+                if ch.calibration is not None:
+                    ch.lut = ch.calibration.lut(self.channelInputRanges[ch.vrange], self.max_adc.value)
+                self._enable_channel(ch)
+        if sampling_time is not None:
+            self.sampling_time.value = sampling_time
+            self.time_step = self.time_unit_in_seconds(sampling_time, self.time_unit)
+            self.sample_step = self.time_step*self.downsample_ratio
+            self.poll_scheduler = PollScheduler(self.sample_step, self.capture_size)
+        self.nextSample = 0
+        self.autoStopOuter = False
+        self.wasCalledBack = False
+        self.wake_event.clear()
+        self.block_start = 0
+        self.block_end = 0
+        self.dropped_blocks = 0
+        while self.filled_blocks:
+            self.filled_blocks.popleft().release()
+        if self.buffer_interleaved is not None:
+            self.buffer_interleaved.reset()
+        for ch in self.channels.values():
+            for ring in (ch.buffer_total, ch.buffer_total_min):
+                if ring is not None:
+                    ring.reset()
+        rotate_samples = self.writer.rotate_samples if self.writer is not None else None
+        rotate_seconds = self.writer.rotate_seconds if self.writer is not None else None
+        self.consumers = []
+        self._add_output_consumers(self.writer is not None,
+                                   self.archive is not None,
+                                   self.pyramid is not None,
+                                   rotate_samples,
+                                   rotate_seconds,
+                                   self.statistics is not None,
+                                   self.statistics.segment_size if self.statistics is not None else None)
+        if blocking:
+            self.run_streaming_blocking(autoStop)
+        else:
+            self.run_streaming_non_blocking(autoStop)
+
+
+    def arm_latency(self):
+        '''
+        Seconds from the start of the device (RunStreaming) to the callback
+        with the first samples, None if no samples are received yet.
+        '''
+        if self.first_sample_time is None or self.arm_time is None:
+            return None
+        return self.first_sample_time - self.arm_time
+
+
+    def set_rapid_block(self, n_segments, pre_trigger, post_trigger, timebase, trigger_channel = None,
+                        threshold = 0.0, direction = 'PS4000_RISING', auto_trigger_ms = 0):
+        '''
+        Prepare the rapid block mode, as alternative to the streaming: the
+        memory of the device is divided in n_segments segments and every
+        run_rapid_block fills all of them, one waveform of pre_trigger +
+        post_trigger samples per trigger, re-armed by the device in a few
+        microseconds. The channels are the ones set with set_channel, with
+        their conversion (see convert_segments). The waveforms are
+        transferred in segments_data, a (n_segments, n_channels, samples)
+        int16 array allocated here once and reused by every capture.
+
+        Parameters:
+        n_segments : int
+            Waveforms captured by every run_rapid_block.
+        pre_trigger, post_trigger : int
+            Samples before and after (trigger included) the trigger.
+        timebase : int
+            Timebase of the device (see the programmer's guide), the
+            sampling interval is in block_sample_step.
+        trigger_channel : str
+            Channel of the simple trigger, e.g. 'PS4000_CHANNEL_A'. If None the
+            waveforms are captured without waiting for a trigger.
+        threshold : float
+            Level of the trigger in volts (or in the unit of the conversion
+            factor), see volts_to_adc.
+        direction : str
+            'PS4000_RISING', 'PS4000_FALLING', 'PS4000_ABOVE', 'PS4000_BELOW'
+            or 'PS4000_RISING_OR_FALLING', on the ADC numbers (opposite to
+            the volts with the negative scale of the channels).
+        auto_trigger_ms : int
+            Milliseconds after which the device triggers anyway, 0 to wait
+            for the trigger forever.
+        '''
+        n_samples = pre_trigger + post_trigger
+        max_samples = ctypes.c_int32()
+        self.status["memorySegments"] = self.ps.ps4000MemorySegments(self.handle, n_segments, ctypes.byref(max_samples))
+        assert_pico_ok(self.status["memorySegments"])
+        if n_samples > max_samples.value:
+            raise ValueError(f'The segments hold at most {max_samples.value} samples.')
+        self.status["setNoOfCaptures"] = self.ps.ps4000SetNoOfCaptures(self.handle, n_segments)
+        assert_pico_ok(self.status["setNoOfCaptures"])
+        time_interval_ns = ctypes.c_float()
+        self.status["getTimebase2"] = self.ps.ps4000GetTimebase2(self.handle,
+                                                                 timebase,
+                                                                 n_samples,
+                                                                 ctypes.byref(time_interval_ns),
+                                                                 1, # oversample
+                                                                 ctypes.byref(max_samples),
+                                                                 0) # segmentIndex
+        assert_pico_ok(self.status["getTimebase2"])
+        if trigger_channel is None:
+            enabled, source, adc_threshold = 0, self.ps.PS4000_CHANNEL['PS4000_CHANNEL_A'], 0
+        else:
+            enabled, source = 1, self.ps.PS4000_CHANNEL[trigger_channel]
+            adc_threshold = self.volts_to_adc(trigger_channel, threshold)
+        self.status["trigger"] = self.ps.ps4000SetSimpleTrigger(self.handle,
+                                                                enabled,
+                                                                source,
+                                                                adc_threshold,
+                                                                PS4000_THRESHOLD_DIRECTION[direction],
+                                                                0, # delay
+                                                                auto_trigger_ms)
+        assert_pico_ok(self.status["trigger"])
+        self.n_segments = n_segments
+        self.pre_trigger = pre_trigger
+        self.post_trigger = post_trigger
+        self.timebase = timebase
+        self.block_sample_step = time_interval_ns.value*1e-9
+        shape = (n_segments, len(self.channels), n_samples)
+        if self.segments_data is None or self.segments_data.shape != shape:
+            self.segments_data = np.zeros(shape, dtype=np.int16)
+            self.trigger_subsample_offsets = np.zeros(n_segments) # Seconds
+            self.trigger_times = np.zeros(n_segments) # Seconds from the trigger of the first segment
+            self.segment_overflows = np.zeros(n_segments, dtype=np.int16)
+        self._register_segment_buffers()
+
+
+    def _register_segment_buffers(self):
+        '''
+        Give the driver the rows of segments_data, one per segment and
+        channel. Segment 0 replaces the buffers of the streaming, registered
+        again by start_streaming.
+        '''
+        for i, ch in enumerate(self.channels.values()):
+            for segment in range(self.n_segments):
+                status = self.ps.ps4000SetDataBufferBulk(self.handle,
+                                                         self.ps.PS4000_CHANNEL[ch.name],
+                                                         self.segments_data[segment, i].ctypes.data_as(
+                                                             ctypes.POINTER(ctypes.c_int16)),
+                                                         self.segments_data.shape[2],
+                                                         segment)
+                assert_pico_ok(status)
+        self.segment_buffers_registered = True
+
+
+    def run_rapid_block(self, timeout = None):
+        '''
+        Capture the waveforms of all the segments (see set_rapid_block) and
+        transfer them with a single bulk call in segments_data. Return
+        (segments_data, trigger_times). The driver of the PS4000 series has
+        no time stamp of the segments (GetTriggerInfoBulk of the PS5000A
+        series), so trigger_times are NaN after the first segment: only
+        trigger_subsample_offsets, the seconds between the trigger and the
+        sample at pre_trigger of every waveform, are given by the driver.
+        The overflows of every segment are in segment_overflows.
+        If the segments are not filled within timeout seconds the device is
+        stopped and TimeoutError is raised.
+        '''
+        if self.segments_data is None:
+            raise ValueError('The rapid block mode is not set, call set_rapid_block first.')
+        if not self.segment_buffers_registered:
+            self._register_segment_buffers()
+        time_indisposed_ms = ctypes.c_int32()
+        self.status["runBlock"] = self.ps.ps4000RunBlock(self.handle,
+                                                         self.pre_trigger,
+                                                         self.post_trigger,
+                                                         self.timebase,
+                                                         1, # oversample
+                                                         ctypes.byref(time_indisposed_ms),
+                                                         0, # segmentIndex
+                                                         None, # The end is polled with IsReady
+                                                         None)
+        assert_pico_ok(self.status["runBlock"])
+        ready = ctypes.c_int16(0)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            self.status["isReady"] = self.ps.ps4000IsReady(self.handle, ctypes.byref(ready))
+            assert_pico_ok(self.status["isReady"])
+            if ready.value:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                self.stop()
+                raise TimeoutError('The segments were not filled before the timeout.')
+            time.sleep(1e-3)
+        n_samples = ctypes.c_uint32(self.segments_data.shape[2])
+        overflows = (ctypes.c_int16*self.n_segments)()
+        self.status["getValuesBulk"] = self.ps.ps4000GetValuesBulk(self.handle,
+                                                                   ctypes.byref(n_samples),
+                                                                   0,
+                                                                   self.n_segments - 1,
+                                                                   overflows)
+        assert_pico_ok(self.status["getValuesBulk"])
+        self.segment_overflows[:] = overflows
+        times = (ctypes.c_int64*self.n_segments)()
+        time_units = (ctypes.c_int32*self.n_segments)()
+        self.status["triggerTimeOffsets"] = self.ps.ps4000GetValuesTriggerTimeOffsetBulk64(self.handle,
+                                                                                           times,
+                                                                                           time_units,
+                                                                                           0,
+                                                                                           self.n_segments - 1)
+        assert_pico_ok(self.status["triggerTimeOffsets"])
+        self.trigger_subsample_offsets[:] = [self.time_unit_in_seconds(t, unit)
+                                             for t, unit in zip(times, time_units, strict=True)]
+        self.trigger_times[0] = 0.0
+        self.trigger_times[1:] = np.nan
+        return self.segments_data, self.trigger_times
+
+
+    def convert_segments(self, out = None):
+        '''
+        Convert segments_data to physical values with the scale (or the
+        lookup table) of every channel, in a single pass. If out is given
+        it must be a float32 array of the same shape.
+        '''
+        if out is None:
+            out = np.empty(self.segments_data.shape, dtype = np.float32)
+        elif out.dtype != np.float32 or out.shape != self.segments_data.shape:
+            raise ValueError(f'out must be a float32 array of shape {self.segments_data.shape}.')
+        for i, ch in enumerate(self.channels.values()):
+            self.convert_samples(ch, self.segments_data[:, i], out = out[:, i])
+        return out
+
+
+    def save_segments(self, subfolder_name = None):
+        '''
+        Save segments_data raw in rapid_block.npy and in rapid_block.json
+        the settings, the trigger times and offsets, the overflows and the header of
+        every channel (see signal_header).
+        '''
+        file_name = self._saving_path(subfolder_name) + '/rapid_block'
+        np.save(file_name + '.npy', self.segments_data)
+        header = {
+            'Segments' : self.n_segments,
+            'Pre trigger samples' : self.pre_trigger,
+            'Post trigger samples' : self.post_trigger,
+            'Timebase' : self.timebase,
+            'Sampling time (s)' : self.block_sample_step,
+            'Trigger times (s)' : self.trigger_times.tolist(),
+            'Trigger subsample offsets (s)' : self.trigger_subsample_offsets.tolist(),
+            'Overflows' : self.segment_overflows.tolist(),
+            'Channels' : [self.signal_header(ch) for ch in self.channels.values()],
+        }
+        with open(file_name + '.json', 'w') as fp:
+            json.dump(header, fp)
     
 
     def stop(self):
-        self.status["stop"] = ps.ps4000Stop(self.handle)
+        self.status["stop"] = self.ps.ps4000Stop(self.handle)
         assert_pico_ok(self.status["stop"])
         self.autoStopOuter = True
+        self.wake_event.set()
         print("> Pico msg: pico stopped!")
     
     
     def disconnect(self):
-        self.status["close"] = ps.ps4000CloseUnit(self.handle)
+        self.status["close"] = self.ps.ps4000CloseUnit(self.handle)
         assert_pico_ok(self.status["close"])
         print("> Pico msg: Device disconnected.")
     
     
-    def set_channel(self, channel, vrange, signal_name = None, conv_factor = None): 
+    def set_channel(self, channel, vrange, signal_name = None, conv_factor = None, calibration = None): 
         '''
         Set channel of the connetted picoscope.
         Parameters:
@@ -294,59 +1311,130 @@ class Picoscope4000():
             
         index of the channelInputRanges list which contains values in mV
         channelInputRanges = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+        calibration : calibration.Calibration
+            Polarity, offset, gain and curve converting the samples instead
+            of the negative linear scale and conv_factor (see
+            convert_samples). It is compiled here into a lookup table.
         '''
+        if calibration is not None and conv_factor is not None:
+            raise ValueError('conv_factor is included in the gain of the calibration.')
 
 
+        if self.buffer_pool:
+            pool = BufferPool(self.buffer_pool, self.capture_size)
+            buffer_small = pool.acquire()
+            buffer_total = None # Blocks are handed over by reference, see get_block
+        elif self.interleaved:
+            pool = None
+            buffer_small = np.zeros(shape=self.capture_size, dtype=np.int16) # ADC is 16 bit 
+            buffer_total = None # All the channels are stored in buffer_interleaved
+        else:
+            pool = None
+            buffer_small = np.zeros(shape=self.capture_size, dtype=np.int16) # ADC is 16 bit 
+            buffer_total = self._make_total_buffer(f'channel{channel[-1]}.npy')
         self.channels[channel[-1]] = PicoChannel(channel, 
-                                                 ps.PS4000_RANGE[vrange],
-                                                 np.zeros(shape=self.capture_size, dtype=np.int16), # ADC is 16 bit 
-                                                 np.zeros(shape=self.capture_size*self.number_captures, dtype=np.int16),
+                                                 self.ps.PS4000_RANGE[vrange],
+                                                 buffer_small,
+                                                 buffer_total,
                                                  {},
                                                  conv_factor,
-                                                 signal_name)
+                                                 signal_name,
+                                                 pool,
+                                                 calibration = calibration)
         # Give an alias to the object for an easier reference
         ch = self.channels[channel[-1]]
-        ch.status["set_channel"] = ps.ps4000SetChannel(self.handle,
-                                                       ps.PS4000_CHANNEL[ch.name],
-                                                       True,  # In the example, 1 is used
-                                                       1,
-                                                       ch.vrange)
+        if calibration is not None:
+            ch.lut = calibration.lut(self.channelInputRanges[ch.vrange], self.max_adc.value)
+        if self.aggregate:
+            ch.buffer_small_min = np.zeros(shape=self.capture_size, dtype=np.int16)
+            if not self.interleaved:
+                ch.buffer_total_min = self._make_total_buffer(f'channel{channel[-1]}_MIN.npy')
+        self._enable_channel(ch)
+        self._register_buffer(ch)
+
+
+    def _enable_channel(self, ch):
+        '''
+        Enable a channel on the device with its voltage range.
+        '''
+        ch.status["set_channel"] = self.ps.ps4000SetChannel(self.handle,
+                                                            self.ps.PS4000_CHANNEL[ch.name],
+                                                            True,  # In the example, 1 is used
+                                                            1,
+                                                            ch.vrange)
         assert_pico_ok(ch.status["set_channel"])
 
+
+    def _make_total_buffer(self, file_name):
+        '''
+        Allocate the buffer for the complete sampled signal of a channel, in
+        memory or, with memmap = True, in file_name in the saving folder.
+        '''
+        size = self.capture_size*self.number_captures
+        if self.memmap:
+            return RingBuffer.open_memmap(self.saving_dir + '/' + file_name, size, dtype=np.int16)
+        return RingBuffer(size, dtype=np.int16)
+
+
+    def _register_buffer(self, ch):
         '''Allocate a buffer in the memory for store the complete sampled
         signal and gives the pointer of the buffer to the driver
         buffer_total must be Numpy array
         '''
-        ch.status["setDataBuffers"] = ps.ps4000SetDataBuffers(self.handle,  # !!! Perché la funzione con la s???
-                                                              ps.PS4000_CHANNEL[ch.name],
-                                                              ch.buffer_small.ctypes.data_as(
-                                                                  ctypes.POINTER(ctypes.c_int16)),
-                                                              None,
-                                                              self.capture_size)
+        if self.ratio_mode == PS4000_RATIO_MODE['PS4000_RATIO_MODE_NONE']:
+            # !!! Perché la funzione con la s???
+            ch.status["setDataBuffers"] = self.ps.ps4000SetDataBuffers(self.handle,
+                                                                       self.ps.PS4000_CHANNEL[ch.name],
+                                                                       ch.buffer_small.ctypes.data_as(
+                                                                           ctypes.POINTER(ctypes.c_int16)),
+                                                                       None,
+                                                                       self.capture_size)
+        else:
+            # In aggregate mode the second buffer receives the minimum values
+            buffer_min = None
+            if self.aggregate:
+                buffer_min = ch.buffer_small_min.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+            ch.status["setDataBuffers"] = self.ps.ps4000SetDataBuffersWithMode(self.handle,
+                                                                               self.ps.PS4000_CHANNEL[ch.name],
+                                                                               ch.buffer_small.ctypes.data_as(
+                                                                                   ctypes.POINTER(ctypes.c_int16)),
+                                                                               buffer_min,
+                                                                               self.capture_size,
+                                                                               self.ratio_mode)
         assert_pico_ok(ch.status["setDataBuffers"])
         
     
     def empty_buffers(self):
+        self._check_samples_stored()
+        if self.interleaved and self.buffer_interleaved is not None:
+            self.buffer_interleaved.empty()
+            return
         for ch in self.channels.values():
             ch.buffer_total.empty()
+            if ch.buffer_total_min is not None:
+                ch.buffer_total_min.empty()
     
 
     def bandwith_limiter(self, channel, enabled = 1):
-        self.status["setBandwidthFilter"] = ps.ps4000SetBwFilter(self.handle,
-                                                                 ps.PS4000_CHANNEL[channel],
-                                                                 enabled)
+        self.status["setBandwidthFilter"] = self.ps.ps4000SetBwFilter(self.handle,
+                                                                      self.ps.PS4000_CHANNEL[channel],
+                                                                      enabled)
         assert_pico_ok(self.status["setBandwidthFilter"])
     
     
-    def save_metadata(self, autoStop):
+    def get_metadata(self, autoStop):
         metadata_dict = {
             'Starting time' : datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            'Device serial': self.serial,
-            'Resolution': self.resolution,
+            'Device serial': self.serial.decode() if isinstance(self.serial, bytes) else self.serial,
             'Circular buffer size (Sa)': self.samples_total,
             'Driver buffer size (Sa)' : self.capture_size,
             'Sampling time (s)': self.time_step,
+            'Downsampling ratio': self.downsample_ratio,
+            'Downsampling mode': self.ratio_mode,
             'Auto stop' : autoStop,
+            'Memory mapped buffers' : self.memmap,
+            'Max ADC' : self.max_adc.value,
         }
         cahnnels_metadata = dict()
         for ch in self.channels.values():
@@ -354,10 +1442,30 @@ class Picoscope4000():
                 'Voltage range' : ch.vrange,
                 'Converting factor' : ch.conv_factor,
                 'Signal name' : ch.signal_name,
+                'Calibration' : ch.calibration.to_dict() if ch.calibration is not None else None,
             }
             cahnnels_metadata.update(
                 {ch.name : channel_info}
             )
         metadata_dict.update(cahnnels_metadata)
+        return metadata_dict
+
+
+    def save_metadata(self, autoStop):
+        with open(self.saving_dir +'/metadata_pico.json', 'w') as fp:
+            json.dump(self.get_metadata(autoStop), fp)
+
+
+    def load_metadata(self):
+        with open(self.saving_dir +'/metadata_pico.json') as fp:
+            return json.load(fp)
+
+
+    def update_metadata(self, entries):
+        '''
+        Add the entries (dict) to the metadata file saved at the start.
+        '''
+        metadata_dict = self.load_metadata()
+        metadata_dict.update(entries)
         with open(self.saving_dir +'/metadata_pico.json', 'w') as fp:
             json.dump(metadata_dict, fp)
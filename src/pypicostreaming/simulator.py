@@ -0,0 +1,516 @@
+import ctypes
+import time
+import numpy as np
+
+
+PICO_OK = 0
+
+TIME_UNIT_SECONDS = [1e-15, 1e-12, 1e-9, 1e-6, 1e-3, 1]
+
+# Same prototype of StreamingReadyType in picosdk
+StreamingReadyType = ctypes.CFUNCTYPE(None,
+                                      ctypes.c_int16,
+                                      ctypes.c_int32,
+                                      ctypes.c_uint32,
+                                      ctypes.c_int16,
+                                      ctypes.c_uint32,
+                                      ctypes.c_int16,
+                                      ctypes.c_int16,
+                                      ctypes.c_void_p)
+
+
+# Same structure of PS5000A_TRIGGER_INFO in picosdk
+class TriggerInfo(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('status', ctypes.c_uint32),
+                ('segmentIndex', ctypes.c_uint32),
+                ('triggerIndex', ctypes.c_uint32),
+                ('triggerTime', ctypes.c_int64),
+                ('timeUnits', ctypes.c_int16),
+                ('reserved0', ctypes.c_int16),
+                ('timeStampCounter', ctypes.c_uint64)]
+
+
+def make_enum(members):
+    return {member: i for i, member in enumerate(members)}
+
+
+class SimulatedPicoscope:
+    def __init__(self, driver_buffer_size = 2**22, table_size = 2**16, seed = None):
+        '''
+        Software emulator of the streaming functions of the PicoScope drivers.
+        It replaces the picosdk module (see the driver argument of the
+        Picoscope classes) to run the streaming without a device attached.
+
+        Samples are produced in real time at the sampling interval requested
+        in RunStreaming. Every GetStreamingLatestValues copies the samples
+        produced since the previous call in the registered buffers (wrapping
+        at their end as the real driver) and calls the callback once.
+        If the application does not poll for longer than the driver buffer
+        can hold, the oldest samples are lost and counted in lost_samples.
+        The seconds spent producing the samples are counted in copy_time, to
+        tell the cost of the simulation from the one of the application.
+
+        The rapid block mode (MemorySegments, RunBlock, GetValuesBulk...) is
+        emulated as well: the waveforms of the segments are taken from the
+        same tables, aligned on the crossings of the simple trigger, with the
+        time stamps of the triggers (GetTriggerInfoBulk, PS5000A series only).
+
+        Parameters:
+        driver_buffer_size : int
+            Samples per channel that the driver can keep waiting for a poll,
+            also the memory shared by the segments in rapid block mode.
+        table_size : int
+            Length of the precomputed waveform repeated in the stream.
+        seed : int
+            Seed of the noise generator.
+        '''
+        self.driver_buffer_size = driver_buffer_size
+        self.table_size = table_size
+        self.rng = np.random.default_rng(seed)
+        self.waveforms = {} # Channel index -> waveform parameters
+        self.channels = {}  # Channel index -> dictionary with range and enabled state
+        self.buffers = {}   # Channel index -> (buffer max, buffer min)
+        self.tables = {}
+        self.streaming = False
+        self.lost_samples = 0
+        self.callbacks = 0
+        self.copy_time = 0.0
+        self._stall = 0.0
+        self._overflow_mask = 0
+        self.n_segments = 1
+        self.n_captures = 1
+        self.trigger = None
+        self.segment_buffers = {} # (channel index, segment) -> buffer of the rapid block mode
+        self._block = None
+
+
+    def set_waveform(self, channel, kind = 'sine', frequency = 50.0, amplitude = 0.5, offset = 0.0, noise = 0.0):
+        '''
+        Define the signal produced on a channel (index or letter).
+        kind : 'sine', 'square', 'triangle', 'dc' or 'noise'
+        amplitude, offset, noise : fractions of the full scale. Values
+            exceeding the full scale are clipped and flagged as overflow.
+        The frequency is rounded so that an integer number of periods fits in
+        the waveform table.
+        '''
+        if isinstance(channel, str):
+            channel = ord(channel[-1]) - ord('A')
+        self.waveforms[channel] = dict(kind=kind, frequency=frequency, amplitude=amplitude,
+                                       offset=offset, noise=noise)
+
+
+    def inject_stall(self, seconds):
+        '''
+        Block the next GetStreamingLatestValues for the given time, as a
+        slow USB transfer would do.
+        '''
+        self._stall = seconds
+
+
+    def inject_overflow(self, channel_mask = 0xFF):
+        '''
+        Flag a voltage overflow on the channels of the bit mask in the next
+        callback.
+        '''
+        self._overflow_mask |= channel_mask
+
+
+    def _make_table(self, channel, sample_time):
+        params = self.waveforms.get(channel, dict(kind='sine', frequency=50.0, amplitude=0.5, offset=0.0, noise=0.0))
+        n = np.arange(self.table_size)
+        periods = max(1, round(self.table_size*params['frequency']*sample_time))
+        phase = n*periods/self.table_size
+        if params['kind'] == 'sine':
+            wave = np.sin(2*np.pi*phase)
+        elif params['kind'] == 'square':
+            wave = np.where(phase % 1 < 0.5, 1.0, -1.0)
+        elif params['kind'] == 'triangle':
+            wave = 4*np.abs(phase % 1 - 0.5) - 1
+        elif params['kind'] == 'noise':
+            wave = self.rng.uniform(-1, 1, self.table_size)
+        else:
+            wave = np.zeros(self.table_size)
+        wave = params['amplitude']*wave + params['offset']
+        if params['noise']:
+            wave += self.rng.normal(0, params['noise'], self.table_size)
+        clipped = bool((np.abs(wave) > 1).any())
+        table = np.round(np.clip(wave, -1, 1)*self.max_adc).astype(np.int16)
+        return table, clipped
+
+
+    def _copy_from_table(self, table, destination, first_sample):
+        position = first_sample % self.table_size
+        done = 0
+        while done < len(destination):
+            n = min(len(destination) - done, self.table_size - position)
+            destination[done:done + n] = table[position:position + n]
+            done += n
+            position = 0
+
+
+    def _open_unit(self, handle):
+        handle._obj.value = 1
+        return PICO_OK
+
+
+    def _set_channel(self, channel, enabled, vrange):
+        self.channels[channel] = dict(enabled=bool(enabled), range=vrange)
+        return PICO_OK
+
+
+    def _set_data_buffers(self, channel, buffer_max, buffer_min, length):
+        buffer_max = np.ctypeslib.as_array(buffer_max, shape=(length,)) if buffer_max else None
+        buffer_min = np.ctypeslib.as_array(buffer_min, shape=(length,)) if buffer_min else None
+        self.buffers[channel] = (buffer_max, buffer_min)
+        self.buffer_length = length
+        return PICO_OK
+
+
+    def _run_streaming(self, sample_interval, time_units, max_samples, auto_stop, ratio):
+        self.sample_time = sample_interval._obj.value*TIME_UNIT_SECONDS[time_units]*ratio
+        self.max_samples = max_samples//ratio
+        self.auto_stop = bool(auto_stop)
+        self.tables = {channel: self._make_table(channel, self.sample_time) for channel in self.buffers}
+        self.delivered = 0
+        self.write_index = 0
+        self.lost_samples = 0
+        self.callbacks = 0
+        self.copy_time = 0.0
+        self.start_time = time.perf_counter()
+        self.streaming = True
+        return PICO_OK
+
+
+    def _get_streaming_latest_values(self, handle, callback, param):
+        if self._stall:
+            time.sleep(self._stall)
+            self._stall = 0.0
+        if not self.streaming:
+            return PICO_OK
+        produced = int((time.perf_counter() - self.start_time)/self.sample_time)
+        if self.auto_stop:
+            produced = min(produced, self.max_samples)
+        available = produced - self.delivered
+        if available > self.driver_buffer_size:
+            # The application did not keep up: the oldest samples are lost
+            lost = available - self.driver_buffer_size
+            self.lost_samples += lost
+            self.delivered += lost
+            available = self.driver_buffer_size
+        n = min(available, self.buffer_length - self.write_index)
+        if n <= 0:
+            return PICO_OK
+        overflow = self._overflow_mask
+        self._overflow_mask = 0
+        copy_start = time.perf_counter()
+        for channel, (buffer_max, buffer_min) in self.buffers.items():
+            if not self.channels.get(channel, {}).get('enabled', True):
+                continue
+            table, clipped = self.tables[channel]
+            self._copy_from_table(table, buffer_max[self.write_index:self.write_index + n], self.delivered)
+            if buffer_min is not None:
+                buffer_min[self.write_index:self.write_index + n] = buffer_max[self.write_index:self.write_index + n]
+            if clipped:
+                overflow |= 1 << channel
+        self.copy_time += time.perf_counter() - copy_start
+        start_index = self.write_index
+        self.delivered += n
+        self.write_index = (self.write_index + n) % self.buffer_length
+        auto_stop = self.auto_stop and self.delivered >= self.max_samples
+        if auto_stop:
+            self.streaming = False
+        self.callbacks += 1
+        callback(handle, n, start_index, overflow, 0, 0, auto_stop, param)
+        return PICO_OK
+
+
+    def _memory_segments(self, n_segments, max_samples):
+        self.n_segments = n_segments
+        max_samples._obj.value = self.driver_buffer_size//n_segments
+        return PICO_OK
+
+
+    def _set_no_of_captures(self, n_captures):
+        self.n_captures = n_captures
+        return PICO_OK
+
+
+    def _get_timebase(self, timebase, time_interval_ns, max_samples):
+        time_interval_ns._obj.value = self._timebase_interval(timebase)*1e9
+        max_samples._obj.value = self.driver_buffer_size//self.n_segments
+        return PICO_OK
+
+
+    def _set_simple_trigger(self, enable, source, threshold, direction):
+        self.trigger = dict(source=source, threshold=threshold, direction=direction) if enable else None
+        return PICO_OK
+
+
+    def _set_segment_buffer(self, channel, buffer, length, segment):
+        self.segment_buffers[(channel, segment)] = np.ctypeslib.as_array(buffer, shape=(length,))
+        return PICO_OK
+
+
+    def _run_block(self, pre_trigger, post_trigger, timebase):
+        sample_time = self._timebase_interval(timebase)
+        n_samples = pre_trigger + post_trigger
+        self._block = dict(pre_trigger=pre_trigger, n_samples=n_samples, sample_time=sample_time,
+                           ready_time=time.perf_counter() + self.n_captures*n_samples*sample_time,
+                           first_samples={})
+        return PICO_OK
+
+
+    def _is_ready(self, ready):
+        ready._obj.value = int(self._block is not None and time.perf_counter() >= self._block['ready_time'])
+        return PICO_OK
+
+
+    def _trigger_samples(self, table):
+        # Indices of the table where the trigger condition starts
+        if self.trigger is None:
+            return np.empty(0, dtype=np.intp)
+        above = np.append(table, table[0]) >= self.trigger['threshold']
+        rising = np.flatnonzero(~above[:-1] & above[1:]) + 1
+        falling = np.flatnonzero(above[:-1] & ~above[1:]) + 1
+        direction = self.trigger['direction']
+        if direction in (0, 2): # Above, rising
+            return rising
+        if direction in (1, 3): # Below, falling
+            return falling
+        return np.sort(np.concatenate((rising, falling)))
+
+
+    def _get_values_bulk(self, n_samples, first_segment, last_segment, overflow):
+        block = self._block
+        n = min(n_samples._obj.value, block['n_samples'])
+        tables = {channel: self._make_table(channel, block['sample_time']) for channel in self.channels}
+        triggers = np.empty(0, dtype=np.intp)
+        if self.trigger is not None and self.trigger['source'] in tables:
+            triggers = self._trigger_samples(tables[self.trigger['source']][0])
+        for segment in range(first_segment, last_segment + 1):
+            if len(triggers):
+                periods, i = divmod(segment, len(triggers))
+                first_sample = triggers[i] + periods*self.table_size - block['pre_trigger']
+            else:
+                first_sample = segment*block['n_samples']
+            block['first_samples'][segment] = first_sample
+            for channel, (table, clipped) in tables.items():
+                buffer = self.segment_buffers.get((channel, segment))
+                if buffer is not None:
+                    self._copy_from_table(table, buffer[:n], first_sample)
+                if clipped:
+                    overflow[segment - first_segment] |= 1 << channel
+        n_samples._obj.value = n
+        return PICO_OK
+
+
+    def _trigger_time_offsets(self, times, time_units, first_segment, last_segment):
+        # The simulated triggers are exactly on a sample
+        for i in range(last_segment - first_segment + 1):
+            times[i] = 0
+            time_units[i] = 2 # ns
+        return PICO_OK
+
+
+    def _trigger_info(self, info, first_segment, last_segment):
+        # Time stamp counter in samples since the trigger of the first segment
+        first_samples = self._block['first_samples']
+        for i, segment in enumerate(range(first_segment, last_segment + 1)):
+            info[i].status = PICO_OK
+            info[i].segmentIndex = segment
+            info[i].timeStampCounter = first_samples[segment] - first_samples[0]
+        return PICO_OK
+
+
+    def _stop(self):
+        self.streaming = False
+        return PICO_OK
+
+
+class SimulatedPs5000a(SimulatedPicoscope):
+    '''
+    Emulator with the function names and constants of picosdk.ps5000a.
+    Usage: Picoscope5000a('PS5000A_DR_16BIT', driver = SimulatedPs5000a())
+    '''
+    PS5000A_DEVICE_RESOLUTION = make_enum(['PS5000A_DR_8BIT', 'PS5000A_DR_12BIT', 'PS5000A_DR_14BIT',
+                                           'PS5000A_DR_15BIT', 'PS5000A_DR_16BIT'])
+    PS5000A_COUPLING = make_enum(['PS5000A_AC', 'PS5000A_DC'])
+    PS5000A_CHANNEL = make_enum(['PS5000A_CHANNEL_A', 'PS5000A_CHANNEL_B', 'PS5000A_CHANNEL_C',
+                                 'PS5000A_CHANNEL_D'])
+    PS5000A_RANGE = make_enum(['PS5000A_10MV', 'PS5000A_20MV', 'PS5000A_50MV', 'PS5000A_100MV',
+                               'PS5000A_200MV', 'PS5000A_500MV', 'PS5000A_1V', 'PS5000A_2V', 'PS5000A_5V',
+                               'PS5000A_10V', 'PS5000A_20V', 'PS5000A_50V'])
+    PS5000A_RATIO_MODE = {
+        'PS5000A_RATIO_MODE_NONE': 0,
+        'PS5000A_RATIO_MODE_AGGREGATE': 1,
+        'PS5000A_RATIO_MODE_DECIMATE': 2,
+        'PS5000A_RATIO_MODE_AVERAGE': 4,
+    }
+    PS5000A_TIME_UNITS = make_enum(['PS5000A_FS', 'PS5000A_PS', 'PS5000A_NS', 'PS5000A_US', 'PS5000A_MS',
+                                    'PS5000A_S'])
+    PS5000A_THRESHOLD_DIRECTION = make_enum(['PS5000A_ABOVE', 'PS5000A_BELOW', 'PS5000A_RISING', 'PS5000A_FALLING',
+                                             'PS5000A_RISING_OR_FALLING'])
+    StreamingReadyType = StreamingReadyType
+    PS5000A_TRIGGER_INFO = TriggerInfo
+    max_adc = 32767
+
+    def ps5000aOpenUnit(self, handle, serial, resolution):
+        # As the device, the 8 bit samples are scaled to 32512 (127*256)
+        if resolution == self.PS5000A_DEVICE_RESOLUTION['PS5000A_DR_8BIT']:
+            self.max_adc = 32512
+        return self._open_unit(handle)
+
+    def ps5000aMaximumValue(self, handle, value):
+        value._obj.value = self.max_adc
+        return PICO_OK
+
+    def ps5000aEnumerateUnits(self, count = None, serials = None, serialLth = None):
+        return PICO_OK
+
+    def ps5000aSetChannel(self, handle, channel, enabled, coupling, vrange, analogueOffset):
+        return self._set_channel(channel, enabled, vrange)
+
+    def ps5000aSetDataBuffer(self, handle, channel, buffer, bufferLth, segmentIndex, mode):
+        self._set_segment_buffer(channel, buffer, bufferLth, segmentIndex)
+        if segmentIndex != 0:
+            return PICO_OK
+        return self._set_data_buffers(channel, buffer, None, bufferLth)
+
+    def ps5000aSetDataBuffers(self, handle, channel, bufferMax, bufferMin, bufferLth, segmentIndex, mode):
+        return self._set_data_buffers(channel, bufferMax, bufferMin, bufferLth)
+
+    def ps5000aRunStreaming(self, handle, sampleInterval, timeUnits, maxPreTriggerSamples,
+                            maxPostTriggerSamples, autoStop, downSampleRatio, downSampleRatioMode,
+                            overviewBufferSize):
+        return self._run_streaming(sampleInterval, timeUnits, maxPreTriggerSamples + maxPostTriggerSamples,
+                                   autoStop, downSampleRatio)
+
+    def ps5000aGetStreamingLatestValues(self, handle, lpPs5000aReady, pParameter):
+        return self._get_streaming_latest_values(handle, lpPs5000aReady, pParameter)
+
+    def _timebase_interval(self, timebase):
+        # Formula of the 8 bit resolution
+        return 2**timebase/1e9 if timebase < 3 else (timebase - 2)/125e6
+
+    def ps5000aMemorySegments(self, handle, nSegments, nMaxSamples):
+        return self._memory_segments(nSegments, nMaxSamples)
+
+    def ps5000aSetNoOfCaptures(self, handle, nCaptures):
+        return self._set_no_of_captures(nCaptures)
+
+    def ps5000aGetTimebase2(self, handle, timebase, noSamples, timeIntervalNanoseconds, maxSamples, segmentIndex):
+        return self._get_timebase(timebase, timeIntervalNanoseconds, maxSamples)
+
+    def ps5000aSetSimpleTrigger(self, handle, enable, source, threshold, direction, delay, autoTrigger_ms):
+        return self._set_simple_trigger(enable, source, threshold, direction)
+
+    def ps5000aRunBlock(self, handle, noOfPreTriggerSamples, noOfPostTriggerSamples, timebase,
+                        timeIndisposedMs, segmentIndex, lpReady, pParameter):
+        return self._run_block(noOfPreTriggerSamples, noOfPostTriggerSamples, timebase)
+
+    def ps5000aIsReady(self, handle, ready):
+        return self._is_ready(ready)
+
+    def ps5000aGetValuesBulk(self, handle, noOfSamples, fromSegmentIndex, toSegmentIndex, downSampleRatio,
+                             downSampleRatioMode, overflow):
+        return self._get_values_bulk(noOfSamples, fromSegmentIndex, toSegmentIndex, overflow)
+
+    def ps5000aGetValuesTriggerTimeOffsetBulk64(self, handle, times, timeUnits, fromSegmentIndex, toSegmentIndex):
+        return self._trigger_time_offsets(times, timeUnits, fromSegmentIndex, toSegmentIndex)
+
+    def ps5000aGetTriggerInfoBulk(self, handle, triggerInfo, fromSegmentIndex, toSegmentIndex):
+        return self._trigger_info(triggerInfo, fromSegmentIndex, toSegmentIndex)
+
+    def ps5000aStop(self, handle):
+        return self._stop()
+
+    def ps5000aCloseUnit(self, handle):
+        return self._stop()
+
+
+class SimulatedPs4000(SimulatedPicoscope):
+    '''
+    Emulator with the function names and constants of picosdk.ps4000.
+    Usage: Picoscope4000(driver = SimulatedPs4000())
+    '''
+    PS4000_CHANNEL = make_enum(['PS4000_CHANNEL_A', 'PS4000_CHANNEL_B', 'PS4000_CHANNEL_C', 'PS4000_CHANNEL_D'])
+    PS4000_RANGE = make_enum(['PS4000_10MV', 'PS4000_20MV', 'PS4000_50MV', 'PS4000_100MV', 'PS4000_200MV',
+                              'PS4000_500MV', 'PS4000_1V', 'PS4000_2V', 'PS4000_5V', 'PS4000_10V',
+                              'PS4000_20V', 'PS4000_50V', 'PS4000_100V'])
+    PS4000_TIME_UNITS = make_enum(['PS4000_FS', 'PS4000_PS', 'PS4000_NS', 'PS4000_US', 'PS4000_MS', 'PS4000_S'])
+    StreamingReadyType = StreamingReadyType
+    max_adc = 32767
+
+    def ps4000OpenUnit(self, handle):
+        return self._open_unit(handle)
+
+    def ps4000OpenUnitEx(self, handle, serial):
+        return self._open_unit(handle)
+
+    def ps4000EnumerateUnits(self, count = None, serials = None, serialLth = None):
+        return PICO_OK
+
+    def ps4000SetChannel(self, handle, channel, enabled, dc, vrange):
+        return self._set_channel(channel, enabled, vrange)
+
+    def ps4000SetDataBuffers(self, handle, channel, bufferMax, bufferMin, bufferLth):
+        return self._set_data_buffers(channel, bufferMax, bufferMin, bufferLth)
+
+    def ps4000SetDataBuffersWithMode(self, handle, channel, bufferMax, bufferMin, bufferLth, mode):
+        return self._set_data_buffers(channel, bufferMax, bufferMin, bufferLth)
+
+    def ps4000SetBwFilter(self, handle, channel, enabled):
+        return PICO_OK
+
+    def ps4000RunStreaming(self, handle, sampleInterval, timeUnits, maxPreTriggerSamples,
+                           maxPostTriggerSamples, autoStop, downSampleRatio, overviewBufferSize):
+        return self._run_streaming(sampleInterval, timeUnits, maxPreTriggerSamples + maxPostTriggerSamples,
+                                   autoStop, downSampleRatio)
+
+    def ps4000RunStreamingEx(self, handle, sampleInterval, timeUnits, maxPreTriggerSamples,
+                             maxPostTriggerSamples, autoStop, downSampleRatio, downSampleRatioMode,
+                             overviewBufferSize):
+        return self._run_streaming(sampleInterval, timeUnits, maxPreTriggerSamples + maxPostTriggerSamples,
+                                   autoStop, downSampleRatio)
+
+    def ps4000GetStreamingLatestValues(self, handle, lpPs4000Ready, pParameter):
+        return self._get_streaming_latest_values(handle, lpPs4000Ready, pParameter)
+
+    def _timebase_interval(self, timebase):
+        return 2**timebase/250e6 if timebase < 2 else (timebase - 1)/31.25e6
+
+    def ps4000MemorySegments(self, handle, nSegments, nMaxSamples):
+        return self._memory_segments(nSegments, nMaxSamples)
+
+    def ps4000SetNoOfCaptures(self, handle, nCaptures):
+        return self._set_no_of_captures(nCaptures)
+
+    def ps4000GetTimebase2(self, handle, timebase, noSamples, timeIntervalNanoseconds, oversample, maxSamples,
+                           segmentIndex):
+        return self._get_timebase(timebase, timeIntervalNanoseconds, maxSamples)
+
+    def ps4000SetSimpleTrigger(self, handle, enable, source, threshold, direction, delay, autoTrigger_ms):
+        return self._set_simple_trigger(enable, source, threshold, direction)
+
+    def ps4000SetDataBufferBulk(self, handle, channel, buffer, bufferLth, waveform):
+        return self._set_segment_buffer(channel, buffer, bufferLth, waveform)
+
+    def ps4000RunBlock(self, handle, noOfPreTriggerSamples, noOfPostTriggerSamples, timebase, oversample,
+                       timeIndisposedMs, segmentIndex, lpReady, pParameter):
+        return self._run_block(noOfPreTriggerSamples, noOfPostTriggerSamples, timebase)
+
+    def ps4000IsReady(self, handle, ready):
+        return self._is_ready(ready)
+
+    def ps4000GetValuesBulk(self, handle, noOfSamples, fromSegmentIndex, toSegmentIndex, overflow):
+        return self._get_values_bulk(noOfSamples, fromSegmentIndex, toSegmentIndex, overflow)
+
+    def ps4000GetValuesTriggerTimeOffsetBulk64(self, handle, times, timeUnits, fromSegmentIndex, toSegmentIndex):
+        return self._trigger_time_offsets(times, timeUnits, fromSegmentIndex, toSegmentIndex)
+
+    def ps4000Stop(self, handle):
+        return self._stop()
+
+    def ps4000CloseUnit(self, handle):
+        return self._stop()
@@ -0,0 +1,163 @@
+import numpy as np
+from threading import Lock
+from numpy.lib.stride_tricks import sliding_window_view
+from pypicostreaming.pipeline import Stage
+
+
+class RunningStatistics:
+    def __init__(self):
+        '''
+        Count, mean, RMS, standard deviation, minimum and maximum of a signal
+        updated block by block in constant memory. The mean and the sum of
+        the squared deviations of every block are computed with vectorized
+        reductions and merged with the parallel form of Welford's algorithm
+        (Chan et al.), which stays accurate for any number of samples.
+        '''
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of the squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def push(self, block):
+        values = np.asarray(block, dtype=np.float64)
+        n = len(values)
+        if not n:
+            return
+        block_mean = values.mean()
+        block_m2 = np.square(values - block_mean).sum()
+        delta = block_mean - self.mean
+        total = self.count + n
+        self.mean += delta*n/total
+        self.m2 += block_m2 + delta**2*self.count*n/total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+
+    def stats(self):
+        variance = self.m2/self.count if self.count else 0.0
+        return {
+            'count' : self.count,
+            'mean' : float(self.mean),
+            'rms' : float(np.sqrt(self.mean**2 + variance)),
+            'std' : float(np.sqrt(variance)),
+            'min' : self.min if self.count else None,
+            'max' : self.max if self.count else None,
+        }
+
+
+class WelchPSD:
+    def __init__(self, segment_size = 4096, overlap = 0.5, sample_step = 1.0):
+        '''
+        Power spectral density of a signal averaged over its segments
+        (Welch's method), updated block by block in constant memory. The
+        segments of segment_size samples, overlapping by the fraction
+        overlap, have their mean removed and are multiplied by a Hann window
+        computed once. All the segments complete in a block are transformed
+        with a single 2-D rfft and their power added to the sum. The samples
+        of the incomplete segment are kept for the next block.
+
+        Parameters:
+        segment_size : int
+            Samples per segment, the resolution is 1/(segment_size*sample_step).
+        overlap : float
+            Fraction of the segment shared with the next one, in [0, 1).
+        sample_step : float
+            Seconds between two samples.
+        '''
+        if not 0 <= overlap < 1:
+            raise ValueError('overlap must be in [0, 1).')
+        self.segment_size = segment_size
+        self.step = segment_size - int(segment_size*overlap)
+        self.sample_step = sample_step
+        self.window = np.hanning(segment_size)
+        # Density scaling: V**2/Hz, one-sided
+        self._norm = sample_step/np.square(self.window).sum()
+        self.power_sum = np.zeros(segment_size//2 + 1)
+        self.segments = 0
+        self._pending = np.empty(0)
+
+
+    def push(self, block):
+        data = np.concatenate((self._pending, np.asarray(block, dtype=np.float64)))
+        n_segments = (len(data) - self.segment_size)//self.step + 1 if len(data) >= self.segment_size else 0
+        if n_segments:
+            frames = sliding_window_view(data, self.segment_size)[::self.step][:n_segments]
+            frames = frames - frames.mean(axis=1, keepdims=True)
+            spectra = np.fft.rfft(frames*self.window, axis=1)
+            self.power_sum += (np.square(spectra.real) + np.square(spectra.imag)).sum(axis=0)
+            self.segments += n_segments
+        self._pending = data[n_segments*self.step:].copy()
+
+
+    def frequencies(self):
+        return np.fft.rfftfreq(self.segment_size, self.sample_step)
+
+
+    def psd(self):
+        '''
+        Average power spectral density of the segments so far (unit of the
+        samples squared per Hz), zeros before the first complete segment.
+        '''
+        psd = self.power_sum*self._norm/max(self.segments, 1)
+        # One-sided: the power of the negative frequencies is added, except at 0 and Nyquist
+        psd[1:-1 if self.segment_size % 2 == 0 else None] *= 2
+        return psd
+
+
+class StatisticsStage(Stage):
+    '''
+    Pipeline stage updating a RunningStatistics and, if segment_size is
+    given, a WelchPSD for every channel (and the _MIN buffers in aggregate
+    mode). converters (channel name -> function of the raw block) convert
+    the samples to physical values before the update, raw ADC numbers are
+    used for the channels without one. stats and psd can be called at any
+    time during the acquisition.
+    '''
+    def __init__(self, sample_step, segment_size = None, overlap = 0.5):
+        super().__init__('StatisticsStage', max_results=1)
+        self.sample_step = sample_step
+        self.segment_size = segment_size
+        self.overlap = overlap
+        self.converters = {}
+        self.statistics = {}
+        self.spectra = {}
+        self._lock = Lock()
+
+    def process(self, start_sample, blocks):
+        with self._lock:
+            for name, block in blocks.items():
+                if name not in self.statistics:
+                    self.statistics[name] = RunningStatistics()
+                    if self.segment_size is not None:
+                        self.spectra[name] = WelchPSD(self.segment_size, self.overlap, self.sample_step)
+                convert = self.converters.get(name)
+                values = convert(block) if convert is not None else block
+                self.statistics[name].push(values)
+                if self.segment_size is not None:
+                    self.spectra[name].push(values)
+
+    def stats(self):
+        with self._lock:
+            stats = {name : statistics.stats() for name, statistics in self.statistics.items()}
+            for name, spectrum in self.spectra.items():
+                stats[name]['psd_segments'] = spectrum.segments
+        return stats
+
+    def psd(self, channel_name):
+        '''
+        (frequencies, power spectral density) of a channel.
+        '''
+        with self._lock:
+            spectrum = self.spectra[channel_name]
+            return spectrum.frequencies(), spectrum.psd()
+
+    def save(self, file_name):
+        '''
+        Save the frequencies and the spectra of all the channels in a .npz file.
+        '''
+        with self._lock:
+            spectra = {name : spectrum.psd() for name, spectrum in self.spectra.items()}
+        np.savez(file_name, frequencies = np.fft.rfftfreq(self.segment_size, self.sample_step), **spectra)
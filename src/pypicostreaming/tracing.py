@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+import numpy as np
+
+
+class Tracer:
+    def __init__(self, capacity = 2**16):
+        '''
+        Record the duration of the steps of the acquisition (spans) in
+        preallocated arrays used as a ring: the last capacity spans are kept
+        and recording does not allocate memory. The spans can be exported as
+        a Chrome trace (chrome://tracing or https://ui.perfetto.dev) and
+        summarized with percentiles of the durations.
+        The Picoscope classes record the driver call, the callback, the push
+        of every channel and the consumers when set_pico is called with
+        is_debug = True:
+            start = time.perf_counter_ns()
+            ...
+            tracer.record('name', start)
+        '''
+        self.capacity = capacity
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.durations = np.zeros(capacity, dtype=np.int64)
+        self.span_ids = np.zeros(capacity, dtype=np.int32)
+        self.thread_ids = np.zeros(capacity, dtype=np.int64)
+        self.names = [] # Span id -> name
+        self._ids = {}  # Name -> span id
+        self.reset()
+
+
+    def reset(self):
+        self.count = 0
+        self.origin = time.perf_counter_ns()
+
+
+    def record(self, name, start, end = None):
+        '''
+        Add the span name from start to end (perf_counter_ns, now if None).
+        '''
+        if end is None:
+            end = time.perf_counter_ns()
+        span_id = self._ids.get(name)
+        if span_id is None:
+            span_id = self._ids[name] = len(self.names)
+            self.names.append(name)
+        i = self.count % self.capacity
+        self.starts[i] = start
+        self.durations[i] = end - start
+        self.span_ids[i] = span_id
+        self.thread_ids[i] = threading.get_native_id()
+        self.count += 1
+
+
+    def _ordered(self):
+        # Index of the spans kept, from the oldest
+        if self.count <= self.capacity:
+            return np.arange(self.count)
+        return (self.count + np.arange(self.capacity)) % self.capacity
+
+
+    def chrome_trace(self):
+        '''
+        Spans kept as a Chrome trace event list (times in microseconds from
+        the reset of the tracer).
+        '''
+        order = self._ordered()
+        events = [{'name' : self.names[span_id],
+                   'ph' : 'X',
+                   'ts' : (start - self.origin)/1e3,
+                   'dur' : duration/1e3,
+                   'pid' : 0,
+                   'tid' : int(thread_id)}
+                  for start, duration, span_id, thread_id in zip(self.starts[order].tolist(),
+                                                                 self.durations[order].tolist(),
+                                                                 self.span_ids[order].tolist(),
+                                                                 self.thread_ids[order],
+                                                                 strict=True)]
+        return {'traceEvents' : events, 'displayTimeUnit' : 'ns'}
+
+
+    def save_chrome_trace(self, file_name):
+        with open(file_name, 'w') as fp:
+            json.dump(self.chrome_trace(), fp)
+
+
+    def summary(self):
+        '''
+        Number of spans kept, mean, p50, p99 and max duration (microseconds)
+        for every name.
+        '''
+        order = self._ordered()
+        span_ids = self.span_ids[order]
+        durations = self.durations[order]/1e3
+        summary = {}
+        for span_id, name in enumerate(self.names):
+            values = durations[span_ids == span_id]
+            if not len(values):
+                continue
+            p50, p99 = np.percentile(values, [50, 99])
+            summary[name] = {'count' : len(values),
+                             'mean_us' : float(values.mean()),
+                             'p50_us' : float(p50),
+                             'p99_us' : float(p99),
+                             'max_us' : float(values.max())}
+        return summary
+
+
+    def histogram(self, name, bins = 50):
+        '''
+        Counts and edges (microseconds) of the durations of the spans name.
+        '''
+        order = self._ordered()
+        values = self.durations[order][self.span_ids[order] == self._ids[name]]/1e3
+        return np.histogram(values, bins=bins)
@@ -0,0 +1,260 @@
+import json
+import queue
+import numpy as np
+from abc import ABC, abstractmethod
+from pathlib import Path
+from threading import Thread
+
+
+class Condition(ABC):
+    '''
+    Base class of the trigger conditions. mask(blocks) returns a boolean
+    array, True where the condition holds for every sample of the new block
+    (blocks is the dictionary channel name -> raw samples of the callback).
+    Conditions are combined with & and |. Thresholds are in ADC numbers,
+    see volts_to_adc of the Picoscope classes.
+    '''
+    @abstractmethod
+    def mask(self, blocks):
+        pass
+
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+
+class _ChannelCondition(Condition):
+    # Keeps the last samples of the channel for the conditions on consecutive samples
+    def __init__(self, channel, history = 1):
+        self.channel = channel
+        self.history = history
+        self._last = None
+
+    def _with_history(self, blocks):
+        block = blocks[self.channel]
+        if self._last is None:
+            self._last = np.full(self.history, block[0] if len(block) else 0, dtype=np.int16)
+        samples = np.concatenate((self._last, block))
+        self._last = samples[-self.history:]
+        return samples
+
+
+class Level(_ChannelCondition):
+    '''
+    Samples above (or below) the threshold.
+    '''
+    def __init__(self, channel, threshold, above = True):
+        super().__init__(channel)
+        self.threshold = threshold
+        self.above = above
+
+    def mask(self, blocks):
+        block = blocks[self.channel]
+        return block >= self.threshold if self.above else block <= self.threshold
+
+
+class Edge(_ChannelCondition):
+    '''
+    Samples where the signal crosses the threshold, direction is 'rising',
+    'falling' or 'both'.
+    '''
+    def __init__(self, channel, threshold, direction = 'rising'):
+        if direction not in ('rising', 'falling', 'both'):
+            raise ValueError("direction must be 'rising', 'falling' or 'both'.")
+        super().__init__(channel)
+        self.threshold = threshold
+        self.direction = direction
+
+    def mask(self, blocks):
+        above = self._with_history(blocks) >= self.threshold
+        rising = above[1:] & ~above[:-1]
+        falling = ~above[1:] & above[:-1]
+        if self.direction == 'rising':
+            return rising
+        if self.direction == 'falling':
+            return falling
+        return rising | falling
+
+
+class Window(_ChannelCondition):
+    '''
+    Samples outside (or inside) the range [low, high].
+    '''
+    def __init__(self, channel, low, high, inside = False):
+        super().__init__(channel)
+        self.low = low
+        self.high = high
+        self.inside = inside
+
+    def mask(self, blocks):
+        block = blocks[self.channel]
+        inside = (block >= self.low) & (block <= self.high)
+        return inside if self.inside else ~inside
+
+
+class Slope(_ChannelCondition):
+    '''
+    Samples where the change over the last lag samples is at least
+    min_change (ADC numbers), or at most min_change if it is negative.
+    '''
+    def __init__(self, channel, min_change, lag = 1):
+        super().__init__(channel, lag)
+        self.min_change = min_change
+        self.lag = lag
+
+    def mask(self, blocks):
+        samples = self._with_history(blocks).astype(np.int32)
+        change = samples[self.lag:] - samples[:-self.lag]
+        return change >= self.min_change if self.min_change >= 0 else change <= self.min_change
+
+
+class All(Condition):
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def mask(self, blocks):
+        masks = [condition.mask(blocks) for condition in self.conditions]
+        return np.logical_and.reduce(masks)
+
+
+class Any(Condition):
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+    def mask(self, blocks):
+        masks = [condition.mask(blocks) for condition in self.conditions]
+        return np.logical_or.reduce(masks)
+
+
+class EventStore:
+    def __init__(self, saving_dir = None, keep_in_memory = True, queue_depth = 256):
+        '''
+        Events captured by an EventDetector: (trigger sample, {channel name:
+        samples of the window}). If saving_dir is given each event is saved
+        as event_XXXXXX.npz and the list of events in events.json at close.
+        The files are written by a background thread, so that add (called
+        from the driver callback) does not wait on the disk unless
+        queue_depth events are already waiting to be written.
+        '''
+        self.saving_dir = saving_dir
+        self.keep_in_memory = keep_in_memory
+        self.events = []
+        self.trigger_samples = []
+        self._queue = None
+        self._thread = None
+        if saving_dir is not None:
+            Path(saving_dir).mkdir(parents=True, exist_ok=True)
+            self._queue = queue.Queue(maxsize=queue_depth)
+            self._thread = Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return len(self.trigger_samples)
+
+    def add(self, trigger_sample, first_sample, windows):
+        if self._queue is not None:
+            self._queue.put((len(self.trigger_samples), trigger_sample, first_sample, windows))
+        if self.keep_in_memory:
+            self.events.append((trigger_sample, windows))
+        self.trigger_samples.append(trigger_sample)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            index, trigger_sample, first_sample, windows = item
+            np.savez(self.saving_dir + f'/event_{index:06d}.npz',
+                     trigger_sample = trigger_sample,
+                     first_sample = first_sample,
+                     **windows)
+
+    def close(self):
+        '''
+        Wait for the events to be written and save the list of events.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.saving_dir is not None:
+            with open(self.saving_dir + '/events.json', 'w') as fp:
+                json.dump({'Trigger samples' : [int(sample) for sample in self.trigger_samples]}, fp)
+
+
+class EventDetector:
+    def __init__(self, condition, pre, post, holdoff = None, store = None):
+        '''
+        Consumer (see add_consumer) evaluating the condition on every new
+        block and saving only the windows of pre samples before and post
+        samples after every trigger (first sample of each group of samples
+        meeting the condition), with the index of the trigger from the
+        start of the acquisition. The last pre samples of every channel are
+        kept to fill the windows triggered at the start of a block.
+
+        Parameters:
+        condition : Condition
+        pre, post : int
+            Samples saved before and after (trigger included) the trigger.
+        holdoff : int
+            Minimum samples between two triggers, post if None.
+        store : EventStore
+            Where the events are added, a new one in memory if None.
+        '''
+        self.condition = condition
+        self.pre = pre
+        self.post = post
+        self.holdoff = post if holdoff is None else holdoff
+        self.store = EventStore() if store is None else store
+        self.triggers = 0
+        self._was_true = False
+        self._next_allowed = 0
+        self._history = {} # Last pre samples of every channel
+        self._pending = [] # [trigger sample, windows, samples filled] of the windows not complete
+
+
+    def put(self, start_sample, blocks):
+        mask = self.condition.mask(blocks)
+        starts = np.flatnonzero(mask[1:] & ~mask[:-1]) + 1
+        if len(mask) and mask[0] and not self._was_true:
+            starts = np.concatenate(([0], starts))
+        if len(mask):
+            self._was_true = bool(mask[-1])
+        # Samples available: the history followed by the new block
+        samples = {}
+        for name, block in blocks.items():
+            history = self._history.get(name, np.empty(0, dtype=block.dtype))
+            samples[name] = np.concatenate((history, block))
+        first = start_sample - len(next(iter(self._history.values()), ()))
+        end = start_sample + len(mask)
+        for trigger in start_sample + starts:
+            if trigger < self._next_allowed:
+                continue
+            self._next_allowed = trigger + self.holdoff
+            self.triggers += 1
+            windows = {name : np.zeros(self.pre + self.post, dtype=block.dtype) for name, block in samples.items()}
+            self._pending.append([int(trigger), windows, 0])
+        for event in list(self._pending):
+            trigger, windows, filled = event
+            window_start = trigger - self.pre
+            # Copy the part of the window available in samples
+            lo = max(window_start + filled, first)
+            hi = min(trigger + self.post, end)
+            if hi > lo:
+                for name, window in windows.items():
+                    window[lo - window_start:hi - window_start] = samples[name][lo - first:hi - first]
+                event[2] = hi - window_start
+            if event[2] >= self.pre + self.post:
+                self.store.add(trigger, window_start, windows)
+                self._pending.remove(event)
+        for name, channel_samples in samples.items():
+            self._history[name] = channel_samples[-self.pre:].copy() if self.pre else channel_samples[:0]
+
+
+    def close(self):
+        # Windows not complete at the end are saved with the samples received
+        for trigger, windows, _ in self._pending:
+            self.store.add(trigger, trigger - self.pre, windows)
+        self._pending = []
+        self.store.close()
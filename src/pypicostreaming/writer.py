@@ -0,0 +1,304 @@
+import os
+import json
+import queue
+import time
+import numpy as np
+from threading import Lock, Thread
+from pathlib import Path
+
+
+NPY_HEADER_SIZE = 128 # Fixed size so the header can be rewritten in place while the file grows
+
+
+def npy_header(dtype, length):
+    '''
+    Build a .npy (format version 1.0) header for a 1-D array of the given
+    length. The header is padded to NPY_HEADER_SIZE bytes so that it can be
+    rewritten without moving the data that follows.
+    '''
+    header = f"{{'descr': {np.dtype(dtype).str!r}, 'fortran_order': False, 'shape': ({length},), }}"
+    header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class ChunkedWriter:
+    def __init__(self, saving_dir, queue_depth = 256, fsync_bytes = 64*2**20, fsync_interval = 1.0,
+                 rotate_samples = None, rotate_seconds = None, drop_when_full = True):
+        '''
+        Write the raw blocks of every channel to disk from a background thread.
+        Each channel is appended to its own growing channelX_stream.npy file,
+        whose header is rewritten at every fsync, so the file can be loaded
+        with np.load at any moment (also after a crash) up to the last sync.
+
+        Parameters:
+        saving_dir : str
+            Folder where the files are created.
+        queue_depth : int
+            Maximum number of callbacks waiting to be written. When the queue
+            is full new blocks are dropped instead of blocking the driver
+            callback. The samples dropped are listed in stream.json (or in
+            segments.json with rotation) when the writer is closed.
+        fsync_bytes : int
+            Force the data to disk after this amount of bytes is written...
+        fsync_interval : float
+            ...or after this amount of seconds from the last sync.
+        rotate_samples : int
+            Roll over to new numbered files (segments, channelX_stream_NNNNNN.npy)
+            every rotate_samples samples...
+        rotate_seconds : float
+            ...or every rotate_seconds seconds (at the end of a block).
+            The first sample of every segment is recorded in segments.json
+            (see check_segments). A segment always holds consecutive samples:
+            if a block is missing (see below) a new segment is started.
+        drop_when_full : bool
+            If False put waits for a free place in the queue instead of
+            dropping the block (the polling of the driver is paused).
+
+        If a write fails (disk full, permissions...) the error is kept in
+        self.error, the blocks queued or put afterwards are dropped and
+        close raises the error once the files are closed and the metadata
+        written.
+        '''
+        self.saving_dir = saving_dir
+        Path(self.saving_dir).mkdir(parents=True, exist_ok=True)
+        self.fsync_bytes = fsync_bytes
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.bytes_written = {} # Per channel counters
+        self.samples_written = {}
+        self.dropped_blocks = 0
+        self.dropped_samples = 0
+        self.drops = []            # First sample and length of the blocks dropped
+        self.error = None          # First exception raised by the writes
+        self._drop_lock = Lock()   # put and the writing thread both drop blocks
+        self.rotate_samples = rotate_samples
+        self.rotate_seconds = rotate_seconds
+        self.rotate = rotate_samples is not None or rotate_seconds is not None
+        self.drop_when_full = drop_when_full
+        self.segment = 0
+        self.segments = []         # Completed segments, see segments.json
+        self.gaps = []             # Missing samples between the blocks written
+        self.next_sample = None    # Index of the sample expected in the next block
+        self.first_sample = None   # Index of the first sample written
+        self._segment_start = 0
+        self._segment_samples = 0
+        self._segment_time = time.monotonic()
+        self._files = {}
+        self._file_samples = {}
+        self._dtypes = {}
+        self._unsynced_bytes = 0
+        self._last_sync = time.monotonic()
+        self._thread = Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+
+    def file_name(self, channel_name):
+        # 'PS5000A_CHANNEL_A' -> channelA, 'PS5000A_CHANNEL_A_MIN' -> channelA_MIN
+        suffix = channel_name.split("_CHANNEL_")[-1]
+        if self.rotate:
+            return self.saving_dir + f'/channel{suffix}_stream_{self.segment:06d}.npy'
+        return self.saving_dir + f'/channel{suffix}_stream.npy'
+
+
+    def put(self, start_sample, blocks):
+        '''
+        Queue a copy of the new blocks (dictionary channel name -> samples).
+        Called from the driver callback, it never waits on the disk.
+        '''
+        if self.error is not None:
+            self._drop(start_sample, blocks)
+            return
+        copies = {name: np.array(block) for name, block in blocks.items()}
+        try:
+            self.queue.put((start_sample, copies), block = not self.drop_when_full)
+        except queue.Full:
+            self._drop(start_sample, copies)
+
+
+    def _drop(self, start_sample, blocks):
+        n = len(next(iter(blocks.values()), ()))
+        with self._drop_lock:
+            self.dropped_blocks += 1
+            self.dropped_samples += n
+            self.drops.append({'First sample' : start_sample, 'Samples' : n})
+
+
+    def close(self):
+        '''
+        Wait for the queue to be written, sync and close all the files.
+        The first error of the writes is raised after the metadata is saved.
+        '''
+        if not self._thread.is_alive():
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._close_segment()
+        if self.error is not None:
+            raise self.error
+
+
+    def _open(self, channel_name, dtype):
+        fp = open(self.file_name(channel_name), 'wb')
+        fp.write(npy_header(dtype, 0))
+        fp.flush()
+        self._files[channel_name] = fp
+        self._dtypes[channel_name] = dtype
+        self._file_samples[channel_name] = 0
+        self.bytes_written.setdefault(channel_name, 0)
+        self.samples_written.setdefault(channel_name, 0)
+        return fp
+
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                # Nothing arrived for a while: make sure the last blocks reach the disk
+                if self._unsynced_bytes and self.error is None:
+                    try:
+                        self._sync()
+                    except Exception as error:
+                        self.error = error
+                continue
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep emptying the queue so that a blocking put never waits forever
+                self._drop(*item)
+                continue
+            try:
+                self._write(*item)
+            except Exception as error:
+                self.error = error
+                self._drop(*item)
+
+
+    def _write(self, start_sample, blocks):
+        if self.next_sample is None:
+            self.next_sample = self._segment_start = self.first_sample = start_sample
+        elif start_sample != self.next_sample:
+            self.gaps.append({'First missing sample' : self.next_sample,
+                              'Missing samples' : start_sample - self.next_sample})
+            if self.rotate:
+                self._close_segment()
+                self._segment_start = start_sample
+            self.next_sample = start_sample
+        n = len(next(iter(blocks.values()), ()))
+        done = 0
+        while done < n:
+            # Split the block where the segment is full
+            part = n - done
+            if self.rotate_samples is not None:
+                part = min(part, self.rotate_samples - self._segment_samples)
+            self._write_blocks({name: block[done:done + part] for name, block in blocks.items()})
+            done += part
+            if self.rotate_samples is not None and self._segment_samples >= self.rotate_samples:
+                self._close_segment()
+        if (self.rotate_seconds is not None and self._segment_samples and
+            time.monotonic() - self._segment_time >= self.rotate_seconds):
+            self._close_segment()
+        if (self._unsynced_bytes >= self.fsync_bytes or
+            time.monotonic() - self._last_sync >= self.fsync_interval):
+            self._sync()
+
+
+    def _write_blocks(self, blocks):
+        for name, block in blocks.items():
+            fp = self._files.get(name)
+            if fp is None:
+                fp = self._open(name, block.dtype)
+            fp.write(memoryview(block))
+            self.bytes_written[name] += block.nbytes
+            self.samples_written[name] += len(block)
+            self._file_samples[name] += len(block)
+            self._unsynced_bytes += block.nbytes
+        n = len(next(iter(blocks.values()), ()))
+        self._segment_samples += n
+        self.next_sample += n
+
+
+    def _close_segment(self):
+        '''
+        Sync and close the files of the current segment and, with rotation,
+        record it in segments.json and start a new one. The files are closed
+        and the metadata written also if the sync fails, the error is kept in
+        self.error.
+        '''
+        try:
+            self._sync()
+        except OSError as error:
+            self.error = self.error or error
+        files = {name : os.path.basename(fp.name) for name, fp in self._files.items()}
+        for fp in self._files.values():
+            try:
+                fp.close()
+            except OSError as error:
+                self.error = self.error or error
+        self._files = {}
+        if not self.rotate:
+            with open(self.saving_dir + '/stream.json', 'w') as fp:
+                json.dump(dict(self.stats(),
+                               **{'First sample' : self.first_sample,
+                                  'Samples' : max(self.samples_written.values(), default = 0),
+                                  'Files' : files}), fp)
+            return
+        if self._segment_samples:
+            self.segments.append({'Segment' : self.segment,
+                                  'First sample' : self._segment_start,
+                                  'Samples' : self._segment_samples,
+                                  'Files' : files})
+            self.segment += 1
+        self._segment_start = self.next_sample
+        self._segment_samples = 0
+        self._segment_time = time.monotonic()
+        with open(self.saving_dir + '/segments.json', 'w') as fp:
+            json.dump(dict(self.stats(), **{'Segments' : self.segments}), fp)
+
+
+    def stats(self):
+        '''
+        Blocks and samples dropped (with the first sample and the length of
+        every block dropped), the gaps between the blocks written and the
+        error that stopped the writes, if any.
+        '''
+        with self._drop_lock:
+            return {'Dropped blocks' : self.dropped_blocks,
+                    'Dropped samples' : self.dropped_samples,
+                    'Drops' : list(self.drops),
+                    'Gaps' : list(self.gaps),
+                    'Error' : None if self.error is None else repr(self.error)}
+
+
+    def _sync(self):
+        for name, fp in self._files.items():
+            fp.seek(0)
+            fp.write(npy_header(self._dtypes[name], self._file_samples[name]))
+            fp.seek(0, os.SEEK_END)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._unsynced_bytes = 0
+        self._last_sync = time.monotonic()
+
+
+def check_segments(saving_dir):
+    '''
+    Verify the segments written by a ChunkedWriter with rotation: every
+    segment must start where the previous one ended and its files must hold
+    the number of samples recorded. Return the list of the problems found
+    (empty if the segments concatenated are gapless).
+    '''
+    with open(saving_dir + '/segments.json') as fp:
+        segments = json.load(fp)['Segments']
+    problems = []
+    for previous, segment in zip(segments[:-1], segments[1:], strict=True):
+        end = previous['First sample'] + previous['Samples']
+        if segment['First sample'] != end:
+            problems.append(f"Samples {end} to {segment['First sample']} missing "
+                            f"between the segments {previous['Segment']} and {segment['Segment']}")
+    for segment in segments:
+        for file_name in segment['Files'].values():
+            length = len(np.load(saving_dir + '/' + file_name, mmap_mode='r'))
+            if length != segment['Samples']:
+                problems.append(f"{file_name} has {length} samples instead of {segment['Samples']}")
+    return problems
@@ -0,0 +1,54 @@
+import time
+import numpy as np
+import pytest
+from pypicostreaming import Picoscope4000, Picoscope5000a
+from pypicostreaming.simulator import SimulatedPs4000, SimulatedPs5000a
+
+
+SERIES = {
+    '5000a' : (lambda driver: Picoscope5000a('PS5000A_DR_16BIT', driver = driver), SimulatedPs5000a, 'PS5000A'),
+    '4000' : (lambda driver: Picoscope4000(driver = driver), SimulatedPs4000, 'PS4000'),
+}
+
+
+class SimulatedScope:
+    '''
+    A Picoscope class of one series connected to its simulated driver.
+    '''
+    def __init__(self, series, saving_path):
+        make_scope, driver_class, self.prefix = SERIES[series]
+        self.driver = driver_class()
+        self.scope = make_scope(self.driver)
+        self.saving_path = str(saving_path)
+
+    def set_pico(self, capture_size = 1000, samples_total = 10000, **kwargs):
+        self.scope.set_pico(capture_size, samples_total, 1, self.prefix + '_US', self.saving_path, **kwargs)
+
+    def set_channel(self, letter, **kwargs):
+        self.scope.set_channel(f'{self.prefix}_CHANNEL_{letter}', self.prefix + '_1V', **kwargs)
+
+    def run_until(self, n_samples, timeout = 10):
+        '''
+        Stream without autoStop until n_samples have been received, so that
+        the buffers can wrap, then stop and wait for the completion.
+        '''
+        self.scope.run_streaming_non_blocking(autoStop = False)
+        deadline = time.monotonic() + timeout
+        try:
+            while self.scope.nextSample < n_samples and time.monotonic() < deadline:
+                time.sleep(1e-3)
+        finally:
+            self.scope.stop()
+        assert self.scope.completed_event.wait(timeout)
+
+    def expected(self, letter, start, n):
+        '''
+        Samples [start, start + n) produced by the simulator on a channel.
+        '''
+        table = self.driver.tables[ord(letter) - ord('A')][0]
+        return table[np.arange(start, start + n) % len(table)]
+
+
+@pytest.fixture(params = list(SERIES))
+def sim(request, tmp_path):
+    return SimulatedScope(request.param, tmp_path)
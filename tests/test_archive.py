@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from pypicostreaming.archive import ArchiveReader, ArchiveWriter, decode_chunk, encode_chunk
+
+
+def test_encoding_is_reversible():
+    # The deltas wrap in int16 between the extremes
+    samples = np.array([0, 32767, -32768, -1, 32767, -32768, 5], dtype=np.int16)
+    np.testing.assert_array_equal(decode_chunk(encode_chunk(samples)), samples)
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'bz2', 'lzma'])
+def test_ranges_and_index(tmp_path, codec):
+    rng = np.random.default_rng(0)
+    samples = np.cumsum(rng.integers(-50, 50, 10000), dtype=np.int16)
+    file_name = str(tmp_path / 'channelA.pcarc')
+    with ArchiveWriter(file_name, chunk_size = 1000, codec = codec, scale = 0.5, metadata = {'Run' : 1}) as writer:
+        # Blocks not aligned on the chunks
+        for start in range(0, len(samples), 700):
+            writer.write(samples[start:start + 700])
+    assert writer.bytes_written < samples.nbytes
+
+    with ArchiveReader(file_name) as reader:
+        assert reader.n_samples == len(samples) and reader.metadata == {'Run' : 1}
+        np.testing.assert_array_equal(reader.read(), samples)
+        for start, stop in ((0, 1), (999, 1001), (2500, 7321), (9990, 20000)):
+            np.testing.assert_array_equal(reader.read(start, stop), samples[start:stop])
+        np.testing.assert_array_equal(reader[100:5000:7], samples[100:5000:7])
+        assert len(reader.read(5000, 5000)) == 0
+        np.testing.assert_allclose(reader.read_scaled(10, 20), samples[10:20]*0.5)
+        starts, minima, maxima = reader.envelope()
+        np.testing.assert_array_equal(starts, np.arange(0, 10000, 1000))
+        np.testing.assert_array_equal(minima, samples.reshape(10, 1000).min(axis = 1))
+        np.testing.assert_array_equal(maxima, samples.reshape(10, 1000).max(axis = 1))
+
+
+def test_incomplete_archive(tmp_path):
+    file_name = str(tmp_path / 'channelA.pcarc')
+    writer = ArchiveWriter(file_name, chunk_size = 10)
+    writer.write(np.arange(100, dtype=np.int16))
+    writer._file.flush()
+    with pytest.raises(ValueError):
+        ArchiveReader(file_name)
+    writer.close()
+    with pytest.raises(ValueError):
+        ArchiveWriter(file_name, codec = 'zstd')
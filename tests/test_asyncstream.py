@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from pypicostreaming.asyncstream import AsyncBlockStream
+
+
+def block(start, n = 10):
+    return {'PS5000A_CHANNEL_A' : np.arange(start, start + n, dtype=np.int16)}
+
+
+async def read_all(stream):
+    return [start_sample async for start_sample, _ in stream]
+
+
+@pytest.mark.parametrize('policy, kept', [('drop_newest', [0, 10]), ('drop_oldest', [30, 40])])
+def test_drop_policies(policy, kept):
+    async def main():
+        stream = AsyncBlockStream(asyncio.get_running_loop(), queue_depth = 2, policy = policy)
+        for start in range(0, 50, 10):
+            stream.put(start, block(start))
+        stream.close()
+        return stream, await read_all(stream)
+
+    stream, starts = asyncio.run(main())
+    assert starts == kept
+    assert stream.dropped_blocks == 3
+
+
+def test_block_policy_waits_for_the_reader():
+    async def main():
+        stream = AsyncBlockStream(asyncio.get_running_loop(), queue_depth = 2, policy = 'block')
+        put_done = threading.Event()
+
+        def put_blocks():
+            for start in range(0, 50, 10):
+                stream.put(start, block(start))
+            stream.close()
+            put_done.set()
+
+        threading.Thread(target=put_blocks, daemon=True).start()
+        await asyncio.sleep(0.1)
+        # The queue is full: the callback waits
+        assert not put_done.is_set()
+        starts = await read_all(stream)
+        assert put_done.is_set()
+        return stream, starts
+
+    stream, starts = asyncio.run(main())
+    assert starts == list(range(0, 50, 10))
+    assert stream.dropped_blocks == 0
+
+
+def test_cancel_releases_the_callback():
+    async def main():
+        stream = AsyncBlockStream(asyncio.get_running_loop(), queue_depth = 1, policy = 'block')
+        put_done = threading.Event()
+
+        def put_blocks():
+            for start in range(0, 50, 10):
+                stream.put(start, block(start))
+            put_done.set()
+
+        threading.Thread(target=put_blocks, daemon=True).start()
+        await asyncio.sleep(0.1)
+        stream.cancel()
+        return await asyncio.to_thread(put_done.wait, 5)
+
+    assert asyncio.run(main())
+
+
+def test_scope_stream(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+
+    async def main():
+        n_samples = 0
+        async with sim.scope.stream(autoStop = True, queue_depth = 4) as blocks:
+            async for start_sample, samples in blocks:
+                assert start_sample == n_samples
+                raw = samples[f'{sim.prefix}_CHANNEL_A']
+                np.testing.assert_array_equal(raw, sim.expected('A', start_sample, len(raw)))
+                n_samples += len(raw)
+        return n_samples
+
+    assert asyncio.run(main()) == 10000
+
+
+def test_scope_stream_cancelled(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+
+    async def main():
+        received = 0
+        async with sim.scope.stream(autoStop = False) as blocks:
+            async for _ in blocks:
+                received += 1
+                if received == 3:
+                    break
+        return received
+
+    assert asyncio.run(main()) == 3
+    # Leaving the context stopped the device and the acquisition completes
+    assert sim.scope.completed_event.wait(5)
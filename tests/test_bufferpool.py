@@ -0,0 +1,69 @@
+import threading
+import time
+import pytest
+
+
+def test_pool_blocks_are_handed_over(sim):
+    # Enough buffers for the whole acquisition: no block is dropped
+    sim.set_pico(buffer_pool = 16)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    n_samples = 0
+    while (block := sim.scope.get_block()) is not None:
+        assert block.start_sample == n_samples
+        assert (block.data == sim.expected('A', block.start_sample, len(block.data))).all()
+        n_samples += len(block.data)
+        block.release()
+    assert sim.scope.dropped_blocks == 0
+    assert n_samples == sim.scope.nextSample
+
+
+def test_pool_mode_does_not_store_samples(sim):
+    sim.set_pico(buffer_pool = 4)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    for read in (sim.scope.save_signals, sim.scope.get_all_signals, sim.scope.get_signals_matrix):
+        with pytest.raises(ValueError, match = 'buffer pool'):
+            read()
+
+
+def test_buffers_are_swapped_while_streaming(sim):
+    # Fewer buffers than blocks: the blocks released by the consumer are given
+    # back to the driver during the acquisition
+    sim.set_pico(capture_size = 500, samples_total = 20000, buffer_pool = 3,
+                 ratio_mode = sim.prefix + '_RATIO_MODE_AVERAGE', downsample_ratio = 2)
+    sim.set_channel('A')
+    sim.set_channel('B')
+    received = {'A' : [], 'B' : []}
+
+    def consume():
+        while not (sim.scope.completed_event.is_set() and not sim.scope.filled_blocks):
+            block = sim.scope.get_block()
+            if block is None:
+                time.sleep(1e-4)
+                continue
+            letter = block.channel[-1]
+            assert (block.data == sim.expected(letter, block.start_sample, len(block.data))).all()
+            received[letter].append((block.start_sample, len(block.data)))
+            block.release()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    sim.scope.run_streaming_non_blocking(autoStop = True)
+    assert sim.scope.completed_event.wait(10)
+    consumer.join(10)
+
+    assert received['A'] == received['B']
+    # More blocks than buffers: the buffers released were registered again
+    assert len(received['A']) > 3
+    # The samples follow each other, except where the consumer was too slow
+    # and a block was dropped (the driver overwrote the same buffers)
+    gaps = 0
+    next_sample = 0
+    for start_sample, n in received['A']:
+        assert start_sample >= next_sample
+        gaps += start_sample > next_sample
+        next_sample = start_sample + n
+    gaps += next_sample < sim.scope.nextSample
+    assert gaps <= sim.scope.dropped_blocks
+    assert sim.scope.nextSample == 10000
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from pypicostreaming.calibration import LUT_ADC, Calibration, convert, inverse
+
+
+ADC = np.array([-32767, -16384, -1, 0, 1, 12345, 32767], dtype=np.int16)
+
+
+def volts(adc, range_mv = 1000, max_adc = 32767, polarity = 1):
+    return adc.astype(np.float64)*polarity*range_mv/max_adc/1000
+
+
+def test_polynomial():
+    calibration = Calibration(-1, 0.5, 2.0, polynomial = [0.1, 1.0, 0.0])
+    x = volts(ADC, polarity = -1)
+    expected = 2.0*(0.1*x**2 + x) + 0.5
+    np.testing.assert_allclose(convert(ADC, calibration.lut(1000)), expected, rtol = 1e-6)
+
+
+def test_table():
+    calibration = Calibration(table = ([-0.5, 0.0, 0.5], [-2.0, 0.0, 1.0]), offset = 1.0)
+    lut = calibration.lut(1000)
+    values = convert(ADC, lut)
+    x = volts(ADC)
+    np.testing.assert_allclose(values, np.interp(x, [-0.5, 0.0, 0.5], [-2.0, 0.0, 1.0]) + 1.0, rtol = 1e-6)
+    # Held constant outside the points of the table
+    assert values[0] == pytest.approx(-1.0) and values[-1] == pytest.approx(2.0)
+
+
+def test_inverse_of_convert():
+    # Monotonic over the range, so that every ADC number has its own value
+    lut = Calibration(gain = 3.0, offset = -0.2, polynomial = [0.1, 1.0, 0.0]).lut(1000)
+    for adc in ADC:
+        assert inverse(lut, convert(np.int16(adc), lut)) == adc
+
+
+def test_clipping_at_max_adc(sim):
+    lut = Calibration().lut(1000)
+    assert convert(np.int16(32767), lut) == pytest.approx(1.0)
+    assert convert(np.int16(-32767), lut) == pytest.approx(-1.0)
+    # Values beyond the full range are clipped to the ADC numbers of the range
+    assert inverse(lut, 10.0) == 32767
+    sim.set_pico()
+    sim.set_channel('A', calibration = Calibration())
+    assert sim.scope.volts_to_adc(f'{sim.prefix}_CHANNEL_A', 10.0) == 32767
+    assert sim.scope.volts_to_adc(f'{sim.prefix}_CHANNEL_A', -10.0) == -32767
+
+
+def test_convert_needs_int16():
+    with pytest.raises(ValueError):
+        convert(ADC.astype(np.int32), Calibration().lut(1000))
+
+
+def test_dict_round_trip():
+    calibration = Calibration(-1, 0.1, 2.0, table = ([0, 1], [0, 2]))
+    assert np.array_equal(Calibration.from_dict(calibration.to_dict()).lut(500), calibration.lut(500))
+    assert len(LUT_ADC) == 2**16
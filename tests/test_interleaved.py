@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import pytest
+
+
+def load_saved(saving_dir, letter, suffix = ''):
+    with open(f'{saving_dir}/channel{letter}.json') as fp:
+        header = json.load(fp)
+    return header['First sample'], np.load(f'{saving_dir}/channel{letter}{suffix}.npy')
+
+
+@pytest.mark.parametrize('aggregate', [False, True])
+def test_save_signals_after_wrap(sim, aggregate):
+    if aggregate:
+        sim.set_pico(interleaved = True, ratio_mode = sim.prefix + '_RATIO_MODE_AGGREGATE', downsample_ratio = 2)
+    else:
+        sim.set_pico(interleaved = True)
+    sim.set_channel('A')
+    sim.set_channel('B')
+    sim.run_until(25000)
+    capacity = sim.scope.buffer_interleaved.capacity
+    sim.scope.save_signals()
+    for letter in 'AB':
+        first_sample, samples = load_saved(sim.scope.saving_dir, letter)
+        assert first_sample == sim.scope.nextSample - capacity
+        np.testing.assert_array_equal(samples, sim.expected(letter, first_sample, capacity))
+        if aggregate:
+            np.testing.assert_array_equal(load_saved(sim.scope.saving_dir, letter, '_MIN')[1], samples)
+
+
+def test_save_intermediate_signals(sim):
+    sim.set_pico(interleaved = True)
+    sim.set_channel('A')
+    sim.set_channel('B')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    sim.scope.save_intermediate_signals('/part')
+    for letter in 'AB':
+        first_sample, samples = load_saved(sim.scope.saving_dir + '/part', letter)
+        assert first_sample == 0
+        np.testing.assert_array_equal(samples, sim.expected(letter, 0, 10000))
+    assert len(sim.scope.buffer_interleaved) == 0 # Marked as read
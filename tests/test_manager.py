@@ -0,0 +1,26 @@
+import json
+from datetime import datetime
+import numpy as np
+from pypicostreaming.manager import AcquisitionManager
+from pypicostreaming.simulator import SimulatedPs4000, SimulatedPs5000a
+
+
+def test_run_two_scopes(tmp_path):
+    manager = AcquisitionManager(str(tmp_path))
+    scopes = {'main' : (manager.open_device('main', '5000a', driver = SimulatedPs5000a()), 'PS5000A'),
+              'aux' : (manager.open_device('aux', '4000', driver = SimulatedPs4000()), 'PS4000')}
+    for name, (scope, prefix) in scopes.items():
+        scope.set_pico(1000, 20000, 1, prefix + '_US', manager.device_path(name))
+        scope.set_channel(prefix + '_CHANNEL_A', prefix + '_1V')
+    manager.run()
+
+    with open(manager.saving_dir + '/metadata_manager.json') as fp:
+        metadata = json.load(fp)
+    # The time of the start, not of the end of the acquisition
+    assert metadata['Starting time'] == manager.start_datetime.strftime('%d/%m/%Y %H:%M:%S')
+    assert manager.start_datetime <= datetime.now()
+    for name, (scope, _) in scopes.items():
+        assert metadata['Devices'][name]['Samples'] == scope.nextSample == 20000
+        timestamps = np.load(manager.saving_dir + f'/timestamps_{name}.npy')
+        assert timestamps[:, 2].sum() == 20000
+        assert (np.diff(timestamps[:, 0]) >= 0).all()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from pypicostreaming.ringbuffer import RingBuffer
+
+
+def test_signals_matrix_rows_are_the_channels(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.set_channel('B')
+    sim.scope.run_streaming_blocking(True)
+
+    matrix = sim.scope.get_signals_matrix()
+    assert matrix.shape == (2, 10000)
+    for row, letter in zip(matrix, 'AB', strict=True):
+        expected = sim.scope.convert_samples(sim.scope.channels[letter], sim.expected(letter, 0, 10000))
+        np.testing.assert_array_equal(row, expected)
+
+
+def test_convert_to_matrix_needs_one_signal_per_channel(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.set_channel('B')
+    with pytest.raises(ValueError):
+        sim.scope.convert_to_matrix([np.zeros(10, dtype=np.int16)])
+
+
+def test_read_between_the_pushes_of_a_callback(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.set_channel('B')
+    sim.scope.start_streaming(False)
+    sim.scope.stop()
+    ring_a, ring_b = (sim.scope.channels[letter].buffer_total for letter in 'AB')
+    a, b = sim.expected('A', 0, 300), sim.expected('B', 0, 300)
+    ring_a.push(a[:100])
+    ring_b.push(b[:100])
+    ring_a.push(a[100:200])
+    # Channel B of the second block not pushed yet
+    first = sim.scope.get_signals_matrix()
+    ring_b.push(b[100:200])
+    ring_a.push(a[200:])
+    ring_b.push(b[200:])
+    second = sim.scope.get_signals_matrix()
+
+    assert first.shape == (2, 100)
+    assert second.shape == (2, 200)
+    for i, (ch, raw) in enumerate(zip(sim.scope.channels.values(), (a, b), strict=True)):
+        np.testing.assert_array_equal(np.concatenate((first[i], second[i])), sim.scope.convert_samples(ch, raw))
+
+
+def test_ring_empty_until_stop():
+    ring = RingBuffer(10)
+    ring.push(np.arange(8, dtype=np.int16))
+    np.testing.assert_array_equal(ring.empty(5), np.arange(5))
+    ring.push(np.arange(8, 16, dtype=np.int16))
+    # 6 and 7 were not read, the samples before 6 are overwritten
+    np.testing.assert_array_equal(ring.empty(14), np.arange(6, 14))
+    np.testing.assert_array_equal(ring.empty(), [14, 15])
+    assert len(ring.empty(20)) == 0
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from pypicostreaming.reader import load_signal
+from pypicostreaming.ringbuffer import RingBuffer, RotatedSamples
+
+
+@pytest.mark.parametrize('n_samples', [0, 700, 1000, 2345, 5000])
+def test_finalize_orders_the_samples(tmp_path, n_samples):
+    file_name = str(tmp_path / 'channelA.npy')
+    ring = RingBuffer.open_memmap(file_name, 1000)
+    samples = np.arange(n_samples, dtype=np.int16)
+    for block in np.array_split(samples, 7):
+        ring.push(block)
+    ring.finalize()
+    np.testing.assert_array_equal(np.load(file_name), samples[-1000:])
+
+
+def test_push_after_finalize(tmp_path):
+    file_name = str(tmp_path / 'channelA.npy')
+    ring = RingBuffer.open_memmap(file_name, 1000)
+    ring.push(np.arange(1500, dtype=np.int16))
+    ring.finalize()
+    ring.push(np.arange(1500, 1800, dtype=np.int16))
+    np.testing.assert_array_equal(ring.snapshot()[1], np.arange(800, 1800))
+    ring.finalize()
+    np.testing.assert_array_equal(np.load(file_name), np.arange(800, 1800))
+
+
+def test_scope_finalizes_the_files(sim):
+    sim.set_pico(memmap = True)
+    sim.set_channel('A')
+    sim.run_until(25000)
+    ring = sim.scope.channels['A'].buffer_total
+    first_sample = ring.written - ring.capacity
+    channel = load_signal(sim.scope.saving_dir + '/channelA.npy')
+    assert channel.first_sample == first_sample
+    np.testing.assert_array_equal(channel.raw(), sim.expected('A', first_sample, ring.capacity))
+    # The file was not rotated: it holds the samples where the ring wrote them
+    offset = first_sample % ring.capacity
+    samples = np.load(sim.scope.saving_dir + '/channelA.npy')
+    np.testing.assert_array_equal(samples[offset:], sim.expected('A', first_sample, ring.capacity - offset))
+
+
+@pytest.mark.parametrize('n_samples', [0, 700, 1000, 2345, 5000])
+def test_finalize_without_rotation(tmp_path, n_samples):
+    file_name = str(tmp_path / 'channelA.npy')
+    ring = RingBuffer.open_memmap(file_name, 1000)
+    samples = np.arange(n_samples, dtype=np.int16)
+    for block in np.array_split(samples, 7):
+        ring.push(block)
+    offset = ring.finalize(rotate = False)
+    assert offset == (n_samples % 1000 if n_samples >= 1000 else 0)
+    rotated = RotatedSamples(np.load(file_name, mmap_mode='r'), offset)
+    expected = samples[-1000:]
+    assert len(rotated) == len(expected)
+    np.testing.assert_array_equal(rotated[:], expected)
+    for key in (slice(100, 500), slice(200, None), slice(-50, None), slice(None, None, 7), slice(10, 5)):
+        np.testing.assert_array_equal(rotated[key], expected[key])
+    if len(expected):
+        assert rotated[0] == expected[0] and rotated[-1] == expected[-1]
+        np.testing.assert_array_equal(np.asarray(rotated), expected)
@@ -0,0 +1,43 @@
+import threading
+from pypicostreaming.monitor import StreamMonitor
+
+
+def test_stats_while_recording():
+    # record runs on the driver callback thread while stats is read elsewhere
+    monitor = StreamMonitor({'A' : 0}, driver_buffer_size = 1000, window = 1e-3)
+    stop = threading.Event()
+    errors = []
+
+    def record():
+        index = 0
+        while not stop.is_set():
+            monitor.record(index, 10, index % 1000, 0)
+            index += 10
+
+    recorder = threading.Thread(target = record)
+    recorder.start()
+    try:
+        for _ in range(20000):
+            try:
+                monitor.stats()
+            except RuntimeError as error:
+                errors.append(error)
+                break
+    finally:
+        stop.set()
+        recorder.join()
+    assert errors == []
+    assert monitor.stats()['callbacks'] > 0
+
+
+def test_gaps_and_overflows():
+    monitor = StreamMonitor({'A' : 0, 'B' : 1}, driver_buffer_size = 100)
+    monitor.record(0, 50, 0, 0)
+    monitor.record(50, 30, 60, 0b10) # Should start at 50
+    monitor.record(80, 10, 90, 0)
+    stats = monitor.stats()
+    assert stats['samples'] == 90
+    assert stats['gap_count'] == 1
+    assert stats['gaps'] == [{'sample' : 50, 'start_index' : 60, 'expected_index' : 50}]
+    assert stats['overflow_count'] == {'A' : 0, 'B' : 1}
+    assert stats['overflow_samples'] == {'A' : [], 'B' : [50]}
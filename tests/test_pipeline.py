@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from pypicostreaming.pipeline import FFTStage, FunctionStage, Pipeline, Stage
+
+
+def test_stage_is_abstract():
+    with pytest.raises(TypeError):
+        Stage()
+
+
+def test_fft_stage_keeps_up_with_large_blocks():
+    stage = FFTStage('A', n_fft = 4096, max_results = 1000)
+    rng = np.random.default_rng(0)
+    signal = rng.integers(-1000, 1000, 20*50000).astype(np.int16)
+    for i in range(20):
+        stage.process(i*50000, {'A' : signal[i*50000:(i + 1)*50000]})
+    n_segments = len(signal)//4096
+    assert len(stage.results) == n_segments
+    assert len(stage._pending) == len(signal) - n_segments*4096
+    # Same spectra as one segment at a time
+    for i in (0, 12, n_segments - 1):
+        segment = signal[i*4096:(i + 1)*4096]
+        np.testing.assert_allclose(stage.results[i], np.abs(np.fft.rfft(segment*np.hanning(4096))))
+
+
+def test_pipeline_runs_the_stages_in_order():
+    calls = []
+    stage = FunctionStage(lambda start_sample, blocks: calls.append(start_sample) or start_sample)
+    pipeline = Pipeline([stage], policy = 'block')
+    for start in range(0, 1000, 100):
+        pipeline.put(start, {'A' : np.zeros(100, dtype=np.int16)})
+    pipeline.close()
+    assert calls == list(range(0, 1000, 100))
+    assert list(stage.results) == calls
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from pypicostreaming.process import ProcessPicoscope, SharedRingBuffer
+from pypicostreaming.simulator import SimulatedPs4000, SimulatedPs5000a
+
+
+SERIES = {
+    '5000a' : (('PS5000A_DR_16BIT',), SimulatedPs5000a, 'PS5000A'),
+    '4000' : ((), SimulatedPs4000, 'PS4000'),
+}
+
+
+def test_shared_ring_between_writer_and_reader():
+    ring = SharedRingBuffer.create(100)
+    reader = SharedRingBuffer.attach(*ring.descriptor())
+    try:
+        ring.push(np.arange(150, dtype=np.int16))
+        assert reader.written == 150
+        start, samples = reader.snapshot()
+        assert start == 50
+        np.testing.assert_array_equal(samples, np.arange(50, 150))
+        # The reader does not move the counter of the writer
+        reader.written = 0
+        assert ring.written == 150
+        del samples
+    finally:
+        reader.close()
+        ring.close(unlink = True)
+
+
+@pytest.mark.parametrize('series', list(SERIES))
+def test_process_mode(tmp_path, series):
+    args, driver_class, prefix = SERIES[series]
+    driver = driver_class()
+    scope = ProcessPicoscope(series, *args, driver = driver)
+    try:
+        scope.set_pico(1000, 10000, 1, prefix + '_US', str(tmp_path))
+        scope.set_channel(f'{prefix}_CHANNEL_A', prefix + '_1V')
+        scope.run_streaming_blocking(True)
+        assert scope.finished.is_set()
+
+        # Samples produced by the copy of the simulator in the child process
+        # (16 bit: same full scale as the class default)
+        table = driver._make_table(0, 1e-6)[0]
+        expected = table[np.arange(10000) % len(table)]
+        start, signals = scope.snapshot()
+        assert start == 0
+        np.testing.assert_array_equal(signals['A'], expected)
+        assert scope.snapshot_valid(start)
+        del signals
+
+        (values,) = scope.get_all_signals()
+        np.testing.assert_allclose(values, expected*scope.scales['A'], rtol = 1e-6)
+        # The samples are marked as read in the shared ring
+        assert len(scope.get_all_signals()[0]) == 0
+        assert scope.polling_statistics()['polls'] > 0
+
+        names = [ring.shm.name for ring in scope.rings.values()]
+    finally:
+        scope.close()
+    assert not scope._process.is_alive()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name = name)
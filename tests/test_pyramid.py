@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from pypicostreaming.pyramid import MinMaxPyramid
+
+
+def build(n_samples, factor = 4, levels = 5, seed = 0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-32767, 32768, n_samples, dtype=np.int16)
+    pyramid = MinMaxPyramid(factor, levels)
+    # Blocks of random sizes, so that the bins span several blocks
+    edges = np.sort(rng.integers(0, n_samples, 20))
+    for block in np.split(data, edges):
+        pyramid.push(block)
+    return data, pyramid
+
+
+def bin_size(pyramid, start, stop, pixels):
+    # Coarsest level with at least one bin per pixel, as envelope
+    level = 0
+    while level + 1 < pyramid.levels and pyramid.bin_size(level + 1) <= max(1, (stop - start)/pixels):
+        level += 1
+    return pyramid.bin_size(level)
+
+
+def check_envelope(data, pyramid, start, stop, pixels):
+    positions, low, high, mean = pyramid.envelope(start, stop, pixels)
+    size = bin_size(pyramid, start, stop, pixels)
+    # Only the complete bins are indexed
+    end = min(-(-stop//size), len(data)//size)*size
+    assert len(positions) <= pixels
+    assert positions[0] == start//size*size
+    for i, first in enumerate(positions):
+        last = positions[i + 1] if i + 1 < len(positions) else end
+        assert low[i] == data[first:last].min()
+        assert high[i] == data[first:last].max()
+        assert mean[i] == pytest.approx(data[first:last].mean(), rel = 1e-4, abs = 1e-2)
+
+
+@pytest.mark.parametrize('start, stop, pixels', [
+    (0, 100000, 100),         # Whole signal, merged bins
+    (12345, 67891, 50),       # Not on bin boundaries
+    (3, 17, 100),             # Fewer samples than pixels: level 0
+    (1001, 1030, 7),
+    (99000, 100000, 1000),    # Last bins
+    (0, 100000, 100000),      # One bin per pixel
+])
+def test_envelope_matches_brute_force(start, stop, pixels):
+    data, pyramid = build(100000)
+    check_envelope(data, pyramid, start, stop, pixels)
+
+
+def test_random_ranges():
+    data, pyramid = build(50000, factor = 8, levels = 4, seed = 1)
+    rng = np.random.default_rng(2)
+    for _ in range(200):
+        start, stop = np.sort(rng.integers(0, 50000 - 64, 2))
+        check_envelope(data, pyramid, int(start), int(stop) + 64, int(rng.integers(1, 500)))
+
+
+def test_save_and_load(tmp_path):
+    data, pyramid = build(30000)
+    pyramid.save(tmp_path / 'channelA_lod.npz')
+    loaded = MinMaxPyramid.load(tmp_path / 'channelA_lod.npz')
+    assert loaded.n_samples == 30000
+    for saved, read in zip(pyramid.envelope(123, 29000, 64), loaded.envelope(123, 29000, 64), strict=True):
+        np.testing.assert_array_equal(saved, read)
+
+
+def test_scope_index(sim):
+    sim.set_pico(pyramid = True)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(True)
+    data = sim.expected('A', 0, 10000)
+    loaded = MinMaxPyramid.load(sim.scope.saving_dir + '/channelA_lod.npz')
+    check_envelope(data, loaded, 1234, 8765, 40)
+    check_envelope(data, sim.scope.pyramid.pyramids[f'{sim.prefix}_CHANNEL_A'], 0, 10000, 10)
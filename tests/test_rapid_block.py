@@ -0,0 +1,32 @@
+import json
+import os
+import numpy as np
+
+
+def test_rapid_block_segments(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.scope.set_rapid_block(500, 20, 80, 10, f'{sim.prefix}_CHANNEL_A', 0.0, f'{sim.prefix}_RISING')
+    data, times = sim.scope.run_rapid_block(timeout = 5)
+
+    assert data.shape == (500, 1, 100)
+    assert len(times) == 500
+    assert times[0] == 0.0
+    if sim.prefix == 'PS4000':
+        # No time stamps of the segments with the PS4000 driver
+        assert np.isnan(times[1:]).all()
+    else:
+        assert (np.diff(times) > 0).all()
+        # Each segment starts where its time stamp says
+        first_sample = sim.driver._block['first_samples'][0]
+        for segment in (1, 250, 499):
+            start = first_sample + round(times[segment]/sim.scope.block_sample_step)
+            table = sim.driver._make_table(0, sim.scope.block_sample_step)[0]
+            np.testing.assert_array_equal(data[segment, 0], table[np.arange(start, start + 100) % len(table)])
+
+    sim.scope.save_segments('/rb')
+    with open(os.path.join(sim.scope.saving_dir + '/rb', 'rapid_block.json')) as fp:
+        header = json.load(fp)
+    assert header['Segments'] == 500
+    assert header['Trigger times (s)'][0] == 0.0
+    assert len(header['Trigger subsample offsets (s)']) == 500
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from pypicostreaming.archive import ArchiveReader
+from pypicostreaming.calibration import Calibration
+from pypicostreaming.reader import RunReader, load_signal
+
+
+def test_archive_after_wrap(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.run_until(25000)
+    sim.scope.save_archive()
+    start, _ = sim.scope.snapshot()
+    channel = RunReader(sim.scope.saving_dir, source = 'archive')['A']
+    assert channel.first_sample == start > 0
+    np.testing.assert_allclose(channel.time(slice(0, 3)), np.arange(start, start + 3)*sim.scope.sample_step)
+    np.testing.assert_array_equal(channel.raw(slice(0, 10000)), sim.expected('A', start, 10000))
+
+
+def test_streamed_archive(sim):
+    sim.set_pico(archive = True)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    channel = RunReader(sim.scope.saving_dir, source = 'archive')['A']
+    assert channel.first_sample == 0
+    assert len(channel) == 10000
+    np.testing.assert_array_equal(channel.raw(slice(0, 10000)), sim.expected('A', 0, 10000))
+
+
+@pytest.mark.parametrize('streamed', [False, True])
+def test_archive_scaled_with_calibration(sim, streamed):
+    sim.set_pico(archive = streamed)
+    sim.set_channel('A', calibration = Calibration(-1, 0.5, 2.0, polynomial = [0.1, 1.0, 0.0]))
+    sim.set_channel('B', conv_factor = 2.0)
+    sim.scope.run_streaming_blocking(autoStop = True)
+    if not streamed:
+        sim.scope.save_archive()
+    with ArchiveReader(sim.scope.saving_dir + '/channelA.pcarc') as reader:
+        np.testing.assert_array_equal(reader.read_scaled(0, 1000),
+                                      sim.scope.channels['A'].lut[sim.expected('A', 0, 1000).view(np.uint16)])
+    with ArchiveReader(sim.scope.saving_dir + '/channelB.pcarc') as reader:
+        assert reader.calibration is None
+        np.testing.assert_allclose(reader.read_scaled(0, 1000),
+                                   sim.expected('B', 0, 1000)*sim.scope.channel_scale(sim.scope.channels['B']),
+                                   rtol = 1e-6)
+
+
+@pytest.mark.parametrize('mode', ['save_signals', 'memmap', 'memmap copy'])
+def test_saved_signals_after_wrap(sim, mode):
+    sim.set_pico(memmap = mode != 'save_signals')
+    sim.set_channel('A', conv_factor = 2.0)
+    sim.run_until(25000)
+    subfolder_name = '/copy' if mode == 'memmap copy' else None
+    if mode != 'memmap':
+        sim.scope.save_signals(subfolder_name)
+    ring = sim.scope.channels['A'].buffer_total
+    start = ring.written - ring.capacity
+    assert start > 0
+    files_dir = sim.scope.saving_dir + (subfolder_name or '')
+    for channel in (RunReader(sim.scope.saving_dir, source = 'npy', subfolder_name = subfolder_name)['A'],
+                    load_signal(files_dir + '/channelA.npy')):
+        assert channel.first_sample == start
+        np.testing.assert_allclose(channel.time(slice(0, 3)), np.arange(start, start + 3)*sim.scope.sample_step)
+        np.testing.assert_array_equal(channel.raw(), sim.expected('A', start, ring.capacity))
+        np.testing.assert_allclose(channel[:10],
+                                   sim.expected('A', start, 10)*sim.scope.channel_scale(sim.scope.channels['A']),
+                                   rtol = 1e-6)
+
+
+def test_intermediate_signals(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    sim.scope.save_intermediate_signals('/part')
+    channel = RunReader(sim.scope.saving_dir, source = 'npy', subfolder_name = '/part')['A']
+    assert channel.first_sample == 0
+    np.testing.assert_array_equal(channel.raw(), sim.expected('A', 0, 10000))
+
+
+def test_stream(sim):
+    sim.set_pico(stream_to_disk = True)
+    sim.set_channel('A')
+    sim.run_until(25000)
+    channel = RunReader(sim.scope.saving_dir, source = 'stream')['A']
+    assert channel.first_sample == 0
+    assert len(channel) == sim.scope.nextSample
+    np.testing.assert_array_equal(channel.raw(), sim.expected('A', 0, len(channel)))
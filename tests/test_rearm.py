@@ -0,0 +1,53 @@
+import numpy as np
+from pypicostreaming.calibration import Calibration
+
+
+def count_set_channel(sim, monkeypatch):
+    '''
+    Channels set on the simulated driver from now on.
+    '''
+    calls = []
+    name = sim.prefix.lower() + 'SetChannel'
+    set_channel = getattr(sim.driver, name)
+    def counted(handle, channel, *args):
+        calls.append(channel)
+        return set_channel(handle, channel, *args)
+    monkeypatch.setattr(sim.driver, name, counted)
+    return calls
+
+
+def test_rearm_continuity(sim, monkeypatch):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    calls = count_set_channel(sim, monkeypatch)
+    for _ in range(2):
+        sim.scope.rearm(autoStop = True)
+        assert sim.scope.completed_event.wait(10)
+        assert sim.scope.nextSample == 10000
+        assert sim.scope.arm_latency() > 0
+        start, signals = sim.scope.snapshot()
+        assert start == 0
+        np.testing.assert_array_equal(signals[f'{sim.prefix}_CHANNEL_A'], sim.expected('A', 0, 10000))
+    assert calls == []
+
+
+def test_rearm_applies_changed_settings(sim, monkeypatch):
+    sim.set_pico()
+    sim.set_channel('A', calibration = Calibration())
+    sim.set_channel('B')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    calls = count_set_channel(sim, monkeypatch)
+    lut = sim.scope.channels['A'].lut
+    sim.scope.rearm(ranges = {f'{sim.prefix}_CHANNEL_A' : sim.prefix + '_2V',
+                              f'{sim.prefix}_CHANNEL_B' : sim.prefix + '_1V'},
+                    sampling_time = 2)
+    assert sim.scope.completed_event.wait(10)
+    # Only channel A has a new range
+    assert calls == [getattr(sim.driver, sim.prefix + '_CHANNEL')[f'{sim.prefix}_CHANNEL_A']]
+    assert sim.scope.channelInputRanges[sim.scope.channels['A'].vrange] == 2000
+    np.testing.assert_allclose(sim.scope.channels['A'].lut, 2*lut, rtol = 1e-6)
+    assert sim.scope.sample_step == 2e-6
+    assert sim.driver.sample_time == 2e-6
+    start, signals = sim.scope.snapshot()
+    np.testing.assert_array_equal(signals[f'{sim.prefix}_CHANNEL_A'], sim.expected('A', 0, 10000))
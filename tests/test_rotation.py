@@ -0,0 +1,24 @@
+import glob
+import json
+import numpy as np
+from pypicostreaming.writer import check_segments
+
+
+def test_open_ended_run_is_rotated_without_gaps(sim):
+    sim.set_pico(stream_to_disk = True, rotate_samples = 3000)
+    sim.set_channel('A')
+    sim.run_until(25000)
+    assert sim.scope.writer.dropped_blocks == 0
+
+    saving_dir = sim.scope.saving_dir
+    assert check_segments(saving_dir) == []
+    with open(saving_dir + '/segments.json') as fp:
+        segments = json.load(fp)['Segments']
+    assert len(segments) > 1
+    assert all(segment['Samples'] == 3000 for segment in segments[:-1])
+    # The segments concatenated are the whole stream
+    files = sorted(glob.glob(saving_dir + '/channelA_stream_*.npy'))
+    assert len(files) == len(segments)
+    samples = np.concatenate([np.load(file_name) for file_name in files])
+    assert len(samples) == sim.scope.nextSample == sum(segment['Samples'] for segment in segments)
+    np.testing.assert_array_equal(samples, sim.expected('A', 0, len(samples)))
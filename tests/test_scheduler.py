@@ -0,0 +1,42 @@
+import pytest
+from pypicostreaming.scheduler import PollScheduler
+
+
+def test_interval_from_fill_fraction():
+    scheduler = PollScheduler(1e-6, 10000, fill_fraction = 0.25)
+    assert scheduler.target_samples == 2500
+    assert scheduler.interval == pytest.approx(2.5e-3)
+
+
+@pytest.mark.parametrize('time_step, interval', [(1e-9, 1e-4), (10.0, 1.0)])
+def test_interval_is_limited(time_step, interval):
+    assert PollScheduler(time_step, 1000).interval == pytest.approx(interval)
+
+
+def test_sleep_after_callback():
+    scheduler = PollScheduler(1e-6, 10000)
+    assert scheduler.next_sleep(True, 100) == pytest.approx(5e-3)
+    # Behind schedule: poll again at once
+    assert scheduler.next_sleep(True, 5000) == 0.0
+    assert scheduler.data_polls == 2
+
+
+def test_backoff_doubles_up_to_the_interval():
+    scheduler = PollScheduler(1e-6, 10000, min_sleep = 1e-4)
+    sleeps = [scheduler.next_sleep(False) for _ in range(10)]
+    assert sleeps[:6] == pytest.approx([1e-4, 2e-4, 4e-4, 8e-4, 1.6e-3, 3.2e-3])
+    assert sleeps[6:] == pytest.approx([5e-3]*4)
+    # A callback starts the backoff again from min_sleep
+    scheduler.next_sleep(True, 100)
+    assert scheduler.next_sleep(False) == pytest.approx(1e-4)
+    assert scheduler.stats()['empty_polls'] == 11
+    assert scheduler.stats()['empty_poll_ratio'] == pytest.approx(11/12)
+
+
+def test_reset():
+    scheduler = PollScheduler(1e-6, 10000)
+    for _ in range(3):
+        scheduler.next_sleep(False)
+    scheduler.reset()
+    assert scheduler.polls == 0
+    assert scheduler.next_sleep(False) == pytest.approx(scheduler.min_sleep)
@@ -0,0 +1,29 @@
+import time
+import numpy as np
+
+
+def test_samples_are_produced_in_real_time(sim):
+    # 2000 samples of 100 us
+    sim.scope.set_pico(100, 2000, 100, sim.prefix + '_US', sim.saving_path)
+    sim.set_channel('A')
+    started = time.perf_counter()
+    sim.scope.run_streaming_blocking(autoStop = True)
+    elapsed = time.perf_counter() - started
+    assert sim.scope.nextSample == 2000
+    assert elapsed >= 0.2*0.9
+    assert 0 < sim.driver.copy_time < elapsed
+    assert sim.driver.lost_samples == 0
+
+
+def test_stall_loses_the_oldest_samples(sim):
+    sim.driver.driver_buffer_size = 2000
+    sim.set_pico(capture_size = 1000, samples_total = 100000)
+    sim.set_channel('A')
+    sim.driver.inject_stall(0.02)
+    sim.scope.run_streaming_blocking(autoStop = True)
+    # 20000 samples are produced during the stall, the driver keeps 2000
+    assert sim.driver.lost_samples >= 10000
+    assert sim.scope.nextSample + sim.driver.lost_samples == 100000
+    start, signals = sim.scope.snapshot(n = 1000)
+    np.testing.assert_array_equal(signals[f'{sim.prefix}_CHANNEL_A'],
+                                  sim.expected('A', 100000 - 1000, 1000))
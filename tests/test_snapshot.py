@@ -0,0 +1,56 @@
+import json
+import numpy as np
+import pytest
+from pypicostreaming.ringbuffer import RingBuffer
+
+
+def test_snapshot_valid_checks_the_min_buffers(sim):
+    sim.set_pico(ratio_mode = sim.prefix + '_RATIO_MODE_AGGREGATE', downsample_ratio = 2)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(autoStop = True)
+    start, signals = sim.scope.snapshot()
+    assert set(signals) == {sim.prefix + '_CHANNEL_A', sim.prefix + '_CHANNEL_A_MIN'}
+    assert sim.scope.snapshot_valid(start)
+    # Only the buffer of the minimum values wraps over the snapshot
+    ring_min = sim.scope.channels['A'].buffer_total_min
+    ring_min.push(np.zeros(ring_min.capacity//2, dtype=np.int16))
+    assert not sim.scope.snapshot_valid(start)
+
+
+def test_ring_wrap():
+    ring = RingBuffer(1000)
+    samples = np.arange(3456, dtype=np.int16)
+    for block in (samples[:700], samples[700:1300], samples[1300:3456]): # The last one is larger than the ring
+        ring.push(block)
+    assert ring.written == 3456
+    assert len(ring) == 1000
+    start, snapshot = ring.snapshot()
+    assert start == 2456
+    np.testing.assert_array_equal(snapshot, samples[-1000:])
+    start, window = ring.snapshot(start = 2900, stop = 3000)
+    np.testing.assert_array_equal(window, samples[2900:3000])
+    with pytest.raises(ValueError):
+        ring.snapshot(start = 2000)
+    assert ring.is_valid(2456) and not ring.is_valid(2455)
+    np.testing.assert_array_equal(ring.empty(), samples[-1000:])
+    assert len(ring) == 0
+    ring.push(samples[:10])
+    np.testing.assert_array_equal(ring.empty(), samples[:10])
+
+
+def test_save_signals_after_wrap(sim):
+    sim.set_pico()
+    sim.set_channel('A')
+    sim.set_channel('B', conv_factor = 2.0)
+    sim.run_until(25000)
+    sim.scope.save_signals()
+    start, signals = sim.scope.snapshot()
+    assert start == sim.scope.nextSample - 10000
+    for letter in 'AB':
+        with open(f'{sim.scope.saving_dir}/channel{letter}.json') as fp:
+            header = json.load(fp)
+        samples = np.load(f'{sim.scope.saving_dir}/channel{letter}.npy')
+        assert header['First sample'] == start
+        np.testing.assert_array_equal(samples, sim.expected(letter, start, 10000))
+        # The samples are not consumed
+        np.testing.assert_array_equal(signals[f'{sim.prefix}_CHANNEL_{letter}'], samples)
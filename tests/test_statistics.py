@@ -0,0 +1,15 @@
+import numpy as np
+
+
+def test_statistics_of_converted_samples(sim):
+    sim.set_pico(statistics = True)
+    sim.set_channel('A')
+    sim.scope.run_streaming_blocking(True)
+
+    expected = sim.scope.convert_samples(sim.scope.channels['A'], sim.expected('A', 0, 10000))
+    stats = sim.scope.statistics.stats()[f'{sim.prefix}_CHANNEL_A']
+    assert stats['count'] == 10000
+    np.testing.assert_allclose(stats['mean'], expected.mean(dtype=np.float64), rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(stats['std'], expected.std(dtype=np.float64), rtol=1e-5)
+    assert stats['min'] == float(expected.min())
+    assert stats['max'] == float(expected.max())
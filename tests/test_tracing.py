@@ -0,0 +1,15 @@
+from pypicostreaming.tracing import Tracer
+
+
+def test_ring_keeps_the_last_spans(tmp_path):
+    tracer = Tracer(capacity = 8)
+    for i in range(20):
+        tracer.record('poll' if i % 2 else 'callback', 1000*i, 1000*i + 10*i)
+    events = tracer.chrome_trace()['traceEvents']
+    assert len(events) == 8
+    assert [event['dur'] for event in events] == [10*i/1e3 for i in range(12, 20)]
+    summary = tracer.summary()
+    assert summary['poll']['count'] == summary['callback']['count'] == 4
+    assert summary['poll']['max_us'] == 19*10/1e3
+    tracer.save_chrome_trace(str(tmp_path / 'trace.json'))
+    assert (tmp_path / 'trace.json').stat().st_size > 0
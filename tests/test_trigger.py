@@ -0,0 +1,40 @@
+import json
+import threading
+import numpy as np
+import pytest
+from pypicostreaming import trigger
+from pypicostreaming.trigger import Condition, Edge, EventDetector, EventStore
+
+
+def test_condition_is_abstract():
+    with pytest.raises(TypeError):
+        Condition()
+
+
+def test_events_are_written_off_the_callback_thread(tmp_path, monkeypatch):
+    threads = []
+    savez = np.savez
+
+    def record_thread(*args, **kwargs):
+        threads.append(threading.current_thread())
+        savez(*args, **kwargs)
+
+    monkeypatch.setattr(trigger.np, 'savez', record_thread)
+    signal = np.zeros(5000, dtype=np.int16)
+    signal[[1000, 2500, 4990]] = 100 # The last window is not complete at the end
+    store = EventStore(str(tmp_path))
+    detector = EventDetector(Edge('A', 50), pre = 20, post = 30, store = store)
+    for start in range(0, 5000, 700): # The windows cross the blocks
+        detector.put(start, {'A' : signal[start:start + 700]})
+    detector.close()
+
+    assert threads and threading.current_thread() not in threads
+    with open(tmp_path / 'events.json') as fp:
+        assert json.load(fp)['Trigger samples'] == [1000, 2500, 4990]
+    for i, trigger_sample in enumerate((1000, 2500)):
+        event = np.load(tmp_path / f'event_{i:06d}.npz')
+        assert event['trigger_sample'] == trigger_sample
+        assert event['first_sample'] == trigger_sample - 20
+        np.testing.assert_array_equal(event['A'], signal[trigger_sample - 20:trigger_sample + 30])
+    last = np.load(tmp_path / 'event_000002.npz')['A']
+    np.testing.assert_array_equal(last[:30], signal[4970:])
@@ -0,0 +1,137 @@
+import errno
+import json
+import threading
+import numpy as np
+import pytest
+from pypicostreaming.writer import ChunkedWriter, check_segments
+
+
+def blocked_writer(saving_dir):
+    '''
+    Writer with a queue of one block whose thread waits for release before
+    writing, so that the next blocks fill the queue and are dropped.
+    '''
+    writer = ChunkedWriter(saving_dir, queue_depth = 1)
+    entered = threading.Event()
+    release = threading.Event()
+    write_blocks = writer._write_blocks
+
+    def wait_then_write(blocks):
+        entered.set()
+        release.wait()
+        write_blocks(blocks)
+
+    writer._write_blocks = wait_then_write
+    return writer, entered, release
+
+
+def block(start, n = 100):
+    return {'PS5000A_CHANNEL_A' : np.arange(start, start + n, dtype=np.int16)}
+
+
+def test_drops_are_recorded(tmp_path):
+    writer, entered, release = blocked_writer(str(tmp_path))
+    writer.put(0, block(0))
+    assert entered.wait(5)
+    writer.put(100, block(100)) # Queued
+    writer.put(200, block(200)) # Dropped
+    writer.put(300, block(300)) # Dropped
+    release.set()
+    writer.close()
+
+    assert writer.dropped_blocks == 2
+    assert writer.dropped_samples == 200
+    with open(tmp_path / 'stream.json') as fp:
+        sidecar = json.load(fp)
+    assert sidecar['First sample'] == 0
+    assert sidecar['Samples'] == 200
+    assert sidecar['Drops'] == [{'First sample' : 200, 'Samples' : 100},
+                                {'First sample' : 300, 'Samples' : 100}]
+    np.testing.assert_array_equal(np.load(tmp_path / 'channelA_stream.npy'), np.arange(200))
+
+
+def test_gap_after_drop_is_recorded(tmp_path):
+    writer, entered, release = blocked_writer(str(tmp_path))
+    writer.put(0, block(0))
+    assert entered.wait(5)
+    writer.put(100, block(100))
+    writer.put(200, block(200)) # Dropped
+    release.set()
+    while not writer.queue.empty():
+        threading.Event().wait(1e-3)
+    writer.put(300, block(300))
+    writer.close()
+
+    with open(tmp_path / 'stream.json') as fp:
+        sidecar = json.load(fp)
+    assert sidecar['Gaps'] == [{'First missing sample' : 200, 'Missing samples' : 100}]
+    assert sidecar['Drops'] == [{'First sample' : 200, 'Samples' : 100}]
+    assert sidecar['Samples'] == 300
+
+
+def test_rotation_without_drops(tmp_path):
+    writer = ChunkedWriter(str(tmp_path), rotate_samples = 150, drop_when_full = False)
+    for start in range(0, 500, 100):
+        writer.put(start, block(start))
+    writer.close()
+
+    with open(tmp_path / 'segments.json') as fp:
+        index = json.load(fp)
+    assert [segment['Samples'] for segment in index['Segments']] == [150, 150, 150, 50]
+    assert index['Drops'] == []
+    assert index['Dropped blocks'] == 0
+    assert check_segments(str(tmp_path)) == []
+
+
+def failing_writer(saving_dir, fail_at, **kwargs):
+    '''
+    Writer whose writes fail with ENOSPC from the block starting at fail_at.
+    '''
+    writer = ChunkedWriter(saving_dir, queue_depth = 1, **kwargs)
+    write_blocks = writer._write_blocks
+
+    def write_or_fail(blocks):
+        if writer.next_sample >= fail_at:
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        write_blocks(blocks)
+
+    writer._write_blocks = write_or_fail
+    return writer
+
+
+@pytest.mark.parametrize('rotate_samples', [None, 150])
+def test_write_error_does_not_block_put(tmp_path, rotate_samples):
+    writer = failing_writer(str(tmp_path), 200, drop_when_full = False, rotate_samples = rotate_samples)
+    done = threading.Event()
+
+    def put_blocks():
+        for start in range(0, 1000, 100):
+            writer.put(start, block(start))
+        done.set()
+
+    threading.Thread(target=put_blocks, daemon=True).start()
+    assert done.wait(5)
+    with pytest.raises(OSError) as raised:
+        writer.close()
+    assert raised.value.errno == errno.ENOSPC
+
+    assert writer.dropped_samples == 800
+    with open(tmp_path / ('segments.json' if rotate_samples else 'stream.json')) as fp:
+        metadata = json.load(fp)
+    assert metadata['Dropped samples'] == 800
+    assert 'No space left on device' in metadata['Error']
+    assert sorted(drop['First sample'] for drop in metadata['Drops']) == list(range(200, 1000, 100))
+
+
+def test_scope_completes_after_write_error(sim, monkeypatch):
+    sim.set_pico(stream_to_disk = True)
+    sim.set_channel('A')
+    monkeypatch.setattr(sim.scope.writer, '_write_blocks', _fail)
+    with pytest.raises(OSError):
+        sim.scope.run_streaming_blocking(True)
+    assert sim.scope.completed_event.is_set()
+    assert 'Error' in sim.scope.load_metadata()['Stream to disk']
+
+
+def _fail(blocks):
+    raise OSError(errno.EACCES, 'Permission denied')